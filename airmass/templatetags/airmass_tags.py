@@ -17,6 +17,8 @@ import numpy as np
 import time
 from django.contrib.auth.models import User
 from guardian.shortcuts import get_objects_for_user
+from custom_code.visibility import get_24hr_visibility
+from custom_code.spectra import spectrum_arrays
 import logging
 
 logger = logging.getLogger(__name__)
@@ -47,68 +49,21 @@ def airmass_plot(context):
 
 def get_24hr_airmass(target, interval, airmass_limit):
 
-    plot_data = []
-    
-    start = Time(datetime.datetime.utcnow())
-    end = Time(start.datetime + datetime.timedelta(days=1))
-    time_range = time_grid_from_range(
-        time_range = [start, end],
-        time_resolution = interval*u.minute)
-    time_plot = time_range.datetime
-    
-    fixed_target = FixedTarget(name = target.name, 
-        coord = SkyCoord(
-            target.ra,
-            target.dec,
-            unit = 'deg'
-        )
+    sites, time_plot, airmass = get_24hr_visibility(
+        target.ra, target.dec, interval, airmass_limit,
+        sun_alt_limit=-18.0, #between astro twilights
+        halimit=None
     )
 
-    #Hack to speed calculation up by factor of ~3
-    sun_coords = get_sun(time_range[int(len(time_range)/2)])
-    fixed_sun = FixedTarget(name = 'sun',
-        coord = SkyCoord(
-            sun_coords.ra,
-            sun_coords.dec,
-            unit = 'deg'
+    plot_data = []
+    for i, site in enumerate(sites.names):
+        label = '({facility}) {site}'.format(
+            facility = sites.facility, site = site
         )
-    )
-
-    for observing_facility in facility.get_service_classes():
 
-        if observing_facility != 'LCO':
-            continue
-
-        observing_facility_class = facility.get_service_class(observing_facility)
-        sites = observing_facility_class().get_observing_sites()
-
-        for site, site_details in sites.items():
-
-            observer = Observer(
-                longitude = site_details.get('longitude')*u.deg,
-                latitude = site_details.get('latitude')*u.deg,
-                elevation = site_details.get('elevation')*u.m
-            )
-            
-            sun_alt = observer.altaz(time_range, fixed_sun).alt
-            obj_airmass = observer.altaz(time_range, fixed_target).secz
-
-            bad_indices = np.argwhere(
-                (obj_airmass >= airmass_limit) |
-                (obj_airmass <= 1) |
-                (sun_alt > -18*u.deg)  #between astro twilights
-            )
-
-            obj_airmass = [np.nan if i in bad_indices else float(x)
-                for i, x in enumerate(obj_airmass)]
-
-            label = '({facility}) {site}'.format(
-                facility = observing_facility, site = site
-            )
-
-            plot_data.append(
-                go.Scatter(x=time_plot, y=obj_airmass, mode='lines', name=label, )
-            )
+        plot_data.append(
+            go.Scatter(x=time_plot, y=airmass[0, i], mode='lines', name=label, )
+        )
 
     return plot_data
 
@@ -178,13 +133,8 @@ def spectra_plot(target, dataproduct=None):
     if dataproduct:
         spectral_dataproducts = DataProduct.objects.get(dataproduct=dataproduct)
     for spectrum in spectral_dataproducts:
-        datum = spectrum.value
-        wavelength = []
-        flux = []
         name = str(spectrum.timestamp).split(' ')[0]
-        for key, value in datum.items():
-            wavelength.append(value['wavelength'])
-            flux.append(float(value['flux']))
+        wavelength, flux = spectrum_arrays(spectrum.value)
         spectra.append((wavelength, flux, name))
     plot_data = [
         go.Scatter(
@@ -1,3 +1,4 @@
+import dash
 import dash_core_components as dcc
 import dash_bootstrap_components as dbc
 from dash import html
@@ -11,15 +12,18 @@ from django.conf import settings
 from django.contrib.auth.models import User
 from tom_targets.models import Target
 from custom_code.models import ReducedDatumExtra, Papers
+from custom_code import times
+from custom_code.photometry import decimate, group_by_filter, load_photometry
 import logging
 from django.templatetags.static import static
-from datetime import datetime, timezone
-from astropy.time import Time
 from dash import no_update
 from guardian.shortcuts import get_objects_for_user
 
 logger = logging.getLogger(__name__)
 
+# Upper bound on the photometry points sent to the browser per figure
+LIGHTCURVE_MAX_POINTS = getattr(settings, 'LIGHTCURVE_MAX_POINTS', 3000)
+
 app = DjangoDash(name='Lightcurve', add_bootstrap_links=True)
 app.css.append_css({'external_url': static('custom_code/css/dash.css')})
 telescopes = ['LCO']
@@ -255,6 +259,34 @@ def update_algorithm_value(selected_subtraction):
 def update_template_value(selected_subtraction):
     return ['LCO', 'SDSS', 'PS1']
 
+def hover_text(timestamps):
+    """
+    Returns the hover labels of the points, like 05/21/2024 (MJD 60451.18)
+    """
+    mjds = np.round(times.mjd(timestamps), 2).astype(str)
+    return np.char.add(np.char.add(np.char.add(times.mdy(timestamps), ' (MJD '), mjds), ')')
+
+def zoom_window(relayout_data):
+    """
+    Returns the x-axis range (in days ago) after a zoom or pan, None
+    after the axes are reset, and False for relayouts that leave
+    the x axis as it is
+    """
+    if not relayout_data:
+        return False
+    if 'xaxis.range[0]' in relayout_data and 'xaxis.range[1]' in relayout_data:
+        x_range = (relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]'])
+    elif 'xaxis.range' in relayout_data:
+        x_range = tuple(relayout_data['xaxis.range'])
+    elif relayout_data.get('xaxis.autorange'):
+        return None
+    else:
+        return False
+    try:
+        return tuple(float(x) for x in x_range)
+    except (TypeError, ValueError):
+        return False
+
 @app.callback(
         Output('lightcurve-plot', 'figure'),
         [Input('telescopes-checklist', 'value'),
@@ -268,8 +300,9 @@ def update_template_value(selected_subtraction):
          Input('reducer-group-checklist', 'value'),
          Input('target_id', 'value'),
          Input('user_id', 'value'),
-         Input('plot-height', 'value')])
-def update_graph(selected_telescope, subtracted_value, selected_algorithm, selected_template, selected_photometry_type, reduction_type, final_reduction_value, selected_paper, selected_groups, target_id, user_id, height):
+         Input('plot-height', 'value'),
+         Input('lightcurve-plot', 'relayoutData')])
+def update_graph(selected_telescope, subtracted_value, selected_algorithm, selected_template, selected_photometry_type, reduction_type, final_reduction_value, selected_paper, selected_groups, target_id, user_id, height, relayout_data):
     def get_color(filter_name, filter_translate):
         colors = {'U': 'rgb(59,0,113)',
             'u': 'rgb(59,0,113)',
@@ -293,6 +326,15 @@ def update_graph(selected_telescope, subtracted_value, selected_algorithm, selec
         except: color = colors['other']
         return color
 
+    ### Zooming refetches the points in the visible window at full resolution,
+    ### other relayouts (resizing, y-axis only) leave the figure alone
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    window = zoom_window(relayout_data)
+    if triggered == ['lightcurve-plot.relayoutData'] and window is False:
+        return no_update
+    if 'lightcurve-plot.relayoutData' not in triggered:
+        window = None
+
     logger.info('Plotting dash lightcurve for target %s', target_id)
 
     filter_translate = {'U': 'U', 'B': 'B', 'V': 'V', 'R': 'R', 'I': 'I',
@@ -364,48 +406,42 @@ def update_graph(selected_telescope, subtracted_value, selected_algorithm, selec
     spec = get_objects_for_user(user, 'tom_dataproducts.view_reduceddatum',
                                 klass=ReducedDatum.objects.filter(
                                     target=target, data_type='spectroscopy'))
+    spec_timestamps = list(spec.values_list('timestamp', flat=True))
         
-    for data in datums:
-        for rd in data:
-            value = rd.value
-            if not value:
-                continue
-            if isinstance(value, str):
-                value = json.loads(value)
-
-            ### Check if the value contains a magnitude (may not if the entry is 9999 in snex1)
-            if not value.get('magnitude', ''):
-                continue
-
-            ### Get subtracted or unsubtracted data
-            if value.get('background_subtracted', '') == True:
-                if value.get('subtraction_algorithm', '') in selected_algorithm and value.get('template_source', '') in selected_template and reduction_type == 'manual':
-                    
-                    raw_filter = value.get('filter', '')
-                    subtracted_filt = filter_translate.get(raw_filter, raw_filter or 'other')
-
-                    subtracted_photometry_data.setdefault(subtracted_filt, {})
-                    subtracted_photometry_data[subtracted_filt].setdefault('time', []).append(rd.timestamp)
-                    subtracted_photometry_data[subtracted_filt].setdefault('magnitude', []).append(value.get('magnitude',None))
-                    subtracted_photometry_data[subtracted_filt].setdefault('error', []).append(value.get('error', None))
-            elif value.get('reduction_type', '') == reduction_type or reduction_type == 'all':
-
-                raw_filter = value.get('filter', '')
-                filt = filter_translate.get(raw_filter, raw_filter or 'other')
-
-                photometry_data.setdefault(filt, {})
-                photometry_data[filt].setdefault('time', []).append(rd.timestamp)
-                photometry_data[filt].setdefault('magnitude', []).append(value.get('magnitude',None))
-                photometry_data[filt].setdefault('error', []).append(value.get('error', None))
+    photometry = np.concatenate([load_photometry(data) for data in datums])
+
+    ### Get subtracted or unsubtracted data
+    subtracted = photometry['background_subtracted']
+    selected_subtracted = subtracted & np.isin(photometry['subtraction_algorithm'], selected_algorithm) & np.isin(photometry['template_source'], selected_template)
+    if reduction_type != 'manual':
+        selected_subtracted[:] = False
+    selected_unsubtracted = ~subtracted
+    if reduction_type != 'all':
+        selected_unsubtracted &= photometry['reduction_type'] == reduction_type
+
+    group_default = lambda raw_filter: raw_filter or 'other'
+    photometry_data = group_by_filter(photometry[selected_unsubtracted], filter_translate, default=group_default)
+    subtracted_photometry_data = group_by_filter(photometry[selected_subtracted], filter_translate, default=group_default)
 
     if subtracted_value == 'Unsubtracted':
         selected_photometry = photometry_data
     elif subtracted_value == 'Subtracted':
         selected_photometry = subtracted_photometry_data
 
+    ### Send a bounded number of points, over the zoomed window if there is one
+    now = times.utcnow()
+    start = end = None
+    if window:
+        start, end = times.from_days_ago([max(window), min(window)], now)
+    max_points = max(LIGHTCURVE_MAX_POINTS // max(len(selected_photometry), 1), 2)
+    plotted_photometry = {
+        filter_name: decimate(filter_values, max_points, start, end)
+        for filter_name, filter_values in selected_photometry.items()
+    }
+
     plot_data = [
         go.Scatter(
-            x=[(datetime.now(timezone.utc) - t.replace(tzinfo=timezone.utc)).total_seconds()/(24*3600) for t in filter_values['time']],
+            x=times.days_ago(filter_values['timestamp'], now),
             y=filter_values['magnitude'], 
             mode='markers',
             marker=dict(color=get_color(filter_name, filter_translate),
@@ -418,8 +454,8 @@ def update_graph(selected_telescope, subtracted_value, selected_algorithm, selec
                 visible=True,
                 color=get_color(filter_name, filter_translate)
             ),
-            text=['{} (MJD {})'.format(t.strftime('%m/%d/%Y'), str(round(Time(t).mjd, 2))) for t in filter_values['time']],
-        ) for filter_name, filter_values in selected_photometry.items()]
+            text=hover_text(filter_values['timestamp']),
+        ) for filter_name, filter_values in plotted_photometry.items()]
 
     redshift = target.redshift
     if redshift == None:
@@ -428,12 +464,12 @@ def update_graph(selected_telescope, subtracted_value, selected_algorithm, selec
         ydata = []
         for filter_name, filter_values in selected_photometry.items():
             if filter_name is not None:
-                ydata.append(np.asarray(filter_values['magnitude']) + np.asarray(filter_values['error']))
-                ydata.append(np.asarray(filter_values['magnitude']) - np.asarray(filter_values['error']))
+                ydata.append(filter_values['magnitude'] + filter_values['error'])
+                ydata.append(filter_values['magnitude'] - filter_values['error'])
         if ydata:
             ydata = np.concatenate(ydata)
-            ymin = np.min(ydata)
-            ymax = np.max(ydata)
+            ymin = np.nanmin(ydata)
+            ymax = np.nanmax(ydata)
             ymin_view = ymin - 0.05 * (ymax-ymin)
             ymax_view = ymax + 0.05 * (ymax-ymin)
         else:
@@ -463,6 +499,10 @@ def update_graph(selected_telescope, subtracted_value, selected_algorithm, selec
         height=height,
         hovermode='closest',
         plot_bgcolor='white',
+        # Keep the zoom when the refined points come back, reset it when the options change
+        uirevision=json.dumps([selected_telescope, subtracted_value, selected_algorithm, selected_template,
+                               selected_photometry_type, reduction_type, final_reduction_value,
+                               selected_paper, selected_groups, target_id]),
         shapes=[
             dict(
                 type='line',
@@ -470,21 +510,25 @@ def update_graph(selected_telescope, subtracted_value, selected_algorithm, selec
                 y0=0,
                 y1=1,
                 xref='x',
-                x0=(datetime.now(timezone.utc) - s.timestamp.replace(tzinfo=timezone.utc)).total_seconds()/(24*3600),
-                x1=(datetime.now(timezone.utc) - s.timestamp.replace(tzinfo=timezone.utc)).total_seconds()/(24*3600),
+                x0=spec_days,
+                x1=spec_days,
                 opacity=0.2,
                 line=dict(color='black', dash='dash'),
-            ) for s in spec] + [{'type': 'line', 'yref': 'paper', 'y0': 0, 'y1': 1, 'xref': 'x',
+            ) for spec_days in times.days_ago(spec_timestamps, now).tolist()] + [{'type': 'line', 'yref': 'paper', 'y0': 0, 'y1': 1, 'xref': 'x',
                                  'x0': 0.0, 'x1': 0.0, 'opacity': 0.001,
                                  'line': {'color': 'black', 'dash': 'dash'}
                             }] #Have to put this in so plotly doesn't autofit the axes after zoom
     )
 
     ### Set the minimum x-axis range to one day
-    min_xs = [min(filter_values['time']) for filter_values in selected_photometry.values()]
+    min_xs = [filter_values['timestamp'].min() for filter_values in selected_photometry.values()]
 
-    if len(min_xs) > 0:# and len(max_xs) > 0:
-        layout['xaxis']['range'] = [(datetime.now(timezone.utc) - min(min_xs).replace(tzinfo=timezone.utc)).total_seconds()/(24*3600)*1.06, 0]
+    if window:
+        layout['xaxis']['range'] = list(window)
+        layout['xaxis']['autorange'] = False
+        layout['xaxis']['title'] = 'Days Ago'
+    elif len(min_xs) > 0:# and len(max_xs) > 0:
+        layout['xaxis']['range'] = [float(times.days_ago(min(min_xs), now)[0])*1.06, 0]
         layout['xaxis']['autorange'] = False
         layout['xaxis']['title'] = 'Days Ago'
 
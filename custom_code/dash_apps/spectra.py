@@ -6,7 +6,6 @@ import dash_core_components as dcc
 import dash_html_components as html
 import plotly.graph_objs as go
 import numpy as np
-import json
 from guardian.shortcuts import get_objects_for_user
 from tom_targets.models import Target
 from django.contrib.auth.models import User
@@ -19,10 +18,10 @@ logger = logging.getLogger(__name__)
 
 from django_plotly_dash import DjangoDash
 from tom_dataproducts.models import ReducedDatum
-from custom_code.templatetags.custom_code_tags import bin_spectra
+from custom_code import spectrum_cache
 from django.templatetags.static import static
 import matplotlib.pyplot as plt
-from custom_code.dash_apps.spectra_utils import elements, calculate_flux_range
+from custom_code.dash_apps.spectra_utils import elements, calculate_flux_range, line_overlay_js
 
 external_stylesheets = [dbc.themes.BOOTSTRAP]
 
@@ -120,16 +119,21 @@ for elem in list(elements.keys())[9:]:
     elem_input_array.append(row)
 table_body_two =[html.Tbody(elem_input_array)]
 
+figure_layout = {'height': 350,
+                 'margin': {'l': 60, 'b': 30, 'r': 60, 't': 10},
+                 'yaxis': {'type': 'linear', 'tickformat': '.1e'},
+                 'xaxis': {'showgrid': False},
+                 'uirevision': 'spectra'
+                 }
+
 app.layout = html.Div([
     dcc.Graph(id='table-editing-simple-output',
-              figure = {'layout' : {'height': 350,
-                                    'margin': {'l': 60, 'b': 30, 'r': 60, 't': 10},
-                                    'yaxis': {'type': 'linear', 'tickformat': '.1e'},
-                                    'xaxis': {'showgrid': False}
-                                    },
+              figure = {'layout' : figure_layout,
                         'data' : []#[go.Scatter({'x': [], 'y': []})]
                     }
     ),
+    # Spectrum traces and flux range, the element lines are drawn client side
+    dcc.Store(id='spectrum-store'),
     html.Div([
         dcc.Input(id='target_id', type='hidden', value=0),
         dcc.Input(id='user_id', type='hidden', value=0),
@@ -141,11 +145,6 @@ app.layout = html.Div([
             options=[{'label': 'Show line plotting interface', 'value': 'display'}],
             value=''
         ),
-        html.Div(
-            children=[],
-            id='checked-rows',
-            style={'display': 'none'}
-        ),
         html.Div(
             children=[
                 dbc.Row([
@@ -181,25 +180,10 @@ def show_table(value, *args, **kwargs):
 line_plotting_input = [Input('standalone-checkbox-'+elem.replace(' ', '-'), 'value') for elem in elements]
 line_plotting_input += [Input('v-'+elem.replace(' ', '-'), 'value') for elem in elements]
 line_plotting_input += [Input('z-'+elem.replace(' ', '-'), 'value') for elem in elements]
-@app.callback(
-    Output('checked-rows', 'children'),
-    line_plotting_input)
-def checked_boxes(*args, **kwargs):
-    
-    all_rows = [item for item in line_plotting_input if 'standalone-checkbox' in item.component_id]
-    velocity_rows = [item for item in line_plotting_input if 'v-' in item.component_id]
-    redshift_rows = [item for item in line_plotting_input if 'z-' in item.component_id]
-    
-    checked_rows = []
-    for i in range(len(all_rows)):
-        if args[i]:
-            elem = list(elements.keys())[i]
-            checked_rows.append(json.dumps({elem: {'redshift': args[i+2*len(all_rows)],
-                                                   'velocity': args[i+len(all_rows)]
-                                                }
-                                            })
-                                        )
-    return checked_rows
+app.clientside_callback(
+    line_overlay_js(),
+    Output('table-editing-simple-output', 'figure'),
+    [Input('spectrum-store', 'data')] + line_plotting_input)
 
 @app.callback(
     Output('table-container-div', 'children'),
@@ -299,113 +283,45 @@ def change_redshift(z, *args, **kwargs):
         ]
 
 @app.expanded_callback(
-    Output('table-editing-simple-output', 'figure'),
-    [Input('checked-rows', 'children'),
-     Input('target_id', 'value'),
+    Output('spectrum-store', 'data'),
+    [Input('target_id', 'value'),
      Input('user_id', 'value'),
      Input('min-flux', 'value'),
-     Input('max-flux', 'value'),
-     State('table-editing-simple-output', 'figure')])
-def display_output(selected_rows,
-                   #selected_row_ids, columns, 
-                   target_id, user_id, min_flux, max_flux, fig_data, *args, **kwargs):
+     Input('max-flux', 'value')])
+def display_output(target_id, user_id, min_flux, max_flux, *args, **kwargs):
     # Improvements:
-    #   Fix dataproducts so they're correctly serialized
     #   Correctly display message when there are no spectra
     
     user = User.objects.get(id=user_id)
     target = Target.objects.get(id=target_id)
 
-    if isinstance(fig_data, dict):
-        graph_data = {'data': fig_data['data'],
-                      'layout': fig_data['layout']}
-    else:
-        graph_data = {'data': [],
-                      'layout': []}
+    graph_data = {'data': [],
+                  'layout': figure_layout}
 
-    # If the page just loaded, plot all the spectra
-    spectral_dataproducts = get_objects_for_user(user, 'tom_dataproducts.view_reduceddatum', klass=ReducedDatum.objects.filter(
-                                                         target=target, data_type='spectroscopy')).order_by('timestamp')
-    if not spectral_dataproducts:
-        return 'No spectra yet'
+    spectrum_ids = list(get_objects_for_user(user, 'tom_dataproducts.view_reduceddatum', klass=ReducedDatum.objects.filter(
+                                                         target=target, data_type='spectroscopy')).order_by('timestamp').values_list('id', flat=True))
 
-    if not fig_data['data']:
-        colormap = plt.cm.gist_rainbow
-        colors = [colormap(i) for i in np.linspace(0.99, 0., len(spectral_dataproducts))]
-        rgb_colors = ['rgb({r}, {g}, {b})'.format(
-            r=int(color[0]*255),
-            g=int(color[1]*255),
-            b=int(color[2]*255),
-        ) for color in colors]
-        all_data = []
-        for i in range(len(spectral_dataproducts)):
-            spectrum = spectral_dataproducts[i]
-            datum = spectrum.value
-            wavelength = []
-            flux = []
-            name = str(spectrum.timestamp).split(' ')[0]
-            if datum.get('photon_flux'):
-                wavelength = datum.get('wavelength')
-                flux = datum.get('photon_flux')
-            elif datum.get('flux'):
-                wavelength = datum.get('wavelength')
-                flux = datum.get('flux')
-            else:
-                for key, value in datum.items():
-                    wavelength.append(float(value['wavelength']))
-                    flux.append(float(value['flux']))
-            
-            binned_wavelength, binned_flux = bin_spectra(wavelength, flux, 5)
-            scatter_obj = go.Scatter(
-                x=binned_wavelength,
-                y=binned_flux,
-                name=name,
-                line_color=rgb_colors[i]
-            )
-            graph_data['data'].append(scatter_obj)
+    spectral_dataproducts = list(spectrum_cache.get_spectra(spectrum_ids).values())
+    colormap = plt.cm.gist_rainbow
+    colors = [colormap(i) for i in np.linspace(0.99, 0., len(spectral_dataproducts))]
+    rgb_colors = ['rgb({r}, {g}, {b})'.format(
+        r=int(color[0]*255),
+        g=int(color[1]*255),
+        b=int(color[2]*255),
+    ) for color in colors]
+    for i in range(len(spectral_dataproducts)):
+        spectrum = spectral_dataproducts[i]
+        name = str(spectrum.timestamp).split(' ')[0]
+        binned_wavelength, binned_flux = spectrum_cache.binned(spectrum, 5)
+        scatter_obj = go.Scatter(
+            x=binned_wavelength,
+            y=binned_flux,
+            name=name,
+            line_color=rgb_colors[i]
+        )
+        graph_data['data'].append(scatter_obj)
 
-    for d in reversed(fig_data['data']):
-        if d['name'] in elements:
-            # Remove all the element lines that were plotted last time
-            fig_data['data'].remove(d)
-    
-    # Calculate actual min/max flux from spectrum data (not element lines)
+    # Calculate actual min/max flux from spectrum data, which sets the height of the element lines
     actual_min_flux, actual_max_flux = calculate_flux_range(graph_data, min_flux, max_flux)
-    
-    for row in selected_rows:
-        for elem, row_extras in json.loads(row).items():
-            z = row_extras['redshift']
-            if not z:
-                z = 0
-            v = row_extras['velocity']
-            if not v:
-                v = 0
-            try:
-                v_over_c = float(v/(3e5))
-            except:
-                v_over_c = 0
-            
-            x = []
-            y = []
-            
-            lambda_rest = elements[elem]['waves']
-            for lambduh in lambda_rest:
-                lambda_observed = lambduh*((1+z)-v_over_c)
-        
-                x.append(lambda_observed)
-                x.append(lambda_observed)
-                x.append(None)
-                y.append(actual_min_flux*0.95)
-                y.append(actual_max_flux*1.05)
-                y.append(None)
-
-            graph_data['data'].append(
-                go.Scatter(
-                    x=x,
-                    y=y,
-                    name=elem,
-                    mode='lines',
-                    line=dict(color=elements[elem]['color'])
-                )
-            )
+    graph_data['flux_range'] = [actual_min_flux*0.95, actual_max_flux*1.05]
     return graph_data
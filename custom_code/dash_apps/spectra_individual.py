@@ -4,9 +4,7 @@ import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
 import plotly.graph_objs as go
-import numpy as np
-import json
-from statistics import median
+import copy
 
 ### Jamie's Dash spectra plotting, currently a WIP
 ### Jamie: "lots of help from https://community.plot.ly/t/django-and-dash-eads-method/7717"
@@ -14,13 +12,15 @@ from statistics import median
 from django_plotly_dash import DjangoDash
 from tom_dataproducts.models import ReducedDatum
 from tom_targets.models import Target
-from custom_code.templatetags.custom_code_tags import bin_spectra, extract_spectrum_arrays
+from custom_code import spectrum_cache
+from custom_code.templatetags.custom_code_tags import bin_spectra
 from django.contrib.auth.models import User
-from django.db.models import Q
 from guardian.shortcuts import get_objects_for_user
 from django.templatetags.static import static
 import logging
-from custom_code.dash_apps.spectra_utils import elements, calculate_flux_range
+from custom_code.dash_apps.spectra_utils import elements, calculate_flux_range, line_overlay_js
+from custom_code.names import resolve_target_name, target_names
+from custom_code.spectra import mask_lines, normalize_median, shift_redshift
 
 logger = logging.getLogger(__name__)
 
@@ -45,17 +45,21 @@ columns.insert(0, columns.pop())
 table_body_one =[html.Tbody([])]
 table_body_two =[html.Tbody([])]
 
+figure_layout = {'height': 350,
+                 'margin': {'l': 60, 'b': 30, 'r': 60, 't': 10},
+                 'yaxis': {'type': 'linear', 'tickformat': '.1e'},
+                 'xaxis': {'showgrid': False},
+                 'legend': {'x': 0.85, 'y': 1.0},
+                 }
+
 app.layout = html.Div([
     dcc.Graph(id='table-editing-simple-output',
-              figure = {'layout' : {'height': 350,
-                                    'margin': {'l': 60, 'b': 30, 'r': 60, 't': 10},
-                                    'yaxis': {'type': 'linear', 'tickformat': '.1e'},
-                                    'xaxis': {'showgrid': False},
-                                    'legend': {'x': 0.85, 'y': 1.0},
-                                    },
+              figure = {'layout' : figure_layout,
                         'data' : []#[go.Scatter({'x': [], 'y': []})]
                     }
     ),
+    # Spectrum traces and flux range, the element lines are drawn client side
+    dcc.Store(id='spectrum-store'),
     html.Div([
         dcc.Input(id='spectrum_id', type='hidden', value=0),
         dcc.Input(id='user_id', type='hidden', value=0),
@@ -70,11 +74,6 @@ app.layout = html.Div([
             value='',
             style={'fontSize': 18}
         ),
-        html.Div(
-            children=[],
-            id='checked-rows',
-            style={'display': 'none'}
-        ),
         html.Div(
             children=[
                 dbc.Row([
@@ -133,23 +132,22 @@ app.layout = html.Div([
      State('spectra-compare-dropdown', 'value')])
 def get_target_list(value, existing, *args, **kwargs):
     if existing:
-        target_match_list = Target.objects.filter(
-            Q(name=existing) | Q(aliases__name=existing)).distinct()
+        target_ids = [match.target_id for match in resolve_target_name(existing, exact=True)]
     elif value:
-        target_match_list = Target.objects.filter(
-            Q(name__icontains=value) | Q(aliases__name__icontains=value)).distinct()
+        target_ids = [match.target_id for match in resolve_target_name(value)]
     else:
         return [{'label': '', 'value': ''}]
 
     names = [] if existing else [{'label': '', 'value': ''}]
     seen = set()
-    for target in target_match_list:
-        if target.name in seen:
+    target_name_lists = target_names(target_ids)
+    for target_id in target_ids:
+        name, aliases = target_name_lists.get(target_id, (None, []))
+        if name is None or name in seen:
             continue
-        seen.add(target.name)
-        aliases = [n for n in target.names if n != target.name]
-        label = f'{target.name} ({", ".join(aliases)})' if aliases else target.name
-        names.append({'label': label, 'value': target.name})
+        seen.add(name)
+        label = f'{name} ({", ".join(aliases)})' if aliases else name
+        names.append({'label': label, 'value': name})
     return names
 
 
@@ -177,43 +175,6 @@ line_plotting_input = [Input('standalone-checkbox-'+elem.replace(' ', '-'), 'val
 line_plotting_input += [Input('v-'+elem.replace(' ', '-'), 'value') for elem in elements]+[Input('v-custom-wavelength-1', 'value'), Input('v-custom-wavelength-2', 'value')]
 line_plotting_input += [Input('z-'+elem.replace(' ', '-'), 'value') for elem in elements]+[Input('z-custom-wavelength-1', 'value'), Input('z-custom-wavelength-2', 'value')]
 line_plotting_input += [Input('lambda-custom-wavelength-1', 'value'), Input('lambda-custom-wavelength-2', 'value')]
-@app.callback(
-    Output('checked-rows', 'children'),
-    line_plotting_input)
-def checked_boxes(*args, **kwargs):
-    all_rows = [item for item in line_plotting_input if 'standalone-checkbox' in item.component_id]
-    
-    checked_rows = []
-    for i in range(len(all_rows)):
-        if args[i] and i < len(all_rows) - 2:
-            elem = list(elements.keys())[i]
-            checked_rows.append(json.dumps({elem: {'waves': elements[elem]['waves'],
-                                                   'redshift': args[i+2*len(all_rows)],
-                                                   'velocity': args[i+len(all_rows)],
-                                                   'color': elements[elem]['color']
-                                                } 
-                                            })
-                                        )
-        elif args[i] and i == len(all_rows) - 2:
-            # Custom wavelength entry
-            checked_rows.append(json.dumps({'custom-wavelength-1': {'waves': [args[-2]],
-                                                        'redshift': args[i+2*len(all_rows)],
-                                                        'velocity': args[i+len(all_rows)],
-                                                        'color': '#c7b299'
-                                                    }
-                                            })
-                                        )
-        elif args[i] and i == len(all_rows) - 1:
-            # Custom wavelength entry
-            checked_rows.append(json.dumps({'custom-wavelength-2': {'waves': [args[-1]],
-                                                        'redshift': args[i+2*len(all_rows)],
-                                                        'velocity': args[i+len(all_rows)],
-                                                        'color': '#837565'
-                                                    }
-                                            })
-                                        )
-    return checked_rows
-
 
 @app.callback(
     Output('table-container-div', 'children'),
@@ -401,235 +362,148 @@ def change_redshift(z, *args, **kwargs):
         ]
 
 
-@app.expanded_callback(
-    Output('table-editing-simple-output', 'figure'),
-    [Input('checked-rows', 'children'),
-     Input('spectrum_id', 'value'),
-     Input('user_id', 'value'),
-     Input('min-flux', 'value'),
-     Input('max-flux', 'value'),
-     Input('bin-factor', 'value'),
-     Input('spectra-compare-dropdown', 'value'),
-     Input('mask-lines-checklist', 'value'),
-     State('table-editing-simple-output', 'figure')])
-def display_output(selected_rows,
-                   #selected_row_ids, columns,
-                   value, user_id, min_flux, max_flux, bin_factor, compare_target, mask_value, fig_data, *args, **kwargs):
-    # Improvements:
-    #   Fix dataproducts so they're correctly serialized
-    #   Correctly display message when there are no spectra
-    spectrum_id = value
-    graph_data = {'data': fig_data['data'],#[],
-                  'layout': fig_data['layout']}
+def _figure_layout(uirevision):
+    layout = copy.deepcopy(figure_layout)
+    layout['uirevision'] = uirevision
+    return layout
 
-    if compare_target:
-        compared = False
-        # Check if comparison spectra are already plotted
-        for d in reversed(graph_data['data']):
-            if '---' in d['name']:
-                compared = True
-                break
-        
-        if not compared:
-            # Plot this spectrum and the spectrum for the selected target, normalized to the median
-            graph_data['data'] = []
-            
-            min_flux = 0
-            max_flux = 0
-
-            spectrum = ReducedDatum.objects.get(id=spectrum_id)
-            target_first = Target.objects.get(pk=spectrum.target_id)
-            object_z = target_first.redshift or 0
-
-            if not spectrum:
-                return 'No spectra yet'
-                
-            name = str(spectrum.timestamp).split(' ')[0]
-            wavelength, flux = extract_spectrum_arrays(spectrum)
-                    
-            if not flux:
-                logger.warning('No flux values for spectrum %s, skipping comparison', spectrum_id)
-                return graph_data
-            flux_median = median(flux)
-            median_flux = [f / flux_median for f in flux] if flux_median else list(flux)
-            if max(median_flux) > max_flux: max_flux = max(median_flux)
-
-            if not bin_factor:
-                bin_factor = 1
-            binned_wavelength, binned_flux = bin_spectra(wavelength, median_flux, int(bin_factor))
-
-            scatter_obj = go.Scatter(
-                x=binned_wavelength,
-                y=binned_flux,
-                name='This Target',
-                line_color='black'
-            )
-            graph_data['data'] = [scatter_obj]
-
-            target_compare = Target.objects.filter(
-                Q(name=compare_target) | Q(aliases__name=compare_target)).distinct().first()
-            if not target_compare:
-                target_compare = Target.objects.filter(
-                    Q(name__icontains=compare_target) | Q(aliases__name__icontains=compare_target)).distinct().first()
-            if not target_compare:
-                logger.warning('Compare target %s not found', compare_target)
-                return graph_data
-            compare_z = target_compare.redshift or 0
-
-            spectral_dataproducts = ReducedDatum.objects.filter(
-                target=target_compare, data_type='spectroscopy').order_by('-timestamp')
-            if user_id:
-                compare_user = User.objects.filter(id=user_id).first()
-                if compare_user:
-                    spectral_dataproducts = get_objects_for_user(
-                        compare_user, 'tom_dataproducts.view_reduceddatum',
-                        klass=spectral_dataproducts)
-            if not spectral_dataproducts:
-                logger.info('No viewable spectra for compare target %s', target_compare)
-                return graph_data
-            for spectrum in spectral_dataproducts:
-                name = target_compare.name + ' --- ' +  str(spectrum.timestamp).split(' ')[0]
-                wavelength, flux = extract_spectrum_arrays(spectrum)
-                if not flux:
-                    continue
-                shifted_wavelength = [w * (1+object_z) / (1+compare_z) for w in wavelength]
-                flux_median = median(flux)
-                median_flux = [f / flux_median for f in flux] if flux_median else list(flux)
-                if max(median_flux) > max_flux: max_flux = max(median_flux)
-                
-                if not bin_factor:
-                    bin_factor = 1
-                binned_wavelength, binned_flux = bin_spectra(shifted_wavelength, median_flux, int(bin_factor))
-                
-                scatter_obj = go.Scatter(
-                    x=binned_wavelength,
-                    y=binned_flux,
-                    name=name
-                )
-                graph_data['data'].append(scatter_obj)
-
-            for axis in ('xaxis', 'yaxis'):
-                axis_layout = graph_data['layout'].setdefault(axis, {})
-                axis_layout.pop('range', None)
-                axis_layout['autorange'] = True
-            return graph_data
-        
-    # Remove all the element lines so we can replot the selected ones later
-    for d in reversed(graph_data['data']):
-        if d['name'] in elements.keys():
-            graph_data['data'].remove(d)
-    
-    # If the page just loaded, plot all the spectra
-    if not graph_data['data']:
-        logger.info('Plotting dash spectrum for reduceddatum %s', spectrum_id)
-        spectrum = ReducedDatum.objects.get(id=spectrum_id)
- 
-        if not spectrum:
-            return 'No spectra yet'
-            
-        name = str(spectrum.timestamp).split(' ')[0]
-        wavelength, flux = extract_spectrum_arrays(spectrum)
-        
-        if not bin_factor:
-            bin_factor = 1
-        binned_wavelength, binned_flux = bin_spectra(wavelength, flux, int(bin_factor))
-        scatter_obj = go.Scatter(
-            x=binned_wavelength,
-            y=binned_flux,
-            name=name,
-            line_color='black'
-        )
-        graph_data['data'].append(scatter_obj)
-        return graph_data
 
-    if not compare_target:
-        # Replot the spectrum with correct binning
-        for d in reversed(graph_data['data']):
-            if d['name'] not in elements.keys():
-                graph_data['data'].remove(d)
+def compare_figure(spectrum_id, user_id, bin_factor, compare_target):
+    """
+    Plots this spectrum and the spectra of the selected target, normalized to the median
+    """
+    graph_data = {'data': [],
+                  'layout': _figure_layout(f'compare-{spectrum_id}-{bin_factor}-{compare_target}')}
+    for axis in ('xaxis', 'yaxis'):
+        graph_data['layout'][axis]['autorange'] = True
+
+    spectrum = spectrum_cache.get_spectrum(spectrum_id)
+    if not spectrum:
+        return graph_data
 
-        spectrum = ReducedDatum.objects.get(id=spectrum_id)
+    target_first = Target.objects.get(pk=spectrum.target_id)
+    object_z = target_first.redshift or 0
 
-        if not spectrum:
-            return 'No spectra yet'
+    wavelength, flux = spectrum.wavelength, spectrum.flux
+    if not flux.size:
+        logger.warning('No flux values for spectrum %s, skipping comparison', spectrum_id)
+        return graph_data
+    median_flux = normalize_median(flux)
 
-        name = str(spectrum.timestamp).split(' ')[0]
-        wavelength, flux = extract_spectrum_arrays(spectrum)
+    if not bin_factor:
+        bin_factor = 1
+    binned_wavelength, binned_flux = bin_spectra(wavelength, median_flux, int(bin_factor))
 
-        if 'mask' in mask_value:
-            t = Target.objects.get(pk=spectrum.target_id)
-            object_z = t.redshift
+    scatter_obj = go.Scatter(
+        x=binned_wavelength,
+        y=binned_flux,
+        name='This Target',
+        line_color='black'
+    )
+    graph_data['data'] = [scatter_obj]
 
-            pfit = np.poly1d(np.polyfit(wavelength, flux, 4))
-            for galaxy_wave in elements['Galaxy']['waves']:
-                mask = [abs(l-galaxy_wave*(1+object_z)) < 10 for l in wavelength]
-                flux = np.ma.masked_array(flux, mask)
-                median_flux = np.ma.median(np.ma.masked_array(pfit(wavelength), np.logical_not(mask)))
-                flux = flux.filled(fill_value=median_flux)
-            name += ' (galaxy lines masked)'
+    compare_matches = resolve_target_name(compare_target, limit=1)
+    target_compare = Target.objects.filter(pk=compare_matches[0].target_id).first() if compare_matches else None
+    if not target_compare:
+        logger.warning('Compare target %s not found', compare_target)
+        return graph_data
+    compare_z = target_compare.redshift or 0
+
+    spectral_dataproducts = ReducedDatum.objects.filter(
+        target=target_compare, data_type='spectroscopy').order_by('-timestamp')
+    if user_id:
+        compare_user = User.objects.filter(id=user_id).first()
+        if compare_user:
+            spectral_dataproducts = get_objects_for_user(
+                compare_user, 'tom_dataproducts.view_reduceddatum',
+                klass=spectral_dataproducts)
+    compare_ids = list(spectral_dataproducts.values_list('id', flat=True))
+    if not compare_ids:
+        logger.info('No viewable spectra for compare target %s', target_compare)
+        return graph_data
+    for spectrum in spectrum_cache.get_spectra(compare_ids).values():
+        name = target_compare.name + ' --- ' +  str(spectrum.timestamp).split(' ')[0]
+        wavelength, flux = spectrum.wavelength, spectrum.flux
+        if not flux.size:
+            continue
+        shifted_wavelength = shift_redshift(wavelength, compare_z, object_z)
+        median_flux = normalize_median(flux)
+        binned_wavelength, binned_flux = bin_spectra(shifted_wavelength, median_flux, int(bin_factor))
 
-        if not bin_factor:
-            bin_factor = 1
-        binned_wavelength, binned_flux = bin_spectra(wavelength, flux, int(bin_factor))
         scatter_obj = go.Scatter(
             x=binned_wavelength,
             y=binned_flux,
-            name=name,
-            line_color='black'
+            name=name
         )
         graph_data['data'].append(scatter_obj)
-        if binned_wavelength and binned_flux:
-            graph_data['layout']['xaxis']['range'] = [min(binned_wavelength), max(binned_wavelength)]
-            graph_data['layout']['xaxis']['autorange'] = False
-            graph_data['layout']['yaxis']['range'] = [min(binned_flux), max(binned_flux)]
-            graph_data['layout']['yaxis']['autorange'] = False
-    
-    # Calculate actual min/max flux from spectrum data for element lines
-    actual_min_flux, actual_max_flux = calculate_flux_range(graph_data, min_flux, max_flux)
-    
-    for row in selected_rows:
-        (elem, row_extras), = json.loads(row).items()
-        z = row_extras['redshift']
-        if not z:
-            z = 0
-        v = row_extras['velocity']
-        if not v:
-            v = 0
-        try:
-            v_over_c = float(v/(3e5))
-        except:
-            v_over_c = 0
-        lambda_rest = row_extras['waves']
-        if not lambda_rest[0]:
-            continue
-        x = []
-        y = []
-        
-        if compare_target:
-            actual_min_flux, actual_max_flux = calculate_flux_range(graph_data)
-        for lambduh in lambda_rest:
-
-            lambda_observed = lambduh*((1+z)-v_over_c)
-    
-            x.append(lambda_observed)
-            x.append(lambda_observed)
-            x.append(None)
-            y.append(actual_min_flux)
-            y.append(actual_max_flux)
-            y.append(None)
-
-        try:
-            color = row_extras['color']
-        except:
-            color = 'black'
-
-        graph_data['data'].append(
-            go.Scatter(
-                x=x,
-                y=y,
-                name=elem,
-                mode='lines',
-                line={'color': color},
-            )
-        )
     return graph_data
+
+
+def spectrum_figure(spectrum_id, bin_factor, mask_value):
+    """
+    Plots this spectrum with the chosen binning, optionally with the galaxy lines masked
+    """
+    graph_data = {'data': [],
+                  'layout': _figure_layout(f'spectrum-{spectrum_id}-{bin_factor}-{mask_value}')}
+
+    logger.info('Plotting dash spectrum for reduceddatum %s', spectrum_id)
+    spectrum = spectrum_cache.get_spectrum(spectrum_id)
+    if not spectrum:
+        return graph_data
+
+    name = str(spectrum.timestamp).split(' ')[0]
+
+    if 'mask' in (mask_value or []):
+        wavelength, flux = spectrum.wavelength, spectrum.flux
+        t = Target.objects.get(pk=spectrum.target_id)
+        object_z = t.redshift
+
+        flux = mask_lines(wavelength, flux, elements['Galaxy']['waves'], object_z)
+        name += ' (galaxy lines masked)'
+        binned_wavelength, binned_flux = bin_spectra(wavelength, flux, bin_factor or 1)
+    else:
+        binned_wavelength, binned_flux = spectrum_cache.binned(spectrum, bin_factor)
+    scatter_obj = go.Scatter(
+        x=binned_wavelength,
+        y=binned_flux,
+        name=name,
+        line_color='black'
+    )
+    graph_data['data'].append(scatter_obj)
+    if binned_flux.size:
+        graph_data['layout']['xaxis']['range'] = [float(binned_wavelength.min()), float(binned_wavelength.max())]
+        graph_data['layout']['xaxis']['autorange'] = False
+        graph_data['layout']['yaxis']['range'] = [float(binned_flux.min()), float(binned_flux.max())]
+        graph_data['layout']['yaxis']['autorange'] = False
+    return graph_data
+
+
+@app.expanded_callback(
+    Output('spectrum-store', 'data'),
+    [Input('spectrum_id', 'value'),
+     Input('user_id', 'value'),
+     Input('min-flux', 'value'),
+     Input('max-flux', 'value'),
+     Input('bin-factor', 'value'),
+     Input('spectra-compare-dropdown', 'value'),
+     Input('mask-lines-checklist', 'value')])
+def display_output(value, user_id, min_flux, max_flux, bin_factor, compare_target, mask_value, *args, **kwargs):
+    """
+    Builds the spectrum traces and the flux range spanned by the element
+    lines, which the clientside callback draws on top of them
+    """
+    spectrum_id = value
+    if compare_target:
+        graph_data = compare_figure(spectrum_id, user_id, bin_factor, compare_target)
+        actual_min_flux, actual_max_flux = calculate_flux_range(graph_data)
+    else:
+        graph_data = spectrum_figure(spectrum_id, bin_factor, mask_value)
+        actual_min_flux, actual_max_flux = calculate_flux_range(graph_data, min_flux, max_flux)
+    graph_data['flux_range'] = [actual_min_flux, actual_max_flux]
+    return graph_data
+
+
+app.clientside_callback(
+    line_overlay_js(custom_lines=[('custom-wavelength-1', '#c7b299'), ('custom-wavelength-2', '#837565')]),
+    Output('table-editing-simple-output', 'figure'),
+    [Input('spectrum-store', 'data')] + line_plotting_input)
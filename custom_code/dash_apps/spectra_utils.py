@@ -1,4 +1,7 @@
 """Shared utilities for spectra plotting Dash apps."""
+import json
+
+from custom_code.spectra import flux_range
 
 # Element definitions shared between spectra.py and spectra_individual.py
 elements = {
@@ -36,19 +39,61 @@ def calculate_flux_range(graph_data, min_flux=0, max_flux=0):
     Returns:
         Tuple of (actual_min_flux, actual_max_flux)
     """
-    actual_min_flux = min_flux
-    actual_max_flux = max_flux
-    for trace in graph_data['data']:
-        if trace['name'] not in elements and 'y' in trace and trace['y']:
-            y_vals = [v for v in trace['y'] if v is not None]
-            if y_vals:
-                trace_min = min(y_vals)
-                trace_max = max(y_vals)
-                if actual_min_flux == 0 and actual_max_flux == 0:
-                    actual_min_flux = trace_min
-                    actual_max_flux = trace_max
-                else:
-                    actual_min_flux = min(actual_min_flux, trace_min)
-                    actual_max_flux = max(actual_max_flux, trace_max)
-    return actual_min_flux, actual_max_flux
+    trace_range = flux_range(
+        trace['y'] for trace in graph_data['data']
+        if trace['name'] not in elements and 'y' in trace and trace['y'] is not None
+    )
+    if trace_range is None:
+        return min_flux, max_flux
+    if min_flux == 0 and max_flux == 0:
+        return trace_range
+    return min(min_flux, trace_range[0]), max(max_flux, trace_range[1])
+
+
+# Clientside callback drawing the checked element lines over the spectra
+# in a figure store. Its arguments are the store, then one checkbox, one
+# velocity and one redshift per line (in that order), then the rest
+# wavelengths of the custom lines, so toggling a line never reaches the server
+_LINE_OVERLAY_JS = """
+function(spectrum, ...rows) {
+    if (!spectrum) {
+        return window.dash_clientside.no_update;
+    }
+    const lines = %s;
+    const n = lines.length;
+    const customWaves = rows.slice(3 * n);
+    const low = spectrum.flux_range[0];
+    const high = spectrum.flux_range[1];
+    const data = spectrum.data.slice();
+    lines.forEach(function(line, i) {
+        const waves = line.waves === null ? [customWaves[line.custom]] : line.waves;
+        if (!rows[i] || !waves[0]) {
+            return;
+        }
+        const v = Number(rows[n + i]) || 0;
+        const z = Number(rows[2 * n + i]) || 0;
+        const x = [];
+        const y = [];
+        waves.forEach(function(rest) {
+            const observed = rest * ((1 + z) - v / 3e5);
+            x.push(observed, observed, null);
+            y.push(low, high, null);
+        });
+        data.push({type: 'scatter', mode: 'lines', x: x, y: y, name: line.name, line: {color: line.color}});
+    });
+    return {data: data, layout: spectrum.layout};
+}
+"""
 
+
+def line_overlay_js(custom_lines=()):
+    """
+    Returns the source of the clientside line overlay callback for the
+    elements plus the given (name, color) custom wavelength lines
+    """
+    lines = [{'name': elem, 'color': elements[elem]['color'], 'waves': elements[elem]['waves']} for elem in elements]
+    lines += [
+        {'name': name, 'color': color, 'waves': None, 'custom': i}
+        for i, (name, color) in enumerate(custom_lines)
+    ]
+    return _LINE_OVERLAY_JS % json.dumps(lines)
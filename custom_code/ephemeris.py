@@ -0,0 +1,187 @@
+"""
+Shared sun and moon ephemeris.
+
+The positions of the sun and the moon on a given UTC grid are the same for
+every target, so they are computed once on a fixed cadence (5 minute buckets
+covering the next ~30 days by default) and then interpolated onto whatever
+time grid a plot needs. Tables live in a per-process dictionary and, when
+EPHEMERIS_CACHE['shared'] is set, in the Django cache so that all workers
+share a single computation per day.
+"""
+import datetime
+
+import numpy as np
+from astropy import units as u
+from astropy.coordinates import get_body, get_sun
+from astropy.time import Time
+from django.conf import settings
+from django.core.cache import cache
+
+from custom_code.spatial import angular_separation
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+EPHEMERIS_DEFAULTS = {
+    'resolution': 5, #minutes
+    'days': 31,
+    'shared': True,
+    'timeout': 2 * 24 * 3600, #seconds
+}
+
+_tables = {}
+
+
+def _get_setting(key):
+    return getattr(settings, 'EPHEMERIS_CACHE', {}).get(key, EPHEMERIS_DEFAULTS[key])
+
+
+class EphemerisTable:
+    """
+    Sun and moon positions sampled on a regular JD grid
+
+    Coordinates are geocentric apparent right ascension and declination
+    in degrees (ICRS-aligned axes), distances are in AU for the sun
+    and km for the moon
+    """
+
+    fields = ('jd', 'sun_ra', 'sun_dec', 'sun_distance', 'moon_ra', 'moon_dec', 'moon_distance')
+
+    def __init__(self, jd, sun_ra, sun_dec, sun_distance, moon_ra, moon_dec, moon_distance):
+        self.jd = jd
+        self.sun_ra = sun_ra
+        self.sun_dec = sun_dec
+        self.sun_distance = sun_distance
+        self.moon_ra = moon_ra
+        self.moon_dec = moon_dec
+        self.moon_distance = moon_distance
+
+    @classmethod
+    def compute(cls, start, resolution, days):
+        npoints = int(days * 24 * 60 / resolution) + 1
+        times = start + np.arange(npoints) * resolution * u.minute
+        sun = get_sun(times)
+        moon = get_body('moon', times)
+        return cls(
+            times.jd,
+            sun.ra.deg, sun.dec.deg, sun.distance.to(u.au).value,
+            moon.ra.deg, moon.dec.deg, moon.distance.to(u.km).value
+        )
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.fields}
+
+    def covers(self, jd):
+        jd = np.asarray(jd)
+        return jd.size > 0 and jd.min() >= self.jd[0] and jd.max() <= self.jd[-1]
+
+    def _interp(self, jd, values, angle=False):
+        if angle:
+            unwrapped = np.unwrap(np.radians(values))
+            return np.mod(np.degrees(np.interp(jd, self.jd, unwrapped)), 360.0)
+        return np.interp(jd, self.jd, values)
+
+    def sun(self, jd):
+        """
+        Returns (ra, dec, distance) of the sun at the given JDs
+        """
+        return (self._interp(jd, self.sun_ra, angle=True),
+                self._interp(jd, self.sun_dec),
+                self._interp(jd, self.sun_distance))
+
+    def moon(self, jd):
+        """
+        Returns (ra, dec, distance) of the moon at the given JDs
+        """
+        return (self._interp(jd, self.moon_ra, angle=True),
+                self._interp(jd, self.moon_dec),
+                self._interp(jd, self.moon_distance))
+
+
+def _table_key(start, resolution, days):
+    return 'ephemeris:{:.1f}:{}:{}'.format(start.jd, resolution, days)
+
+
+def get_ephemeris_table(now=None):
+    """
+    Returns the ephemeris table starting at the beginning of the current
+    UTC day, computing it only if no worker has done so yet
+    """
+    if now is None:
+        now = datetime.datetime.utcnow()
+    start = Time(datetime.datetime(now.year, now.month, now.day))
+    resolution = _get_setting('resolution')
+    days = _get_setting('days')
+    key = _table_key(start, resolution, days)
+
+    table = _tables.get(key)
+    if table is not None:
+        return table
+
+    shared = _get_setting('shared')
+    data = cache.get(key) if shared else None
+    if data is not None:
+        table = EphemerisTable(**data)
+    else:
+        logger.info('Computing sun and moon ephemeris for {}'.format(key))
+        table = EphemerisTable.compute(start, resolution, days)
+        if shared:
+            cache.set(key, table.to_dict(), _get_setting('timeout'))
+
+    # Only keep the current day's table around
+    _tables.clear()
+    _tables[key] = table
+    return table
+
+
+def _table_for(times):
+    table = get_ephemeris_table()
+    if table.covers(times.jd):
+        return table
+    return None
+
+
+def sun_position(times):
+    """
+    Returns (ra, dec) arrays in degrees of the sun at the given astropy Times
+    """
+    table = _table_for(times)
+    if table is None:
+        sun = get_sun(times)
+        return sun.ra.deg, sun.dec.deg
+    ra, dec, _ = table.sun(times.jd)
+    return ra, dec
+
+
+def moon_position(times):
+    """
+    Returns (ra, dec) arrays in degrees of the moon at the given astropy Times
+    """
+    table = _table_for(times)
+    if table is None:
+        moon = get_body('moon', times)
+        return moon.ra.deg, moon.dec.deg
+    ra, dec, _ = table.moon(times.jd)
+    return ra, dec
+
+
+def moon_illumination(times):
+    """
+    Fraction of the moon illuminated at the given astropy Times, equivalent
+    to astroplan.moon_illumination
+    """
+    table = _table_for(times)
+    if table is None:
+        sun, moon = get_sun(times), get_body('moon', times)
+        sun_ra, sun_dec, sun_distance = sun.ra.deg, sun.dec.deg, sun.distance.to(u.km).value
+        moon_ra, moon_dec, moon_distance = moon.ra.deg, moon.dec.deg, moon.distance.to(u.km).value
+    else:
+        sun_ra, sun_dec, sun_distance = table.sun(times.jd)
+        sun_distance = (sun_distance * u.au).to(u.km).value
+        moon_ra, moon_dec, moon_distance = table.moon(times.jd)
+
+    elongation = np.radians(angular_separation(sun_ra, sun_dec, moon_ra, moon_dec))
+    phase_angle = np.arctan2(sun_distance * np.sin(elongation),
+                             moon_distance - sun_distance * np.cos(elongation))
+    return (1 + np.cos(phase_angle)) / 2.0
@@ -1,4 +1,5 @@
 from custom_code.models import TNSTarget, ScienceTags, TargetTags, BrokerTarget
+from custom_code.spatial import cone_search
 from tom_targets.models import Target, TargetList
 from tom_targets.filters import filter_for_field, TargetFilterSet
 from django.conf import settings
@@ -88,6 +89,18 @@ class CustomTargetFilter(TargetFilterSet):
     def filter_sciencetags(self, queryset, name, value):
         return queryset.filter(targettags__tag=value).distinct()
 
+    def filter_cone_search(self, queryset, name, value):
+        """
+        Uses the declination zone index for ra,dec,radius searches
+        """
+        if name == 'cone_search':
+            try:
+                ra, dec, radius = (float(v) for v in value.split(','))
+            except ValueError:
+                return queryset.none()
+            return cone_search(queryset, ra, dec, radius)
+        return super().filter_cone_search(queryset, name, value)
+
     class Meta:
         model = Target
         fields = ['name', 'cone_search', 'targetlist__name', 'sciencetags']
@@ -21,6 +21,7 @@ from tom_registration.registration_flows.approval_required.forms import Registra
 from tom_targets.forms import SiderealTargetCreateForm
 from tom_targets.models import Target
 from custom_code.models import Papers, ScienceTags, TargetTags, UserRegistrationInfo
+from custom_code.spatial import cone_search
 import logging
 
 logger = logging.getLogger(__name__)
@@ -76,12 +77,7 @@ class CustomTargetCreateForm(SiderealTargetCreateForm):
         name = cleaned_data.get('name')
 
         if ra and dec:
-            if Target.objects.filter(
-                ra__gte=ra-4/3600,
-                ra__lte=ra+4/3600,
-                dec__gte=dec-4/3600,
-                dec__lte=dec+4/3600
-            ).exists():
+            if cone_search(Target.objects.all(), ra, dec, 4/3600).exists():
                 raise ValidationError("Target exists near these coordinates.")
 
         if name:
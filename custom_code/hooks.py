@@ -235,7 +235,7 @@ def get_unreduced_spectra(allspec=True):
         dateobs = [s.dateobs for s in unreduced_spectra]
         paths = [s.filepath for s in unreduced_spectra]
         filenames = [s.filename for s in unreduced_spectra]
-        imgpaths = [os.path.join(s.filepath.replace(settings.FLOYDS_DIR, '/snex2/data/floyds'), s.filename.replace('.fits', '.png')) for s in unreduced_spectra]
+        imgpaths = [os.path.join(s.filepath.replace(settings.FLOYDS_DIR, settings.FLOYDS_DATA_DIR), s.filename.replace('.fits', '.png')) for s in unreduced_spectra]
 
     return pipeline_ids, propids, dateobs, paths, filenames, imgpaths
 
@@ -302,9 +302,8 @@ def download_test_image_from_archive():
                                 params={'basename': test_thumbnail_basename}).json()["results"]
             thumbnail_url = results[0]["url"]
             thumbnail_filename = results[0]["filename"]
-            # Download image and funpack it
+            # Download image, thumbnails are read from the compressed file
             urllib.request.urlretrieve(thumbnail_url, os.path.join(settings.BASE_DIR, thumbnail_directory, thumbnail_filename))
-            os.system('funpack -D '+ thumbnail_directory + thumbnail_filename)
 
     filepaths = ['','','','']
     filenames = test_thumbnail_basenames
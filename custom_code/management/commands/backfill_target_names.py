@@ -0,0 +1,45 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from tom_targets.models import Target
+
+from custom_code.models import TargetNameKey
+from custom_code.names import index_target_names
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _chunked(iterable, n):
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, n))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = 'Builds or rebuilds the TargetNameKey rows used to resolve target names'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing-only', action='store_true',
+                            help='Only index targets that do not have any name keys yet.')
+        parser.add_argument('--resume-from', type=int, default=0,
+                            help='Skip targets with pk < this (speeds up resume).')
+        parser.add_argument('--chunk', type=int, default=1000,
+                            help='Targets indexed per batch.')
+
+    def handle(self, *args, **opts):
+        qs = Target.objects.filter(pk__gte=opts['resume_from']).order_by('pk')
+        if opts['missing_only']:
+            qs = qs.exclude(pk__in=TargetNameKey.objects.values('target_id'))
+
+        total = 0
+        for batch in _chunked(qs.values_list('pk', flat=True).iterator(), opts['chunk']):
+            index_target_names(batch)
+            total += len(batch)
+            self.stdout.write(f'Indexed {total} targets (last pk {batch[-1]})')
+
+        self.stdout.write(self.style.SUCCESS(f'Done, indexed names of {total} targets'))
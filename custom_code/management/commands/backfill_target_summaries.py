@@ -0,0 +1,44 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from tom_targets.models import Target
+
+from custom_code.models import TargetDataSummary
+from custom_code.summaries import refresh_target_summaries
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _chunked(iterable, n):
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, n))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = 'Builds or rebuilds the TargetDataSummary rows used by the target filter page'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing-only', action='store_true',
+                            help='Only summarize targets that do not have a summary yet.')
+        parser.add_argument('--resume-from', type=int, default=0,
+                            help='Skip targets with pk < this (speeds up resume).')
+        parser.add_argument('--chunk', type=int, default=200,
+                            help='Targets summarized per batch.')
+
+    def handle(self, *args, **opts):
+        qs = Target.objects.filter(pk__gte=opts['resume_from']).order_by('pk')
+        if opts['missing_only']:
+            qs = qs.exclude(pk__in=TargetDataSummary.objects.values('target_id'))
+
+        total = 0
+        for batch in _chunked(qs.values_list('pk', flat=True).iterator(), opts['chunk']):
+            total += refresh_target_summaries(batch)
+            self.stdout.write(f'Summarized {total} targets (last pk {batch[-1]})')
+
+        self.stdout.write(self.style.SUCCESS(f'Done, summarized {total} targets'))
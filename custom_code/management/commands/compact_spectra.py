@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from tom_dataproducts.models import ReducedDatum
+
+from custom_code.spectra import is_per_pixel, spectrum_arrays, spectrum_value
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Rewrites spectra stored as one dictionary per pixel into the compact wavelength/flux array layout'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--encoding', choices=['list', 'base64'], default=None,
+                            help='Layout of the rewritten arrays (default: settings.SPECTRUM_ENCODING).')
+        parser.add_argument('--resume-from', type=int, default=0,
+                            help='Skip reduced datums with pk < this (speeds up resume).')
+        parser.add_argument('--chunk', type=int, default=200,
+                            help='Spectra rewritten per transaction.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Count the spectra that would be rewritten without saving them.')
+
+    def handle(self, *args, **opts):
+        # Legacy spectra are keyed by pixel index, starting at "0"
+        qs = ReducedDatum.objects.filter(
+            data_type='spectroscopy', pk__gte=opts['resume_from'], value__has_key='0'
+        ).order_by('pk')
+        pks = list(qs.values_list('pk', flat=True))
+
+        total = 0
+        for start in range(0, len(pks), opts['chunk']):
+            batch = []
+            for datum in ReducedDatum.objects.filter(pk__in=pks[start:start + opts['chunk']]).order_by('pk'):
+                if not is_per_pixel(datum.value):
+                    continue
+                datum.value = spectrum_value(*spectrum_arrays(datum.value), encoding=opts['encoding'])
+                batch.append(datum)
+
+            if batch and not opts['dry_run']:
+                with transaction.atomic():
+                    ReducedDatum.objects.bulk_update(batch, ['value'])
+            total += len(batch)
+            self.stdout.write(f'Compacted {total} spectra (last pk {pks[min(start + opts["chunk"], len(pks)) - 1]})')
+
+        verb = 'Would compact' if opts['dry_run'] else 'Done, compacted'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {total} spectra'))
@@ -0,0 +1,43 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from custom_code.thumbnail_store import THUMBNAIL_STORE_MAX_AGE_DAYS, THUMBNAIL_STORE_MAX_BYTES, collect_garbage
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Evicts the least recently used image thumbnails to keep the thumbnail store under its age and size limits'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age-days', type=float, default=THUMBNAIL_STORE_MAX_AGE_DAYS,
+                            help='Evict thumbnails not viewed in this many days.')
+        parser.add_argument('--max-size-mb', type=float, default=THUMBNAIL_STORE_MAX_BYTES / 1024**2,
+                            help='Then evict the least recently viewed thumbnails until the store is under this size.')
+        parser.add_argument('--purge-legacy', action='store_true',
+                            help='Also delete the unindexed thumbnails written directly into THUMB_DIR by older versions.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be evicted without deleting anything.')
+
+    def handle(self, *args, **opts):
+        evicted, freed = collect_garbage(
+            max_bytes=int(opts['max_size_mb'] * 1024**2),
+            max_age_days=opts['max_age_days'],
+            dry_run=opts['dry_run']
+        )
+        verb = 'Would evict' if opts['dry_run'] else 'Evicted'
+        self.stdout.write(f'{verb} {evicted} thumbnails ({freed / 1024**2:.1f} MB)')
+
+        if opts['purge_legacy']:
+            # The store only writes into the shard subdirectories
+            legacy = [entry for entry in os.scandir(settings.THUMB_DIR) if entry.is_file()]
+            if not opts['dry_run']:
+                for entry in legacy:
+                    os.remove(entry.path)
+            self.stdout.write(f'{verb} {len(legacy)} legacy thumbnails')
+
+        self.stdout.write(self.style.SUCCESS('Done'))
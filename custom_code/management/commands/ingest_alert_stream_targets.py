@@ -3,9 +3,8 @@ import logging
 import requests
 import time
 import json
-from django.db.models import Q
-from tom_targets.models import Target
 from custom_code.models import TNSTarget, BrokerTarget
+from custom_code.names import cross_match_names
 from custom_code.brokers.queries.alerce_queries import BasicAlerceQuery
 from custom_code.brokers.queries.lasair_iris_queries import LasairIrisQuery
 from custom_code.brokers.queries.tns_target_queries import TNSTargetQuery
@@ -141,14 +140,15 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         ### Search for new data for existing targets that are new or interesting
-        brokertargetlist = BrokerTarget.objects.filter(status__in=['New', 'Interesting'])
+        brokertargetlist = list(BrokerTarget.objects.filter(status__in=['New', 'Interesting']).select_related('tns_target'))
+        existing_targets = cross_match_names(
+            [obj.name for obj in brokertargetlist] +
+            [obj.tns_target.name for obj in brokertargetlist if obj.tns_target]
+        )
         for obj in brokertargetlist:
 
             ### Check if target exists in SNEx2, and update status if it does
-            targetname_matchlist = Target.objects.filter(Q(name__icontains=obj.name) | Q(aliases__name__icontains=obj.name)).distinct().first()
-            if obj.tns_target:
-                target_tnsname_matchlist = Target.objects.filter(Q(name__icontains=obj.tns_target.name) | Q(aliases__name__icontains=obj.tns_target.name)).distinct().first()
-            if targetname_matchlist or (obj.tns_target and target_tnsname_matchlist):
+            if obj.name in existing_targets or (obj.tns_target and obj.tns_target.name in existing_targets):
                 obj.status = 'Added'
                 obj.save()
             
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from custom_code.scripts import sync_databases
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Incrementally syncs changes from the SNEx1 db_changes table, starting after the stored watermark'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=int, default=None,
+                            help='Start after this db_changes id instead of the stored watermark (above it only with --replay).')
+        parser.add_argument('--replay', action='store_true',
+                            help='Reprocess rows after --since without moving the watermark or compacting (for backfills).')
+        parser.add_argument('--batch-size', type=int, default=sync_databases.SYNC_BATCH_SIZE,
+                            help='db_changes rows processed per window.')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Processes to sync each window with, partitioned by target.')
+        parser.add_argument('--no-compact', action='store_true',
+                            help='Leave processed rows in db_changes.')
+
+    def handle(self, *args, **opts):
+        if opts['replay'] and opts['since'] is None:
+            self.stderr.write(self.style.ERROR('--replay needs --since'))
+            return
+
+        try:
+            watermark = sync_databases.run_incremental(
+                since=opts['since'], replay=opts['replay'],
+                batch_size=opts['batch_size'], compact=not opts['no_compact'],
+                workers=opts['workers']
+            )
+        except ValueError as e:
+            self.stderr.write(self.style.ERROR(str(e)))
+            return
+        self.stdout.write(self.style.SUCCESS(f'Done, synced up to db_changes id {watermark}'))
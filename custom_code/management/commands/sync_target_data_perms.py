@@ -8,6 +8,7 @@ from guardian.shortcuts import assign_perm
 
 from tom_targets.models import Target
 from tom_dataproducts.models import ReducedDatum, DataProduct
+from custom_code import render_cache
 from custom_code.models import ReducedDatumExtra
 
 ACTIONS = ('view', 'change', 'delete')
@@ -111,6 +112,10 @@ class Command(BaseCommand):
 
             if made_change:
                 processed += 1
+                if not dry:
+                    # Bulk grants skip the signals that version the cached plots
+                    for data_type in ('photometry', 'spectroscopy'):
+                        render_cache.invalidate(t.pk, data_type)
             else:
                 skipped += 1
 
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from custom_code.thumbnail_store import claim_jobs, run_job
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Renders the queued image thumbnails, polling the ThumbnailJob table for new jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=10,
+                            help='Jobs claimed at a time.')
+        parser.add_argument('--sleep', type=float, default=2.0,
+                            help='Seconds to wait before polling again when the queue is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit when the queue is empty instead of waiting for new jobs.')
+
+    def handle(self, *args, **opts):
+        rendered = failed = 0
+        while True:
+            # Long running, so do not hold on to connections the database has dropped
+            close_old_connections()
+            jobs = claim_jobs(limit=opts['batch'])
+            if not jobs:
+                if opts['once']:
+                    break
+                time.sleep(opts['sleep'])
+                continue
+
+            for job in jobs:
+                if run_job(job):
+                    rendered += 1
+                else:
+                    failed += 1
+            logger.info(f'Rendered {rendered} thumbnails, {failed} failures')
+
+        self.stdout.write(self.style.SUCCESS(f'Done, rendered {rendered} thumbnails ({failed} failures)'))
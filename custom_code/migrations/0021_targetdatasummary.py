@@ -0,0 +1,32 @@
+# Generated by Django 5.2.12 on 2026-10-18 18:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('custom_code', '0020_alter_reduceddatumextra_data_product'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TargetDataSummary',
+            fields=[
+                ('target', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='data_summary', serialize=False, to='custom_code.snextarget')),
+                ('phot_count', models.IntegerField(db_index=True, default=0, help_text='Number of photometry points with a magnitude', verbose_name='Photometry Count')),
+                ('spec_count', models.IntegerField(db_index=True, default=0, help_text='Number of spectra', verbose_name='Spectra Count')),
+                ('first_datum', models.DateTimeField(blank=True, db_index=True, help_text='Timestamp of the earliest ReducedDatum of any type', null=True, verbose_name='First Datum')),
+                ('last_datum', models.DateTimeField(blank=True, db_index=True, help_text='Timestamp of the latest ReducedDatum of any type', null=True, verbose_name='Last Datum')),
+                ('first_phot', models.DateTimeField(blank=True, db_index=True, help_text='Timestamp of the earliest photometry point with a magnitude', null=True, verbose_name='First Photometry')),
+                ('last_phot', models.DateTimeField(blank=True, db_index=True, help_text='Timestamp of the latest photometry point with a magnitude', null=True, verbose_name='Last Photometry')),
+                ('last_mag', models.FloatField(blank=True, db_index=True, help_text='Magnitude of the latest photometry point', null=True, verbose_name='Last Magnitude')),
+                ('last_filter', models.CharField(blank=True, default='', help_text='Filter of the latest photometry point', max_length=50, verbose_name='Last Filter')),
+                ('brightest_mag', models.FloatField(blank=True, db_index=True, help_text='Brightest magnitude in any filter', null=True, verbose_name='Brightest Magnitude')),
+                ('first_spec', models.DateTimeField(blank=True, db_index=True, help_text='Timestamp of the earliest spectrum', null=True, verbose_name='First Spectrum')),
+                ('last_spec', models.DateTimeField(blank=True, db_index=True, help_text='Timestamp of the latest spectrum', null=True, verbose_name='Last Spectrum')),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
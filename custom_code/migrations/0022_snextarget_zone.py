@@ -0,0 +1,31 @@
+# Generated by Django 5.2.12 on 2026-10-18 19:05
+
+from django.db import migrations, models
+import math
+
+ZONE_HEIGHT = 1.0 / 60.0
+
+def populate_zone(apps, schema_editor):
+    SNExTarget = apps.get_model('custom_code', 'SNExTarget')
+    targets = []
+    for target in SNExTarget.objects.filter(dec__isnull=False).only('pk', 'dec').iterator(chunk_size=2000):
+        dec = min(max(target.dec, -90.0), 90.0)
+        target.zone = int(math.floor((dec + 90.0) / ZONE_HEIGHT))
+        targets.append(target)
+    SNExTarget.objects.bulk_update(targets, ['zone'], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('custom_code', '0021_targetdatasummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='snextarget',
+            name='zone',
+            field=models.IntegerField(blank=True, db_index=True, editable=False, help_text='Declination zone of the target, see custom_code.spatial', null=True),
+        ),
+        migrations.RunPython(populate_zone, migrations.RunPython.noop),
+    ]
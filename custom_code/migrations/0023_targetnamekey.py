@@ -0,0 +1,30 @@
+# Generated by Django 5.2.12 on 2026-10-18 19:40
+
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('custom_code', '0022_snextarget_zone'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.CreateModel(
+            name='TargetNameKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='The name or alias as stored on the target', max_length=100, verbose_name='Name')),
+                ('key', models.CharField(db_index=True, help_text='Lowercase compact form of the name used for matching', max_length=100, verbose_name='Key')),
+                ('is_alias', models.BooleanField(default=False)),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='name_keys', to='custom_code.snextarget')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['key'], name='targetnamekey_key_prefix', opclasses=['varchar_pattern_ops']), django.contrib.postgres.indexes.GinIndex(fields=['key'], name='targetnamekey_key_trgm', opclasses=['gin_trgm_ops'])],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.12 on 2026-10-18 20:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('custom_code', '0023_targetnamekey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('watermark', models.BigIntegerField(default=0, help_text='Highest db_changes id that has been processed', verbose_name='Watermark')),
+                ('compacted_to', models.BigIntegerField(default=0, help_text='Processed db_changes rows up to this id have been deleted from SNEx1', verbose_name='Compacted To')),
+                ('retry_ids', models.JSONField(blank=True, default=list, help_text='db_changes ids at or below the watermark that failed and are retried on the next run', verbose_name='Retry IDs')),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.12 on 2026-10-18 21:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('custom_code', '0024_synccheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Thumbnail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(help_text='SHA-1 of the FITS basename and the rendering parameters', max_length=40, unique=True)),
+                ('basename', models.CharField(db_index=True, max_length=100, verbose_name='FITS Basename')),
+                ('grow', models.FloatField()),
+                ('sigma', models.FloatField()),
+                ('x', models.FloatField()),
+                ('y', models.FloatField()),
+                ('ticks', models.BooleanField(default=False)),
+                ('path', models.CharField(help_text='Path of the image relative to THUMB_DIR', max_length=200)),
+                ('size', models.BigIntegerField(default=0, help_text='Size of the image in bytes')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('last_accessed', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
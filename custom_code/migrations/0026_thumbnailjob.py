@@ -0,0 +1,35 @@
+# Generated by Django 5.2.12 on 2026-10-18 22:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('custom_code', '0025_thumbnail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThumbnailJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(help_text='Key of the Thumbnail this job renders', max_length=40, unique=True)),
+                ('filename', models.CharField(max_length=300, verbose_name='FITS Path')),
+                ('grow', models.FloatField()),
+                ('sigma', models.FloatField()),
+                ('x', models.FloatField()),
+                ('y', models.FloatField()),
+                ('ticks', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('priority', models.IntegerField(default=0, help_text='Jobs with a higher priority are rendered first')),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', '-priority', 'created'], name='thumbnailjob_queue')],
+            },
+        ),
+    ]
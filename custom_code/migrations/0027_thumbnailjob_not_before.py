@@ -0,0 +1,18 @@
+# Generated by Django 5.2.12 on 2026-10-19 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('custom_code', '0026_thumbnailjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thumbnailjob',
+            name='not_before',
+            field=models.DateTimeField(blank=True, help_text='A pending job is not run, and a failed one not requeued, before this time', null=True),
+        ),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations
+import ast
+import json
+
+
+def decode_string_values(apps, schema_editor):
+    """
+    Older ReducedDatums were saved with their value as a JSON-encoded
+    string rather than an object, which the value__has_key lookups
+    used by the plots and summaries never match
+    """
+    ReducedDatum = apps.get_model('tom_dataproducts', 'ReducedDatum')
+    datums = ReducedDatum.objects.extra(where=["jsonb_typeof(value) = 'string'"])
+    decoded = 0
+    for rd in datums.iterator(chunk_size=2000):
+        if not isinstance(rd.value, str):
+            continue
+        try:
+            try:
+                value = json.loads(rd.value)
+            except json.JSONDecodeError:
+                # Some were stored as Python dict reprs
+                value = ast.literal_eval(rd.value)
+            if not isinstance(value, dict):
+                raise ValueError('not a JSON object')
+            rd.value = value
+            rd.save(update_fields=['value'])
+            decoded += 1
+        except Exception as e:
+            print(f'Could not decode value for ReducedDatum {rd.id}: {rd.value} — {e}')
+    if decoded:
+        # Historical models do not fire the summary signals
+        print(f'Decoded {decoded} ReducedDatum values, run backfill_target_summaries to update the summaries')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('custom_code', '0027_thumbnailjob_not_before'),
+        ('tom_dataproducts', '0014_alter_reduceddatum_timestamp'),
+    ]
+
+    operations = [
+        migrations.RunPython(decode_string_values, migrations.RunPython.noop),
+    ]
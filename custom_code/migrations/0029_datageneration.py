@@ -0,0 +1,26 @@
+# Generated by Django 5.2.12 on 2026-10-18 21:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('custom_code', '0028_decode_reduceddatum_values'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataGeneration',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_type', models.CharField(max_length=100)),
+                ('generation', models.PositiveBigIntegerField(default=0)),
+                ('target', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='custom_code.snextarget')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('target', 'data_type'), name='datageneration_target_data_type')],
+            },
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 from tom_targets.models import Target
 from custom_code.target_models import SNExTarget
@@ -559,3 +560,236 @@ class TimeUsed(models.Model):
 
     class Meta:
         unique_together = ['semester_name', 'telescope_class']
+
+
+class TargetDataSummary(models.Model):
+    """
+    Denormalized counts and dates of a target's ReducedDatums, kept up to
+    date by custom_code.signals and the SNEx1 sync (see custom_code.summaries)
+    so that the target filter page doesn't have to scan ReducedDatum.
+    """
+    target = models.OneToOneField(
+        Target, on_delete=models.CASCADE, primary_key=True, related_name='data_summary'
+    )
+
+    phot_count = models.IntegerField(
+        default=0, db_index=True, verbose_name='Photometry Count',
+        help_text='Number of photometry points with a magnitude'
+    )
+
+    spec_count = models.IntegerField(
+        default=0, db_index=True, verbose_name='Spectra Count',
+        help_text='Number of spectra'
+    )
+
+    first_datum = models.DateTimeField(
+        null=True, blank=True, db_index=True, verbose_name='First Datum',
+        help_text='Timestamp of the earliest ReducedDatum of any type'
+    )
+
+    last_datum = models.DateTimeField(
+        null=True, blank=True, db_index=True, verbose_name='Last Datum',
+        help_text='Timestamp of the latest ReducedDatum of any type'
+    )
+
+    first_phot = models.DateTimeField(
+        null=True, blank=True, db_index=True, verbose_name='First Photometry',
+        help_text='Timestamp of the earliest photometry point with a magnitude'
+    )
+
+    last_phot = models.DateTimeField(
+        null=True, blank=True, db_index=True, verbose_name='Last Photometry',
+        help_text='Timestamp of the latest photometry point with a magnitude'
+    )
+
+    last_mag = models.FloatField(
+        null=True, blank=True, db_index=True, verbose_name='Last Magnitude',
+        help_text='Magnitude of the latest photometry point'
+    )
+
+    last_filter = models.CharField(
+        max_length=50, blank=True, default='', verbose_name='Last Filter',
+        help_text='Filter of the latest photometry point'
+    )
+
+    brightest_mag = models.FloatField(
+        null=True, blank=True, db_index=True, verbose_name='Brightest Magnitude',
+        help_text='Brightest magnitude in any filter'
+    )
+
+    first_spec = models.DateTimeField(
+        null=True, blank=True, db_index=True, verbose_name='First Spectrum',
+        help_text='Timestamp of the earliest spectrum'
+    )
+
+    last_spec = models.DateTimeField(
+        null=True, blank=True, db_index=True, verbose_name='Last Spectrum',
+        help_text='Timestamp of the latest spectrum'
+    )
+
+    modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Data summary for target {self.target_id}'
+
+
+class TargetNameKey(models.Model):
+    """
+    Normalized lookup key for the name and every alias of a target, kept
+    up to date by custom_code.signals (see custom_code.names) so that
+    name searches hit a trigram index instead of scanning targets
+    joined to their aliases.
+    """
+    target = models.ForeignKey(Target, on_delete=models.CASCADE, related_name='name_keys')
+
+    name = models.CharField(
+        max_length=100, verbose_name='Name',
+        help_text='The name or alias as stored on the target'
+    )
+
+    key = models.CharField(
+        max_length=100, db_index=True, verbose_name='Key',
+        help_text='Lowercase compact form of the name used for matching'
+    )
+
+    is_alias = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['key'], name='targetnamekey_key_prefix', opclasses=['varchar_pattern_ops']),
+            GinIndex(fields=['key'], name='targetnamekey_key_trgm', opclasses=['gin_trgm_ops']),
+        ]
+
+    def __str__(self):
+        return f'{self.key} -> target {self.target_id}'
+
+
+class DataGeneration(models.Model):
+    """
+    Generation counter of a target's ReducedDatums of one data type,
+    bumped when they are changed in place or their permissions change,
+    which versions the cached plots (see custom_code.render_cache). It is
+    kept here rather than in the cache, which culls entries.
+    """
+    # Bumped from the ReducedDatum delete signals while a target is being
+    # deleted, so the target may already be gone
+    target = models.ForeignKey(
+        Target, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+'
+    )
+
+    data_type = models.CharField(max_length=100)
+
+    generation = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['target', 'data_type'], name='datageneration_target_data_type'),
+        ]
+
+    def __str__(self):
+        return f'{self.data_type} generation {self.generation} of target {self.target_id}'
+
+
+class SyncCheckpoint(models.Model):
+    """
+    Progress of an incremental sync through the SNEx1 db_changes table,
+    see custom_code.scripts.sync_databases.run_incremental.
+    """
+    name = models.CharField(max_length=50, unique=True)
+
+    watermark = models.BigIntegerField(
+        default=0, verbose_name='Watermark',
+        help_text='Highest db_changes id that has been processed'
+    )
+
+    compacted_to = models.BigIntegerField(
+        default=0, verbose_name='Compacted To',
+        help_text='Processed db_changes rows up to this id have been deleted from SNEx1'
+    )
+
+    retry_ids = models.JSONField(
+        default=list, blank=True, verbose_name='Retry IDs',
+        help_text='db_changes ids at or below the watermark that failed and are retried on the next run'
+    )
+
+    modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name} at {self.watermark}'
+
+
+class Thumbnail(models.Model):
+    """
+    Index of the rendered image thumbnails in settings.THUMB_DIR,
+    see custom_code.thumbnail_store.
+    """
+    key = models.CharField(
+        max_length=40, unique=True,
+        help_text='SHA-1 of the FITS basename and the rendering parameters'
+    )
+
+    basename = models.CharField(max_length=100, db_index=True, verbose_name='FITS Basename')
+    grow = models.FloatField()
+    sigma = models.FloatField()
+    x = models.FloatField()
+    y = models.FloatField()
+    ticks = models.BooleanField(default=False)
+
+    path = models.CharField(max_length=200, help_text='Path of the image relative to THUMB_DIR')
+    size = models.BigIntegerField(default=0, help_text='Size of the image in bytes')
+
+    created = models.DateTimeField(auto_now_add=True)
+    last_accessed = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f'{self.basename} grow={self.grow} sigma={self.sigma} ({self.key})'
+
+
+THUMBNAIL_JOB_STATUS_CHOICES = (
+    ('pending', 'Pending'),
+    ('running', 'Running'),
+    ('failed', 'Failed')
+)
+
+
+class ThumbnailJob(models.Model):
+    """
+    A thumbnail waiting to be rendered by the thumbnail_worker command,
+    see custom_code.thumbnail_store.enqueue. Jobs are deleted once their
+    thumbnail is stored, and only failed ones are kept.
+    """
+    key = models.CharField(
+        max_length=40, unique=True,
+        help_text='Key of the Thumbnail this job renders'
+    )
+
+    filename = models.CharField(max_length=300, verbose_name='FITS Path')
+    grow = models.FloatField()
+    sigma = models.FloatField()
+    x = models.FloatField()
+    y = models.FloatField()
+    ticks = models.BooleanField(default=False)
+
+    status = models.CharField(
+        max_length=10, choices=THUMBNAIL_JOB_STATUS_CHOICES, default='pending'
+    )
+    priority = models.IntegerField(
+        default=0, help_text='Jobs with a higher priority are rendered first'
+    )
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    not_before = models.DateTimeField(
+        null=True, blank=True,
+        help_text='A pending job is not run, and a failed one not requeued, before this time'
+    )
+
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', '-priority', 'created'], name='thumbnailjob_queue'),
+        ]
+
+    def __str__(self):
+        return f'{self.filename} grow={self.grow} sigma={self.sigma} ({self.status})'
@@ -0,0 +1,196 @@
+"""
+Normalized-name index and resolver for targets.
+
+Every target name and alias gets a TargetNameKey row whose key is the
+name run through _normalize_view_object_name, with the SN/AT prefix
+dropped and lowercased, so that `SN 2024ggi`, `AT2024ggi` and `24ggi` all
+share the key `2024ggi`. Keys are matched with exact, prefix (btree) and
+substring (pg_trgm GIN) lookups, and the matches are ranked in that order.
+"""
+from collections import namedtuple
+import threading
+
+from django.db import transaction
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.functions import Length
+from tom_targets.models import Target, TargetName
+
+from custom_code.models import TargetNameKey
+from custom_code.utils import _normalize_view_object_name
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+EXACT, PREFIX, SUBSTRING = 0, 1, 2
+
+NameMatch = namedtuple('NameMatch', ['target_id', 'name', 'rank'])
+
+_pending = threading.local()
+
+
+def name_key(name):
+    """
+    Returns the lookup key of a target name or search string
+    """
+    canonical = _normalize_view_object_name(name)
+    # The normalizer always returns a two letter SN or AT prefix
+    return canonical[2:].lower()[:100]
+
+
+def search_keys(query):
+    """
+    Returns the keys to look up for a search string, which also include
+    the raw compact form in case normalization mangles it (e.g. `99ex`)
+    """
+    keys = {name_key(query), (query or '').strip().replace(' ', '').lower()}
+    keys.discard('')
+    return keys
+
+
+def index_target_names(target_ids):
+    """
+    Rebuilds the name keys of the given targets from their names and aliases
+    """
+    target_ids = set(Target.objects.filter(id__in=set(target_ids)).values_list('id', flat=True))
+    if not target_ids:
+        return 0
+
+    rows = [
+        TargetNameKey(target_id=target_id, name=name, key=name_key(name), is_alias=False)
+        for target_id, name in Target.objects.filter(id__in=target_ids).values_list('id', 'name')
+    ]
+    rows += [
+        TargetNameKey(target_id=target_id, name=name, key=name_key(name), is_alias=True)
+        for target_id, name in TargetName.objects.filter(target_id__in=target_ids).values_list('target_id', 'name')
+    ]
+    rows = [row for row in rows if row.key]
+
+    TargetNameKey.objects.filter(target_id__in=target_ids).delete()
+    TargetNameKey.objects.bulk_create(rows)
+    return len(rows)
+
+
+def index_on_commit(target_ids):
+    """
+    Rebuilds the name keys of the given targets once the current transaction
+    commits. Deleting a target deletes its name keys and then its aliases,
+    so rebuilding them from the alias delete signal would leave a key row
+    pointing at the deleted target
+    """
+    pending = getattr(_pending, 'target_ids', None)
+    if pending is None:
+        pending = _pending.target_ids = set()
+    pending.update(target_ids)
+    # Registered on every call, as rolling back a savepoint drops its
+    # callbacks; the callbacks after the first find nothing pending
+    transaction.on_commit(_index_pending)
+
+
+def _index_pending():
+    target_ids = getattr(_pending, 'target_ids', None)
+    if not target_ids:
+        return
+    _pending.target_ids = set()
+    index_target_names(target_ids)
+
+
+def resolve_target_name(query, limit=20, exact=False):
+    """
+    Returns a list of NameMatch for the targets whose name or an alias
+    matches query, best first: exact key matches, then key prefix
+    matches, then substring matches, primary names before aliases and
+    shorter names first. Each target appears once, with its best match
+    """
+    keys = search_keys(query)
+    if not keys:
+        return []
+
+    if exact:
+        match_q = Q(key__in=keys)
+    elif not name_key(query):
+        # A bare SN or AT prefix, which keys drop, so match the names as stored
+        match_q = Q(name__icontains=query.strip())
+    else:
+        match_q = Q()
+        for key in keys:
+            match_q |= Q(key__contains=key)
+
+    rank = Case(
+        When(key__in=keys, then=Value(EXACT)),
+        *[When(key__startswith=key, then=Value(PREFIX)) for key in keys],
+        default=Value(SUBSTRING),
+        output_field=IntegerField()
+    )
+    rows = TargetNameKey.objects.filter(match_q).annotate(
+        rank=rank, key_length=Length('key')
+    ).order_by('rank', 'is_alias', 'key_length', 'target_id').values_list('target_id', 'name', 'rank')
+
+    matches = {}
+    # Targets usually have a handful of names, so this is enough to fill limit
+    for target_id, name, match_rank in rows[:limit * 5]:
+        if target_id not in matches:
+            matches[target_id] = NameMatch(target_id, name, match_rank)
+            if len(matches) == limit:
+                break
+    return list(matches.values())
+
+
+def target_names(target_ids):
+    """
+    Returns a dictionary of target_id -> (name, [aliases]) from the index
+    """
+    names = {}
+    rows = TargetNameKey.objects.filter(target_id__in=target_ids).order_by('id').values_list('target_id', 'name', 'is_alias')
+    for target_id, name, is_alias in rows:
+        primary, aliases = names.get(target_id, (None, []))
+        if is_alias:
+            aliases.append(name)
+        else:
+            primary = name
+        names[target_id] = (primary, aliases)
+    return names
+
+
+def cross_match_names(names, chunk_size=500):
+    """
+    Resolves a batch of names against every target name and alias with
+    one query per chunk_size names
+
+    Returns a dictionary of name -> target_id for the names that match,
+    picking for each name its best ranked match as in resolve_target_name
+    """
+    keys_by_name = {name: search_keys(name) for name in set(names) if name}
+    names = [name for name, keys in keys_by_name.items() if keys]
+
+    matched = {}
+    for start in range(0, len(names), chunk_size):
+        chunk = names[start:start + chunk_size]
+        keys = set().union(*(keys_by_name[name] for name in chunk))
+
+        match_q = Q()
+        for key in keys:
+            match_q |= Q(key__contains=key)
+        rows = list(TargetNameKey.objects.filter(match_q).annotate(
+            key_length=Length('key')
+        ).order_by('is_alias', 'key_length', 'target_id').values_list('target_id', 'key'))
+
+        for name in chunk:
+            best = None
+            for target_id, key in rows:
+                for search_key in keys_by_name[name]:
+                    if key == search_key:
+                        rank = EXACT
+                    elif key.startswith(search_key):
+                        rank = PREFIX
+                    elif search_key in key:
+                        rank = SUBSTRING
+                    else:
+                        continue
+                    if best is None or rank < best[0]:
+                        best = (rank, target_id)
+                if best is not None and best[0] == EXACT:
+                    break
+            if best is not None:
+                matched[name] = best[1]
+    return matched
@@ -0,0 +1,203 @@
+"""
+Columnar loading of photometry ReducedDatums.
+
+The light curve plots used to iterate over ReducedDatum objects one at a
+time and pull the magnitude, error and filter out of each JSON value in
+Python. Here the keys are extracted by the database in a single
+values_list query and returned as NumPy structured arrays, optionally
+grouped by (normalized) filter.
+"""
+import json
+
+from django.conf import settings
+from django.db.models.fields.json import KeyTextTransform
+from guardian.shortcuts import get_objects_for_user
+from tom_dataproducts.models import ReducedDatum
+import numpy as np
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# JSON keys pulled out of ReducedDatum.value, in the order they are queried
+PHOTOMETRY_KEYS = (
+    'magnitude', 'error', 'filter', 'background_subtracted',
+    'subtraction_algorithm', 'template_source', 'reduction_type'
+)
+
+PHOTOMETRY_DTYPE = np.dtype([
+    ('id', 'i8'),
+    ('timestamp', 'datetime64[us]'),
+    ('data_product_id', 'i8'),
+    ('magnitude', 'f8'),
+    ('error', 'f8'),
+    ('filter', object),
+    ('background_subtracted', '?'),
+    ('subtraction_algorithm', object),
+    ('template_source', object),
+    ('reduction_type', object),
+])
+
+
+def photometry_for_user(target, user, **filters):
+    """
+    Returns the photometry ReducedDatums of target that user can view,
+    respecting TARGET_PERMISSIONS_ONLY
+    """
+    datums = ReducedDatum.objects.filter(
+        target=target, data_type=settings.DATA_PRODUCT_TYPES['photometry'][0], **filters
+    )
+    if settings.TARGET_PERMISSIONS_ONLY:
+        return datums
+    return get_objects_for_user(user, 'tom_dataproducts.view_reduceddatum', klass=datums)
+
+
+def _to_float(column):
+    column = np.asarray(column, dtype=object)
+    column[(column == None) | (column == '')] = np.nan
+    try:
+        return column.astype(float)
+    except (TypeError, ValueError):
+        def convert(x):
+            try:
+                return float(x)
+            except (TypeError, ValueError):
+                return np.nan
+        return np.array([convert(x) for x in column], dtype=float)
+
+
+def _to_text(column):
+    column = np.asarray(column, dtype=object)
+    column[column == None] = ''
+    return column
+
+
+def string_valued(datums):
+    """
+    Returns the datums whose value is a JSON-encoded string rather than an
+    object, which older code saved and which key lookups never match
+    """
+    return datums.extra(where=['jsonb_typeof("{}"."value") = %s'.format(ReducedDatum._meta.db_table)], params=['string'])
+
+
+def decode_value(value):
+    """
+    Returns the dictionary held by a ReducedDatum value, decoding it if it
+    is a JSON-encoded string, or an empty dictionary
+    """
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            return {}
+    return value if isinstance(value, dict) else {}
+
+
+def _key_text(value):
+    # As KeyTextTransform returns it
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return value
+
+
+def load_photometry(datums, require=('magnitude',)):
+    """
+    Loads a queryset of photometry ReducedDatums into a structured array
+    with one row per datum and the fields of PHOTOMETRY_DTYPE
+
+    Rows missing any of the required keys, or without a numeric
+    magnitude, are dropped. Timestamps are naive UTC and missing
+    data_product_ids are -1
+    """
+    legacy = string_valued(datums).values_list('id', 'timestamp', 'data_product_id', 'value')
+    for key in require:
+        datums = datums.filter(**{'value__has_key': key})
+
+    annotations = {'_' + key: KeyTextTransform(key, 'value') for key in PHOTOMETRY_KEYS}
+    rows = list(
+        datums.annotate(**annotations).values_list(
+            'id', 'timestamp', 'data_product_id', *annotations.keys()
+        )
+    )
+    # Decoded in Python, see string_valued
+    for datum_id, timestamp, data_product_id, value in legacy:
+        value = decode_value(value)
+        if all(key in value for key in require):
+            rows.append((datum_id, timestamp, data_product_id, *(_key_text(value.get(key)) for key in PHOTOMETRY_KEYS)))
+
+    photometry = np.empty(len(rows), dtype=PHOTOMETRY_DTYPE)
+    if not rows:
+        return photometry
+
+    columns = list(zip(*rows))
+    photometry['id'] = columns[0]
+    photometry['timestamp'] = [t.replace(tzinfo=None) for t in columns[1]]
+    photometry['data_product_id'] = [-1 if dp is None else dp for dp in columns[2]]
+    photometry['magnitude'] = _to_float(columns[3])
+    photometry['error'] = _to_float(columns[4])
+    photometry['filter'] = _to_text(columns[5])
+    # Booleans come back as JSON text
+    photometry['background_subtracted'] = np.asarray(columns[6], dtype=object) == 'true'
+    photometry['subtraction_algorithm'] = _to_text(columns[7])
+    photometry['template_source'] = _to_text(columns[8])
+    photometry['reduction_type'] = _to_text(columns[9])
+
+    if 'magnitude' in require:
+        photometry = photometry[~np.isnan(photometry['magnitude'])]
+    return photometry
+
+
+def group_by_filter(photometry, filter_translate, default=''):
+    """
+    Splits a photometry array into a dictionary of normalized filter ->
+    structured array, in order of first appearance
+
+    Filters missing from filter_translate are mapped to default, which
+    can also be a function of the raw filter name
+    """
+    if not len(photometry):
+        return {}
+
+    raw_filters, first_index, inverse = np.unique(
+        photometry['filter'].astype(str), return_index=True, return_inverse=True
+    )
+    normalized = np.array([
+        filter_translate.get(f, default(f) if callable(default) else default) for f in raw_filters
+    ], dtype=object)
+    filters = normalized[inverse]
+
+    grouped = {}
+    for filt in normalized[np.argsort(first_index)]:
+        if filt not in grouped:
+            grouped[filt] = photometry[filters == filt]
+    return grouped
+
+
+def decimate(photometry, max_points, start=None, end=None):
+    """
+    Returns the rows of a photometry array between the naive UTC
+    datetime64 start and end (either may be None) thinned to at most
+    about max_points rows, sorted by timestamp
+
+    The time range is split into max_points // 2 equal bins and the
+    brightest and faintest points of each bin are kept, so that the
+    shape and the extremes of the light curve survive the thinning
+    """
+    if start is not None:
+        photometry = photometry[photometry['timestamp'] >= start]
+    if end is not None:
+        photometry = photometry[photometry['timestamp'] <= end]
+
+    if len(photometry) > max_points:
+        n_bins = max(max_points // 2, 1)
+        t = photometry['timestamp'].astype('i8')
+        span = t.max() - t.min() + 1
+        bins = ((t - t.min()) / span * n_bins).astype('i8')
+
+        order = np.lexsort((photometry['magnitude'], bins))
+        sorted_bins = bins[order]
+        first = np.flatnonzero(np.r_[True, sorted_bins[1:] != sorted_bins[:-1]])
+        last = np.r_[first[1:] - 1, len(order) - 1]
+        photometry = photometry[np.unique(np.r_[order[first], order[last]])]
+
+    return photometry[np.argsort(photometry['timestamp'], kind='stable')]
@@ -0,0 +1,116 @@
+"""
+Cache for the static collapse plots shown on the target list pages.
+
+Rendered plot divs are keyed by the target, the groups of the requesting
+user (which determine which ReducedDatums they can see) and a version of
+the target's data. The data version is made of the latest ReducedDatum id
+and count for each data type, plus a DataGeneration counter that is bumped
+by the signals in custom_code.signals whenever a ReducedDatum or its group
+permissions change. The counters live in the database, since a culled
+cache entry would reset to 0 and bring back a plot cached before the bump. Airmass plots do not depend on the data, so they are
+keyed on the coordinates and a time bucket instead.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Max
+from tom_dataproducts.models import ReducedDatum
+
+from custom_code.models import DataGeneration
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+RENDER_CACHE_TIMEOUT = getattr(settings, 'RENDER_CACHE_TIMEOUT', 24 * 3600)
+AIRMASS_BUCKET = 30 * 60 #seconds, the collapse plot grid spacing
+
+
+def permission_fingerprint(user):
+    """
+    Returns a short string identifying the set of groups a user can view
+    data through, so that users with the same groups share cache entries
+    """
+    fingerprint = getattr(user, '_render_cache_fingerprint', None)
+    if fingerprint is None:
+        if user.is_superuser:
+            fingerprint = 'superuser'
+        else:
+            group_ids = sorted(user.groups.values_list('id', flat=True))
+            fingerprint = hashlib.md5(','.join(str(g) for g in group_ids).encode()).hexdigest()[:12]
+        user._render_cache_fingerprint = fingerprint
+    return fingerprint
+
+
+def invalidate(target_id, data_type):
+    """
+    Bumps the generation counter so that every cached plot of this
+    target that depends on data_type is re-rendered
+    """
+    invalidate_targets([target_id], data_type)
+
+
+def invalidate_targets(target_ids, data_type):
+    """
+    Bumps the generation counters of data_type for all of target_ids
+    with two queries
+    """
+    target_ids = set(target_ids)
+    if not target_ids:
+        return
+    DataGeneration.objects.bulk_create(
+        [DataGeneration(target_id=target_id, data_type=data_type) for target_id in target_ids],
+        ignore_conflicts=True
+    )
+    DataGeneration.objects.filter(
+        target_id__in=target_ids, data_type=data_type
+    ).update(generation=F('generation') + 1)
+
+
+def data_version(target_id, data_types):
+    """
+    Returns a string that changes whenever the target's data of
+    any of the given types changes
+    """
+    rows = ReducedDatum.objects.filter(
+        target_id=target_id, data_type__in=data_types
+    ).values('data_type').annotate(latest=Max('id'), count=Count('id'))
+    latest = {row['data_type']: '{}.{}'.format(row['latest'], row['count']) for row in rows}
+
+    generations = dict(DataGeneration.objects.filter(
+        target_id=target_id, data_type__in=data_types
+    ).values_list('data_type', 'generation'))
+    return '-'.join(
+        '{}.{}'.format(latest.get(data_type, '0.0'), generations.get(data_type, 0))
+        for data_type in data_types
+    )
+
+
+def plot_key(kind, target_id, user, data_types):
+    return 'render:{}:{}:{}:{}'.format(
+        kind, target_id, permission_fingerprint(user), data_version(target_id, data_types)
+    )
+
+
+def airmass_key(kind, target, bucket=AIRMASS_BUCKET):
+    """
+    Airmass plots only depend on the coordinates, so this also works for
+    galaxies and broker targets that share the collapse templates
+    """
+    return 'render:{}:{:.6f}:{:.6f}:{}'.format(
+        kind, float(target.ra), float(target.dec), int(time.time() // bucket)
+    )
+
+
+def get_or_render(key, render, timeout=RENDER_CACHE_TIMEOUT):
+    """
+    Returns the cached plot for key, calling render() to make
+    and store it on a miss
+    """
+    plot = cache.get(key)
+    if plot is None:
+        plot = render()
+        cache.set(key, plot, timeout)
+    return plot
@@ -1,26 +1,48 @@
 #!/usr/bin/env python
 
-from sqlalchemy import create_engine, and_, pool, select
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.automap import automap_base
+from sqlalchemy import and_, select
 from sqlalchemy.sql import func
 
 import json
-from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 import os
 import datetime
 from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from tom_dataproducts.models import DataProduct, data_product_path, ReducedDatum
 from django.contrib.auth.models import Group
-from custom_code.utils import update_permissions
-from custom_code.models import ReducedDatumExtra
+from custom_code import render_cache, snex1, spectra, summaries, thumbnail_store
+from custom_code.utils import bulk_update_permissions, update_permissions
+from custom_code.models import ReducedDatumExtra, SyncCheckpoint
+from custom_code.summaries import deferred_summaries
+from custom_code.sync_runner import ParallelSyncRunner
 from guardian.shortcuts import assign_perm
 from tom_targets.models import Target, TargetName
 
 import logging
 logger = logging.getLogger(__name__)
 
-engine1 = create_engine(settings.SNEX1_DB_URL)
+SYNC_BATCH_SIZE = 5000 # db_changes rows per window
+COMPACT_CHUNK_SIZE = 10000 # db_changes ids per compaction delete
+SNEX1_CHECKPOINT = 'snex1_db_changes'
+SYNCED_TABLES = ('targets', 'targetnames', 'photlco', 'spec')
+
+# SNEx1 table handles by module attribute name
+SNEX1_TABLES = {
+    'Db_Changes': 'db_changes',
+    'Photlco': 'photlco',
+    'Spec': 'spec',
+    'Targets': 'targets',
+    'Target_Names': 'targetnames',
+    'Classifications': 'classifications',
+    'Groups': 'groups',
+}
+
+_snex1_groups = None
+
 
 @contextmanager
 def get_session(db_address=settings.SNEX1_DB_URL):
@@ -31,26 +53,17 @@ def get_session(db_address=settings.SNEX1_DB_URL):
     ----------
     session: SQLAlchemy database session
     """
-    Base = automap_base()
-    if db_address == settings.SNEX1_DB_URL:
-        Base.metadata.bind = engine1
-        db_session = sessionmaker(bind=engine1, autoflush=False, expire_on_commit=False)
-
-    session = db_session()
-    try:
+    with snex1.session_scope(db_address) as session:
         yield session
-        session.commit()
-    except:
-        session.rollback()
-        raise
-    finally:
-        session.close()
 
 
 def load_table(tablename, db_address=settings.SNEX1_DB_URL):
     """
     Load a table with its data from a database
 
+    The schema is reflected the first time any table is loaded in
+    this process, and memoized after that
+
     Parameters
     ----------
     tablename: str, the name of the table to load
@@ -60,30 +73,53 @@ def load_table(tablename, db_address=settings.SNEX1_DB_URL):
     ----------
     table: sqlalchemy table object
     """
-    Base = automap_base()
-    engine = create_engine(db_address, poolclass=pool.NullPool)
-    Base.prepare(autoload_with=engine)
+    return snex1.get_table(tablename, db_address)
+
+
+class _Tables:
+    """
+    Our SNex1 db tables as Classes, loaded on first use
+    """
+    def __getattr__(self, name):
+        if name not in SNEX1_TABLES:
+            raise AttributeError(name)
+        table = load_table(SNEX1_TABLES[name], db_address=settings.SNEX1_DB_URL)
+        setattr(self, name, table)
+        return table
+
+
+tables = _Tables()
+
+
+def get_snex1_groups():
+    """
+    Returns a dictionary of the groups in the SNex1 db, name -> idcode,
+    queried once per process
+    """
+    global _snex1_groups
+    if _snex1_groups is None:
+        with get_session(db_address=settings.SNEX1_DB_URL) as db_session:
+            _snex1_groups = {x.name: x.idcode for x in db_session.query(tables.Groups)}
+    return _snex1_groups
 
-    table = getattr(Base.classes, tablename)
-    return table
 
+def warm():
+    """
+    Loads the SNex1 tables and groups up front, so that a sync job
+    fails early if SNex1 is unreachable
+    """
+    for name in SNEX1_TABLES:
+        getattr(tables, name)
+    get_snex1_groups()
 
-### Define our SNex1 db tables as Classes
-Db_Changes = load_table('db_changes', db_address=settings.SNEX1_DB_URL)
-Photlco = load_table('photlco', db_address=settings.SNEX1_DB_URL)
-Spec = load_table('spec', db_address=settings.SNEX1_DB_URL)
-Targets = load_table('targets', db_address=settings.SNEX1_DB_URL)
-Target_Names = load_table('targetnames', db_address=settings.SNEX1_DB_URL)
-Classifications = load_table('classifications', db_address=settings.SNEX1_DB_URL)
-Groups = load_table('groups', db_address=settings.SNEX1_DB_URL)
-Targets = load_table('targets', db_address=settings.SNEX1_DB_URL)
-Target_Names = load_table('targetnames', db_address=settings.SNEX1_DB_URL)
 
-### Make a dictionary of the groups in the SNex1 db
-with get_session(db_address=settings.SNEX1_DB_URL) as db_session:
-    snex1_groups = {}
-    for x in db_session.query(Groups):
-        snex1_groups[x.name] = x.idcode
+def __getattr__(name):
+    # Keep `from sync_databases import Spec`-style access working
+    if name in SNEX1_TABLES:
+        return getattr(tables, name)
+    if name == 'snex1_groups':
+        return get_snex1_groups()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def query_db_changes(table, action, db_address=settings.SNEX1_DB_URL):
@@ -98,8 +134,8 @@ def query_db_changes(table, action, db_address=settings.SNEX1_DB_URL):
     """
     #table_dict = {'photlco': Photlco, 'spec': Spec}
     with get_session(db_address=db_address) as db_session:
-        criteria = and_(Db_Changes.tablename==table, Db_Changes.action==action)
-        record = db_session.query(Db_Changes).filter(criteria)
+        criteria = and_(tables.Db_Changes.tablename==table, tables.Db_Changes.action==action)
+        record = db_session.query(tables.Db_Changes).filter(criteria)
     return record
 
 
@@ -121,14 +157,14 @@ def get_current_row(table, id_, db_address=settings.SNEX1_DB_URL):
 
 def get_spec_row_from_filename(filename, db_address=settings.SNEX1_DB_URL):
     with get_session(db_address=db_address) as db_session:
-        criteria = getattr(Spec, 'filename') == filename
-        record = db_session.query(Spec).filter(criteria).first()
+        criteria = getattr(tables.Spec, 'filename') == filename
+        record = db_session.query(tables.Spec).filter(criteria).first()
     return record
 
 def get_spec_row_from_id(id_, db_address=settings.SNEX1_DB_URL):
     with get_session(db_address=db_address) as db_session:
-        criteria = getattr(Spec, 'id') == id_
-        record = db_session.query(Spec).filter(criteria).first()
+        criteria = getattr(tables.Spec, 'id') == id_
+        record = db_session.query(tables.Spec).filter(criteria).first()
     return record
 
 def delete_row(table, id_, db_address=settings.SNEX1_DB_URL):
@@ -147,241 +183,526 @@ def delete_row(table, id_, db_address=settings.SNEX1_DB_URL):
         db_session.commit()
 
 
-def update_phot(action):
+def get_standard_ids(db_address=settings.SNEX1_DB_URL):
+    """
+    Returns the set of pipeline ids of targets classified as standards
+    """
+    with get_session(db_address=db_address) as db_session:
+        standard_classification_row = db_session.query(tables.Classifications).filter(tables.Classifications.name=='Standard').first()
+        if standard_classification_row is None:
+            return set()
+        standard_list = db_session.query(tables.Targets.id).filter(tables.Targets.classificationid==standard_classification_row.id)
+        return {x.id for x in standard_list}
+
+
+def phot_timestamp(phot_row):
+    """
+    Returns the observation time of a Photlco row as an aware UTC datetime
+    """
+    dobs = phot_row.dateobs
+    tobs = phot_row.ut
+    if tobs is None:
+        tobs = '00:00:00'
+    if dobs is None:
+        dobs = datetime.datetime.today().strftime('%Y-%m-%d')
+    time = parse_datetime('{} {}'.format(dobs, tobs))
+    if time is not None and timezone.is_naive(time):
+        time = timezone.make_aware(time, datetime.timezone.utc)
+    return time
+
+
+def phot_value(phot_row):
+    """
+    Returns the ReducedDatum value for a Photlco row, which is just the
+    snex_id for rows without a usable magnitude
+    """
+    id_ = int(phot_row.id)
+    if int(phot_row.mag) == 9999:
+        return {'snex_id': id_}
+
+    if int(phot_row.filetype) == 1:
+        return {'magnitude': float(phot_row.mag), 'filter': phot_row.filter, 'error': float(phot_row.dmag), 'snex_id': id_, 'background_subtracted': False, 'telescope': phot_row.telescope, 'instrument': phot_row.instrument}
+
+    elif int(phot_row.filetype) == 3 and phot_row.difftype is not None:
+        if int(phot_row.difftype) == 0:
+            subtraction_algorithm = 'Hotpants'
+        elif int(phot_row.difftype) == 1:
+            subtraction_algorithm = 'PyZOGY'
+        filename = phot_row.filename
+        if 'SDSS' in filename:
+            template_source = 'SDSS'
+        else:
+            template_source = 'LCO'
+        return {'magnitude': float(phot_row.mag), 'filter': phot_row.filter, 'error': float(phot_row.dmag), 'snex_id': id_, 'background_subtracted': True, 'subtraction_algorithm': subtraction_algorithm, 'template_source': template_source, 'reduction_type': 'manual', 'telescope': phot_row.telescope, 'instrument': phot_row.instrument}
+
+    return {'snex_id': id_}
+
+
+def query_db_changes_window(table, action, after_id=0, limit=SYNC_BATCH_SIZE, db_address=settings.SNEX1_DB_URL):
+    """
+    Returns up to limit db_changes rows for table and action with ids
+    above after_id, in id order
+    """
+    with get_session(db_address=db_address) as db_session:
+        criteria = and_(tables.Db_Changes.tablename==table, tables.Db_Changes.action==action, tables.Db_Changes.id > after_id)
+        return db_session.query(tables.Db_Changes).filter(criteria).order_by(tables.Db_Changes.id).limit(limit).all()
+
+
+def delete_rows(table, ids, db_address=settings.SNEX1_DB_URL):
+    """
+    Deletes the rows of table with the given ids in one statement
+    """
+    if not ids:
+        return
+    with get_session(db_address=db_address) as db_session:
+        db_session.query(table).filter(table.id.in_(list(ids))).delete(synchronize_session=False)
+
+
+def _frame_position(position):
+    return 9999 if position is None else int(round(position))
+
+
+def _sync_phot_rows(phot_rows, standard_ids):
+    """
+    Upserts the photometry ReducedDatums of a batch of Photlco rows
+
+    Returns the set of Photlco ids that were handled, leaving out rows
+    whose target is not in SNEx2 yet so that they are retried
+
+    If writing the batch fails it is retried in halves, so that only the
+    rows that fail on their own are left out and the rest are synced
+    """
+    try:
+        return _sync_phot_batch(phot_rows, standard_ids)
+    except Exception as e:
+        if len(phot_rows) == 1:
+            logger.exception(f'Failed to sync photlco row {next(iter(phot_rows))} with exception {e}')
+            return set()
+        logger.warning(f'Failed to sync a batch of {len(phot_rows)} photlco rows with exception {e}, retrying in halves')
+
+    ids = sorted(phot_rows)
+    half = len(ids) // 2
+    return (
+        _sync_phot_rows({id_: phot_rows[id_] for id_ in ids[:half]}, standard_ids)
+        | _sync_phot_rows({id_: phot_rows[id_] for id_ in ids[half:]}, standard_ids)
+    )
+
+
+def _sync_phot_batch(phot_rows, standard_ids):
+    handled = set()
+    pipeline_ids = set()
+    values = {}
+    for id_, phot_row in phot_rows.items():
+        try:
+            if phot_row.targetid in standard_ids or int(phot_row.filetype) not in (1, 3):
+                handled.add(id_)
+                continue
+            values[id_] = (phot_value(phot_row), phot_timestamp(phot_row))
+        except Exception as e:
+            logger.exception(f'Failed to process photlco row {id_} with exception {e}')
+            continue
+        pipeline_ids.add(phot_row.targetid)
+
+    target_ids = dict(Target.objects.filter(pipeline_id__in=pipeline_ids).values_list('pipeline_id', 'id'))
+    to_sync = {
+        id_: phot_rows[id_] for id_ in values
+        if phot_rows[id_].targetid in target_ids
+    }
+    if not to_sync:
+        return handled
+
+    # Existing datums by (target, snex_id), with placeholders (value is only the snex_id) last
+    existing = {}
+    rds = ReducedDatum.objects.filter(
+        data_type='photometry', target_id__in=set(target_ids.values()), value__snex_id__in=list(to_sync.keys())
+    ).order_by('id').only('id', 'target_id', 'value')
+    for rd in rds:
+        existing.setdefault((rd.target_id, int(rd.value['snex_id'])), []).append(rd)
+
+    to_create, to_update, to_delete = [], [], []
+    groups = {}
+    new_frames = []
+    for id_, phot_row in to_sync.items():
+        target_id = target_ids[phot_row.targetid]
+        rds = existing.get((target_id, id_), [])
+        placeholders = [rd for rd in rds if len(rd.value) == 1]
+        full = [rd for rd in rds if len(rd.value) != 1]
+        if full:
+            to_delete += [rd.id for rd in placeholders]
+            rd = full[0]
+            if len(full) > 1:
+                logger.warning(f'Found {len(full)} photometry points for snex_id {id_}, updating {rd.id}')
+        elif placeholders:
+            to_delete += [rd.id for rd in placeholders[1:]]
+            rd = placeholders[0]
+        else:
+            rd = ReducedDatum(target_id=target_id, data_type='photometry')
+
+        rd.value, rd.timestamp = values[id_]
+        rd.source_name = ''
+        rd.source_location = ''
+        if rd.pk is None:
+            to_create.append(rd)
+            if int(phot_row.filetype) == 1 and phot_row.filepath and phot_row.filename:
+                new_frames.append(phot_row)
+        else:
+            to_update.append(rd)
+
+        if phot_row.groupidcode is not None:
+            groups.setdefault(int(phot_row.groupidcode), []).append(rd)
+
+    with transaction.atomic():
+        if to_delete:
+            ReducedDatum.objects.filter(id__in=to_delete).delete()
+        ReducedDatum.objects.bulk_update(to_update, ['value', 'timestamp', 'source_name', 'source_location'], batch_size=1000)
+        ReducedDatum.objects.bulk_create(to_create, batch_size=1000)
+
+        for groupid, group_rds in groups.items():
+            bulk_update_permissions(groupid, 'view_reduceddatum', ReducedDatum.objects.filter(id__in=[rd.id for rd in group_rds]), get_snex1_groups())
+
+    # Bulk operations skip the model signals
+    touched = {rd.target_id for rd in to_update + to_create}
+    render_cache.invalidate_targets(touched, 'photometry')
+    summaries.targets_changed(touched)
+
+    try:
+        queued = thumbnail_store.enqueue_frames(
+            (row.filepath, row.filename, _frame_position(row.psfx), _frame_position(row.psfy)) for row in new_frames
+        )
+        if queued:
+            logger.info(f'Queued {queued} thumbnails of new frames')
+    except Exception as e:
+        logger.exception(f'Failed to queue thumbnails of new frames with exception {e}')
+
+    logger.info(f'Photometry batch: {len(to_create)} created, {len(to_update)} updated, {len(to_delete)} duplicates removed')
+    return handled | set(to_sync.keys())
+
+
+def sync_phot_changes(changes, standard_ids):
+    """
+    Applies a batch of db_changes rows for the photlco table to the SNex2 db,
+    using the last action recorded for each photlco row
+
+    Returns the ids of the db_changes rows that were applied
+    """
+    last_action = {}
+    for change in changes:
+        last_action[change.rowid] = change.action
+
+    deleted = {rowid for rowid, action in last_action.items() if action == 'delete'}
+    if deleted:
+        ReducedDatum.objects.filter(data_type='photometry', value__snex_id__in=list(deleted)).delete()
+
+    row_ids = set(last_action.keys()) - deleted
+    handled = set(deleted)
+    if row_ids:
+        with get_session(db_address=settings.SNEX1_DB_URL) as db_session:
+            phot_rows = {row.id: row for row in db_session.query(tables.Photlco).filter(tables.Photlco.id.in_(list(row_ids)))}
+
+        handled |= _sync_phot_rows(phot_rows, standard_ids)
+        # Rows that no longer exist in photlco will come through as deletes
+        handled |= row_ids - set(phot_rows.keys())
+
+    return [change.id for change in changes if change.rowid in handled]
+
+
+def update_phot(action, standard_ids=None, batch_size=SYNC_BATCH_SIZE):
     """
     Queries the ReducedDatum table in the SNex2 db with any changes made to the Photlco table in the SNex1 db
 
+    Changes are read in windows of batch_size db_changes rows. Each window
+    fetches the Photlco rows and SNEx2 targets it needs with one query
+    each, writes the ReducedDatums in bulk and deletes the processed
+    db_changes rows in one statement
+
     Parameters
     ----------
     action: str, one of 'update', 'insert', or 'delete'
-    db_address: str, sqlalchemy address to the SNex2 db
+    standard_ids: set of pipeline ids of standard stars, computed if not given
+    batch_size: int, number of db_changes rows per window
     """
     logger.info(f'{action} to photometry. . .')
-    phot_result = query_db_changes('photlco', action, db_address=settings.SNEX1_DB_URL)
-    logger.info(f'Total photometry changes {len([change.rowid for change in phot_result])}')
+    if standard_ids is None:
+        standard_ids = get_standard_ids()
+
+    with get_session(db_address=settings.SNEX1_DB_URL) as db_session:
+        total = db_session.query(tables.Db_Changes).filter(and_(tables.Db_Changes.tablename=='photlco', tables.Db_Changes.action==action)).count()
+    logger.info(f'Total photometry changes {total}')
+
+    after_id = 0
+    processed = 0
+    while True:
+        changes = query_db_changes_window('photlco', action, after_id=after_id, limit=batch_size)
+        if not changes:
+            break
+        after_id = changes[-1].id
+        row_ids = {change.rowid for change in changes}
 
-    i = 0
-    for result in phot_result:
-        i += 1
-        logger.info(f"i={i}/{len([change.rowid for change in phot_result])}")
         try:
-            id_ = result.rowid
-            phot_row = get_current_row(Photlco, id_, db_address=settings.SNEX1_DB_URL)
+            done = sync_phot_changes(changes, standard_ids)
             if action=='delete':
-                logger.info("action = delete")
-                ReducedDatum.objects.filter(data_type = 'photometry', value__snex_id = id_).delete()
-
+                # Also clear any other pending changes to the deleted rows
                 with get_session(db_address=settings.SNEX1_DB_URL) as db_session:
-                    all_other_rows = db_session.query(Db_Changes).filter(and_(Db_Changes.tablename=='photlco', Db_Changes.rowid==id_))
-                    for row in all_other_rows:
-                        db_session.delete(row)
-                    db_session.commit()
-                    
-            else:
-                pipeline_id = phot_row.targetid
-                dobs = phot_row.dateobs
-                tobs = phot_row.ut
-                if tobs is None:
-                    tobs = '00:00:00'
-                if dobs is None:
-                    dobs = datetime.datetime.today().strftime('%Y-%m-%d')
-                time = '{} {}'.format(dobs, tobs) 
-                
-                if int(phot_row.mag) != 9999:
-                    if int(phot_row.filetype) == 1:
-                        phot = {'magnitude': float(phot_row.mag), 'filter': phot_row.filter, 'error': float(phot_row.dmag), 'snex_id': int(id_), 'background_subtracted': False, 'telescope': phot_row.telescope, 'instrument': phot_row.instrument}
-                    elif int(phot_row.filetype) == 3 and phot_row.difftype is not None:
-                        if int(phot_row.difftype) == 0:
-                            subtraction_algorithm = 'Hotpants'
-                        elif int(phot_row.difftype) == 1:
-                            subtraction_algorithm = 'PyZOGY'
-                        filename = phot_row.filename
-                        if 'SDSS' in filename:
-                            template_source = 'SDSS'
-                        else:
-                            template_source = 'LCO'
-                        phot = {'magnitude': float(phot_row.mag), 'filter': phot_row.filter, 'error': float(phot_row.dmag), 'snex_id': int(id_), 'background_subtracted': True, 'subtraction_algorithm': subtraction_algorithm, 'template_source': template_source, 'reduction_type': 'manual', 'telescope': phot_row.telescope, 'instrument': phot_row.instrument}
-                
-                    else:
-                        phot = {'snex_id': int(id_)}
-                else:
-                    phot = {'snex_id': int(id_)}
-
-                phot_groupid = phot_row.groupidcode
-
-                with get_session(db_address=settings.SNEX1_DB_URL) as db_session:
-                    standard_classification_row = db_session.query(Classifications).filter(Classifications.name=='Standard').first()
-                    if standard_classification_row is not None:
-                        standard_classification_id = standard_classification_row.id
-                    else:
-                        standard_classification_id = -1
-                    standard_list = db_session.query(Targets).filter(Targets.classificationid == standard_classification_id)
-                    standard_ids = [x.id for x in standard_list]
-                if pipeline_id not in standard_ids and int(phot_row.filetype) in (1, 3):
-                    target = Target.objects.get(pipeline_id=pipeline_id)
-                    logger.info(f'phot dictionary: {phot}')
-
-                    #check if there is a duplicate:
-                    rds = ReducedDatum.objects.filter(target = target,data_type = 'photometry',value__snex_id = id_)
-                    logger.info(f'how many reduced datums for snexid: {id_}? {len(rds)}')
-                    for rd in rds:
-                        logger.info(f'value for rd {rd.id}: {rd.value}')
-                    rd_just_snex1 = [rd for rd in rds if len(rd.value) == 1]
-
-                    if len(rd_just_snex1) < len(rds):
-                        for rd in rd_just_snex1:
-                            logger.info(f'deleting {rd.id} with value {rd.value}')
-                            rd.delete()
-
-                    elif len(rd_just_snex1) > 1:
-                        logger.info(f'Found {len(rd_just_snex1)} placeholders, keeping only one')
-                        for rd in rd_just_snex1[1:]:
-                            logger.info(f'deleting duplicate placeholder {rd.id}')
-                            rd.delete()
-
-                    rd, created = ReducedDatum.objects.update_or_create(
-                        target = target,
-                        data_type = 'photometry',
-                        value__snex_id = id_,
-                        defaults = {
-                            'value': phot,
-                            'timestamp': time,
-                            'source_name': '',
-                            'source_location': '',
-                        })
-
-
-                    if phot_groupid is not None:
-                        update_permissions(int(phot_groupid), 'view_reduceddatum', rd, snex1_groups)
+                    db_session.query(tables.Db_Changes).filter(and_(
+                        tables.Db_Changes.tablename=='photlco', tables.Db_Changes.rowid.in_(list(row_ids))
+                    )).delete(synchronize_session=False)
+                processed += len(changes)
+                continue
 
         except Exception as e:
-            logger.info(f"Failed to process photometry for db_changes row {result.id} photlco {result.rowid} with exception {e}")
+            logger.exception(f'Failed to process photometry for db_changes rows up to {after_id} with exception {e}')
             continue
 
-        delete_row(Db_Changes, result.id, db_address=settings.SNEX1_DB_URL)
+        delete_rows(tables.Db_Changes, done, db_address=settings.SNEX1_DB_URL)
+        processed += len(done)
+        logger.info(f'Processed {processed}/{total} photometry changes')
+
 
 def read_spec(filename):
     """
-    Read an ascii spectrum file and return a JSON dump-s of the wavelengths and fluxes
+    Read an ascii spectrum file and return its ReducedDatum value in the
+    compact wavelength/flux array layout
 
     Parameters
     ----------
     filename: str, the filepath+filename of the ascii file to read
     """
-    spec_file = open(filename, 'r')
-    lines = [x.split() for x in spec_file.readlines()]
-    data = {"{}".format(i): {"wavelength": float(lines[i][0]), "flux": float(lines[i][1])} for i in range(len(lines)) if lines[i][1] != 'nan'}
-    return(data)
+    wavelength, flux = spectra.read_ascii_spectrum(filename)
+    return spectra.spectrum_value(wavelength, flux)
+
+
+def _delete_spec(id_):
+    #Look up the reduceddatum id from the datum_extra table
+    rd_extra = ReducedDatumExtra.objects.filter(
+        data_type = 'spectroscopy',
+        value__snex_id = id_)
+    for rde in rd_extra:
+        if rde.data_product:
+            dp = rde.data_product
+            dp.delete()
+        elif rde.value.get('snex2_id',''):
+            rd_pk = rde.value.get('snex2_id','')
+            rd = ReducedDatum.objects.get(pk = rd_pk)
+            dp = rd.data_product
+            dp.delete()
+
+
+def _apply_spec_row(id_, spec_row, target):
+    time = '{} {}'.format(spec_row.dateobs, spec_row.ut)
+    spec_filepath = "/".join(spec_row.filepath.split('/')[3:]) + spec_row.filename.replace('ascii', 'fits')  #remove everything before 'WEB/floyds/date_tel', e.g.: 'WEB/floyds/20240325_2m0-01/SN2024ehs_20240325_redblu_104630.842.fits'
+    spec_filename = os.path.join(spec_row.filepath.replace(settings.SN_DIR, '/snex2/'), spec_row.filename.replace('.fits', '.ascii'))
+    spec = read_spec(spec_filename)
+    spec_groupid = spec_row.groupidcode
+    if not spec_groupid:
+        spec_groupid = 1703768065789
+
+    #created True means new DataProduct was made, created False is object already existed, like just "get"
+    data_product, dp_created = DataProduct.objects.get_or_create(
+        target = target, 
+        product_id = spec_row.original.replace('.fits',''),
+        data_product_type = 'spectroscopy')
+
+    if dp_created:
+        data_product.data = spec_filepath
+        data_product.created = time
+        data_product.modified = time
+        data_product.featured = False
+        data_product.save()
+
+    reduced_datum, rd_created = ReducedDatum.objects.update_or_create(
+        target = target, 
+        data_product = data_product, 
+        data_type = 'spectroscopy', 
+        defaults = {
+            'value': spec,
+            'timestamp': time,
+            'source_name': '',
+            'source_location': '',
+        })
+
+    spec_extras = {}
+    for key in ['telescope', 'instrument', 'exptime', 'slit', 'airmass', 'reducer']:
+        if getattr(spec_row, key):
+            spec_extras[key] = getattr(spec_row, key)
+    spec_extras['snex_id'] = int(id_)
+    RDExtras_spec, rd_extras_created = ReducedDatumExtra.objects.update_or_create(
+        target = target,
+        data_product = data_product,
+        data_type='spectroscopy',
+        key='spec_extras',
+        value__snex_id = id_)
+
+    RDExtras_spec.value = spec_extras
+    RDExtras_spec.save()
+    logger.info(f'new objects created? dp: {dp_created}, rd: {rd_created}, rd_extra: {rd_extras_created}')
+
+    logger.info(f'rd and extra made or updated: {reduced_datum} {RDExtras_spec} for dataproduct: {data_product} and target {target}')
+
+    update_permissions(int(spec_groupid), 'view_reduceddatum', reduced_datum, get_snex1_groups()) # everyone view reduceddatum
+    lcogt = Group.objects.get(name = "LCOGT")
+    assign_perm('tom_dataproducts.view_dataproduct', lcogt, data_product) # LCOGT group view and edit all dataproducts
+    assign_perm('tom_dataproducts.delete_dataproduct', lcogt, data_product)
+
+
+def sync_spec_changes(changes, standard_ids):
+    """
+    Applies a batch of db_changes rows for the spec table to the SNex2 db,
+    using the last action recorded for each spec row
+
+    The spec rows and their targets are fetched with one query each.
+    Each spectrum is still written on its own, as it reads its ascii file
+    and sets its permissions, so that one failing spectrum does not hold
+    back the others
+
+    Returns the ids of the db_changes rows that were applied (or can be
+    dropped), leaving out those that failed and should be retried
+    """
+    last_action = {}
+    for change in changes:
+        last_action[change.rowid] = change.action
+
+    row_ids = [rowid for rowid, action in last_action.items() if action != 'delete']
+    spec_rows = {}
+    if row_ids:
+        with get_session(db_address=settings.SNEX1_DB_URL) as db_session:
+            spec_rows = {row.id: row for row in db_session.query(tables.Spec).filter(tables.Spec.id.in_(row_ids))}
+    pipeline_ids = {row.targetid for row in spec_rows.values()} - set(standard_ids)
+    targets = {target.pipeline_id: target for target in Target.objects.filter(pipeline_id__in=pipeline_ids)}
+
+    handled = set()
+    for id_, action in last_action.items():
+        try:
+            if action == 'delete':
+                _delete_spec(id_)
+            elif id_ in spec_rows and spec_rows[id_].targetid not in standard_ids:
+                spec_row = spec_rows[id_]
+                if spec_row.targetid not in targets:
+                    logger.warning(f'Target {spec_row.targetid} of spec {id_} is not in SNEx2 yet')
+                    continue
+                _apply_spec_row(id_, spec_row, targets[spec_row.targetid])
+            # Rows that no longer exist in spec will come through as deletes
+        except Exception as e:
+            logger.exception(f"Failed to process spectrum for spec {id_} with exception {e}")
+            continue
+        handled.add(id_)
 
+    return [change.id for change in changes if change.rowid in handled]
 
-def update_spec(action):
+
+def update_spec(action, standard_ids=None, batch_size=SYNC_BATCH_SIZE):
     """
     Queries the ReducedDatum table in the SNex2 db with any changes made to the Spec table in the SNex1 db
 
+    Changes are read in windows of batch_size db_changes rows, and the
+    applied ones are deleted from db_changes in one statement per window
+
     Parameters
     ----------
     action: str, one of 'update', 'insert', or 'delete'
-    db_address: str, sqlalchemy address to the SNex2 db
+    standard_ids: set of pipeline ids of standard stars, computed if not given
+    batch_size: int, number of db_changes rows per window
     """
     logger.info(f'{action} for spectra. . .')
-    spec_result = query_db_changes('spec', action, db_address=settings.SNEX1_DB_URL)
-    logger.info(f'Total spectra changes {len([change.rowid for change in spec_result])}')
-    for result in spec_result:
-        try:
-            id_ = result.rowid # The ID of the row in the spec table
-            if action=='delete':
-                #Look up the reduceddatum id from the datum_extra table
-                rd_extra = ReducedDatumExtra.objects.filter(
-                    data_type = 'spectroscopy',
-                    value__snex_id = id_)
-                for rde in rd_extra:
-                    if rde.data_product:
-                        dp = rde.data_product
-                        dp.delete()
-                    elif rde.value.get('snex2_id',''):
-                        rd_pk = rde.value.get('snex2_id','')
-                        rd = ReducedDatum.objects.get(pk = rd_pk)
-                        dp = rd.data_product
-                        dp.delete()
+    if standard_ids is None:
+        standard_ids = get_standard_ids()
+
+    after_id = 0
+    processed = 0
+    while True:
+        changes = query_db_changes_window('spec', action, after_id=after_id, limit=batch_size)
+        if not changes:
+            break
+        after_id = changes[-1].id
+
+        done = sync_spec_changes(changes, standard_ids)
+        delete_rows(tables.Db_Changes, done, db_address=settings.SNEX1_DB_URL)
+        processed += len(done)
+        logger.info(f'Processed {processed} spectra changes')
 
+
+def sync_target_change(result, action):
+    """
+    Applies one db_changes row for the targets table to the SNex2 db
+
+    Returns True if the change was applied, and False if it failed
+    and should be retried
+    """
+    try:
+        pipeline_id = result.rowid # The ID of the row in the targets table
+        target_row = get_current_row(tables.Targets, pipeline_id, db_address=settings.SNEX1_DB_URL) # The row corresponding to pipeline_id in the targets table
+
+        t_ra = target_row.ra0
+        t_dec = target_row.dec0
+        t_modified = target_row.lastmodified
+        t_created = target_row.datecreated
+        if t_created is None:
+            t_created = t_modified
+        t_groupid = int(target_row.groupidcode)
+
+        ### Get the name of the target
+        with get_session(db_address=settings.SNEX1_DB_URL) as db_session:
+            name_query = db_session.query(tables.Target_Names).filter(tables.Target_Names.targetid==target_row.id).first()
+            if name_query is not None:
+                t_name = name_query.name
             else:
-                spec_row = get_current_row(Spec, id_, db_address=settings.SNEX1_DB_URL) # The row corresponding to id_ in the spec table
-                if not spec_row:
-                    delete_row(Db_Changes, result.id, db_address=settings.SNEX1_DB_URL)
-                    continue
+                ### No name found, so target was created and deleted without being synced
+                return False
+            db_session.commit()
 
-                pipeline_id = spec_row.targetid
-                time = '{} {}'.format(spec_row.dateobs, spec_row.ut)
-                spec_filepath = "/".join(spec_row.filepath.split('/')[3:]) + spec_row.filename.replace('ascii', 'fits')  #remove everything before 'WEB/floyds/date_tel', e.g.: 'WEB/floyds/20240325_2m0-01/SN2024ehs_20240325_redblu_104630.842.fits'
-                spec_filename = os.path.join(spec_row.filepath.replace(settings.SN_DIR, '/snex2/'), spec_row.filename.replace('.fits', '.ascii'))
-                spec = read_spec(spec_filename)
-                spec_groupid = spec_row.groupidcode
-                if not spec_groupid:
-                    spec_groupid = 1703768065789
-    
-                with get_session(db_address=settings.SNEX1_DB_URL) as db_session:
-                    standard_classification_row = db_session.query(Classifications).filter(Classifications.name=='Standard').first()
-                    if standard_classification_row is not None:
-                        standard_classification_id = standard_classification_row.id
-                    else:
-                        standard_classification_id = -1
-                    standard_list = db_session.query(Targets).filter(Targets.classificationid==standard_classification_id)
-                    standard_ids = [x.id for x in standard_list]
-                if pipeline_id not in standard_ids:
-                    target = Target.objects.get(pipeline_id = pipeline_id)
-                    #created True means new DataProduct was made, created False is object already existed, like just "get"
-                    data_product, dp_created = DataProduct.objects.get_or_create(
-                        target = target, 
-                        product_id = spec_row.original.replace('.fits',''),
-                        data_product_type = 'spectroscopy')
-                    
-                    if dp_created:
-                        data_product.data = spec_filepath
-                        data_product.created = time
-                        data_product.modified = time
-                        data_product.featured = False
-                        data_product.save()
-
-                    reduced_datum, rd_created = ReducedDatum.objects.update_or_create(
-                        target = target, 
-                        data_product = data_product, 
-                        data_type = 'spectroscopy', 
-                        defaults = {
-                            'value': spec,
-                            'timestamp': time,
-                            'source_name': '',
-                            'source_location': '',
-                        })
-
-                    spec_extras = {}
-                    for key in ['telescope', 'instrument', 'exptime', 'slit', 'airmass', 'reducer']:
-                        if getattr(spec_row, key):
-                            spec_extras[key] = getattr(spec_row, key)
-                    spec_extras['snex_id'] = int(id_)
-                    RDExtras_spec, rd_extras_created = ReducedDatumExtra.objects.update_or_create(
-                        target = target,
-                        data_product = data_product,
-                        data_type='spectroscopy',
-                        key='spec_extras',
-                        value__snex_id = id_)
-
-                    RDExtras_spec.value = spec_extras
-                    RDExtras_spec.save()
-                    logger.info(f'new objects created? dp: {dp_created}, rd: {rd_created}, rd_extra: {rd_extras_created}')
-
-                    logger.info(f'rd and extra made or updated: {reduced_datum} {RDExtras_spec} for dataproduct: {data_product} and target {target}')
-
-                    update_permissions(int(spec_groupid), 'view_reduceddatum', reduced_datum, snex1_groups) # everyone view reduceddatum
-                    assign_perm('tom_dataproducts.view_dataproduct', Group.objects.get(name = "LCOGT"), data_product) # LCOGT group view and edit all dataproducts
-                    assign_perm('tom_dataproducts.delete_dataproduct', Group.objects.get(name = "LCOGT"), data_product)
+        if action=='delete':
+            Target.objects.delete(pipeline_id=pipeline_id)
 
-        except Exception as e:
-            logger.exception(f"Failed to process spectrum for db_changes row {result.id} spec {result.rowid} with exception {e}")
-            continue
-        
-        delete_row(Db_Changes, result.id, db_address=settings.SNEX1_DB_URL)
+        else:
+            target, created = Target.objects.get_or_create(pipeline_id=pipeline_id)
+            logger.info(f'target to sync: {pipeline_id}, target in snex2: {target}, created? {created}')
+
+            if created:
+                target.name = t_name
+                target.ra = t_ra
+                target.dec = t_dec
+                target.modified = t_modified
+                target.created = t_created
+                target.type = 'SIDEREAL'
+                target.epoch = 2000
+                target.scheme = ''
+                target.permissions = 'PRIVATE'
+                target.save()
+                update_permissions(t_groupid, 'custom_code.change_target', target, get_snex1_groups())
+                update_permissions(t_groupid, 'custom_code.delete_target', target, get_snex1_groups())
+                update_permissions(t_groupid, 'custom_code.view_target', target, get_snex1_groups())
+
+    except Exception as e:
+        logger.exception(f"Failed to process target for db_changes row {result.id} targets {result.rowid} with exception {e}")
+        return False
+
+    return True
+
+
+def sync_targetname_change(result, action):
+    """
+    Applies one db_changes row for the targetnames table to the SNex2 db
+
+    Returns True if the change was applied, and False if it failed
+    and should be retried
+    """
+    try:
+        name_id = result.rowid
+        targetname_row = get_current_row(tables.Target_Names, name_id, db_address=settings.SNEX1_DB_URL)
+        pipeline_id = targetname_row.targetid
+        name = targetname_row.name
+        target = Target.objects.get(pipeline_id=pipeline_id)
+        targetname, created = TargetName.objects.get_or_create(target=target, name=name)
+        if created:
+            logger.info(f'New target name {targetname} added to target {target}')
+        else:
+            logger.info(f'Target name already exists')
+
+    except Exception as e:
+        logger.exception(f"Failed to process target name for db_changes row {result.id} targetnames {result.rowid} with exception {e}")
+        return False
+
+    return True
 
-        
 
 def update_target(action, db_address=settings.SNEX1_DB_URL):
     """
@@ -399,73 +720,12 @@ def update_target(action, db_address=settings.SNEX1_DB_URL):
     logger.info(f'Total target name changes {len([change.rowid for change in name_result])}')
 
     for tresult in target_result:
-        try:
-            pipeline_id = tresult.rowid # The ID of the row in the targets table
-            target_row = get_current_row(Targets, pipeline_id, db_address=settings.SNEX1_DB_URL) # The row corresponding to pipeline_id in the targets table
-
-            t_ra = target_row.ra0
-            t_dec = target_row.dec0
-            t_modified = target_row.lastmodified
-            t_created = target_row.datecreated
-            if t_created is None:
-                t_created = t_modified
-            t_groupid = int(target_row.groupidcode)
-
-            ### Get the name of the target
-            with get_session(db_address=settings.SNEX1_DB_URL) as db_session:
-                name_query = db_session.query(Target_Names).filter(Target_Names.targetid==target_row.id).first()
-                if name_query is not None:
-                    t_name = name_query.name
-                else:
-                    ### No name found, so target was created and deleted without being synced
-                    continue
-                db_session.commit()
-
-            if action=='delete':
-                Target.objects.delete(pipeline_id=pipeline_id)
-
-            else:
-                target, created = Target.objects.get_or_create(pipeline_id=pipeline_id)
-                logger.info(f'target to sync: {pipeline_id}, target in snex2: {target}, created? {created}')
-
-                if created:
-                    target.name = t_name
-                    target.ra = t_ra
-                    target.dec = t_dec
-                    target.modified = t_modified
-                    target.created = t_created
-                    target.type = 'SIDEREAL'
-                    target.epoch = 2000
-                    target.scheme = ''
-                    target.permissions = 'PRIVATE'
-                    target.save()
-                    update_permissions(t_groupid, 'custom_code.change_target', target, snex1_groups)
-                    update_permissions(t_groupid, 'custom_code.delete_target', target, snex1_groups)
-                    update_permissions(t_groupid, 'custom_code.view_target', target, snex1_groups)
-
-        except Exception as e:
-            logger.exception(f"Failed to process target for db_changes row {tresult.id} targets {tresult.rowid} with exception {e}")
-            continue
-
-        delete_row(Db_Changes, tresult.id, db_address=settings.SNEX1_DB_URL)
+        if sync_target_change(tresult, action):
+            delete_row(tables.Db_Changes, tresult.id, db_address=settings.SNEX1_DB_URL)
     
     for nresult in name_result:
-        try:
-            name_id = nresult.rowid
-            targetname_row = get_current_row(Target_Names, name_id, db_address=settings.SNEX1_DB_URL)
-            pipeline_id = targetname_row.targetid
-            name = targetname_row.name
-            target = Target.objects.get(pipeline_id=pipeline_id)
-            targetname, created = TargetName.objects.get_or_create(target=target, name=name)
-            if created:
-                logger.info(f'New target name {targetname} added to target {target}')
-            else:
-                logger.info(f'Target name already exists')
-        except Exception as e:
-            logger.exception(f"Failed to process target name for db_changes row {name.id} targets {name.rowid} with exception {e}")
-            continue
-
-        delete_row(Db_Changes, nresult.id, db_address=settings.SNEX1_DB_URL)
+        if sync_targetname_change(nresult, action):
+            delete_row(tables.Db_Changes, nresult.id, db_address=settings.SNEX1_DB_URL)
     
    
 def run():
@@ -474,12 +734,226 @@ def run():
     and afterwards deletes all the rows in the db_changes table
     """
     actions = ['delete', 'insert', 'update']
-    for action in actions:
-        logger.info(f'Running action: {action}')
-        update_phot(action)
-        logger.info('Done with photometry')
-        update_spec(action)
-        logger.info('Done with spectra')
-        if action != 'delete':
-            update_target(action, db_address = settings.SNEX1_DB_URL)
-            logger.info('Done with targets')
+    warm()
+    standard_ids = get_standard_ids()
+    # Refresh each touched target's data summary once at the end
+    with deferred_summaries():
+        for action in actions:
+            logger.info(f'Running action: {action}')
+            update_phot(action, standard_ids=standard_ids)
+            logger.info('Done with photometry')
+            update_spec(action, standard_ids=standard_ids)
+            logger.info('Done with spectra')
+            if action != 'delete':
+                update_target(action, db_address = settings.SNEX1_DB_URL)
+                logger.info('Done with targets')
+
+
+def sync_change_window(changes, standard_ids):
+    """
+    Applies a window of db_changes rows of any table and action,
+    targets first so that new data finds its target
+
+    Returns the set of ids of the db_changes rows that failed
+    """
+    by_table = {}
+    for change in changes:
+        by_table.setdefault(change.tablename, []).append(change)
+
+    failed = set()
+    for change in by_table.get('targets', []):
+        # Target deletes are not synced, as in run()
+        if change.action != 'delete' and not sync_target_change(change, change.action):
+            failed.add(change.id)
+
+    for change in by_table.get('targetnames', []):
+        if change.action != 'delete' and not sync_targetname_change(change, change.action):
+            failed.add(change.id)
+
+    phot_changes = by_table.get('photlco', [])
+    if phot_changes:
+        try:
+            done = set(sync_phot_changes(phot_changes, standard_ids))
+        except Exception as e:
+            logger.exception(f'Failed to process photometry for db_changes rows {phot_changes[0].id}-{phot_changes[-1].id} with exception {e}')
+            done = set()
+        failed |= {change.id for change in phot_changes if change.id not in done}
+
+    spec_changes = by_table.get('spec', [])
+    if spec_changes:
+        try:
+            done = set(sync_spec_changes(spec_changes, standard_ids))
+        except Exception as e:
+            logger.exception(f'Failed to process spectra for db_changes rows {spec_changes[0].id}-{spec_changes[-1].id} with exception {e}')
+            done = set()
+        failed |= {change.id for change in spec_changes if change.id not in done}
+
+    return failed
+
+
+def change_pipeline_ids(changes):
+    """
+    Returns a dictionary of db_changes id -> pipeline id of the target
+    each change belongs to, for the rows that still exist in SNex1
+    """
+    row_tables = {'photlco': tables.Photlco, 'spec': tables.Spec, 'targetnames': tables.Target_Names}
+    row_ids = {}
+    for change in changes:
+        if change.tablename in row_tables:
+            row_ids.setdefault(change.tablename, set()).add(change.rowid)
+
+    targetids = {}
+    with get_session(db_address=settings.SNEX1_DB_URL) as db_session:
+        for tablename, ids in row_ids.items():
+            table = row_tables[tablename]
+            for id_, targetid in db_session.query(table.id, table.targetid).filter(table.id.in_(list(ids))):
+                targetids[(tablename, id_)] = targetid
+
+    pipeline_ids = {}
+    for change in changes:
+        if change.tablename == 'targets':
+            pipeline_ids[change.id] = change.rowid
+        elif (change.tablename, change.rowid) in targetids:
+            pipeline_ids[change.id] = targetids[(change.tablename, change.rowid)]
+    return pipeline_ids
+
+
+def compact_db_changes(ids, upto, checkpoint_name=SNEX1_CHECKPOINT, chunk_size=COMPACT_CHUNK_SIZE):
+    """
+    Deletes the given processed db_changes rows, in chunks of ids
+
+    Only rows that were applied are deleted, never a range of ids, so a
+    row that commits after a higher id has been read stays in db_changes
+    until the next run picks it up (see run_incremental)
+    """
+    try:
+        ids = sorted(ids)
+        for start in range(0, len(ids), chunk_size):
+            delete_rows(tables.Db_Changes, ids[start:start + chunk_size])
+
+        with transaction.atomic():
+            checkpoint = SyncCheckpoint.objects.select_for_update().get(name=checkpoint_name)
+            checkpoint.compacted_to = max(checkpoint.compacted_to, upto)
+            checkpoint.save(update_fields=['compacted_to', 'modified'])
+        logger.info(f'Compacted {len(ids)} db_changes rows up to {upto}')
+
+    except Exception as e:
+        logger.exception(f'Failed to compact db_changes up to {upto} with exception {e}')
+
+    finally:
+        # This runs in its own thread, which has its own connection
+        connection.close()
+
+
+def _advance_checkpoint(checkpoint_name, watermark, failed, retried=()):
+    with transaction.atomic():
+        checkpoint = SyncCheckpoint.objects.select_for_update().get(name=checkpoint_name)
+        checkpoint.watermark = max(checkpoint.watermark, watermark)
+        checkpoint.retry_ids = sorted((set(checkpoint.retry_ids) - set(retried)) | set(failed))
+        checkpoint.save(update_fields=['watermark', 'retry_ids', 'modified'])
+    return checkpoint
+
+
+def run_incremental(since=None, replay=False, batch_size=SYNC_BATCH_SIZE, compact=True, workers=1, checkpoint_name=SNEX1_CHECKPOINT):
+    """
+    Migrates changes from the SNex1 db to the SNex2 db by reading db_changes
+    in id order above a stored watermark, instead of deleting each row
+    as it is processed
+
+    After each window of batch_size rows the watermark is advanced in one
+    transaction, and the processed rows are deleted from db_changes in bulk
+    by a background thread. Applying a change reads the current state of
+    the row in SNex1, so a window that is replayed after a crash between
+    the writes and the checkpoint gives the same result
+
+    MySQL ids are not committed in order, so a row can appear below the
+    watermark after a higher id has been read. Compaction only deletes the
+    rows that were applied, and each run first sweeps whatever is left at
+    or below the watermark, which also retries the rows that failed before
+
+    Parameters
+    ----------
+    since: int, start after this db_changes id instead of the watermark,
+        which must not be above the watermark unless replaying
+    replay: bool, reprocess the rows after since without moving the
+        checkpoint or compacting, for backfills
+    batch_size: int, number of db_changes rows per window
+    compact: bool, delete processed rows from db_changes
+    workers: int, number of processes to sync each window with, see
+        custom_code.sync_runner
+    """
+    checkpoint, _ = SyncCheckpoint.objects.get_or_create(name=checkpoint_name)
+    if since is not None and since > checkpoint.watermark and not replay:
+        # The rows between the watermark and since would be skipped for good
+        raise ValueError(f'--since {since} is above the watermark {checkpoint.watermark}, use --replay to sync from there')
+
+    warm()
+    standard_ids = get_standard_ids()
+    cursor = checkpoint.watermark if since is None else since
+    compactor = ThreadPoolExecutor(max_workers=1) if compact and not replay else None
+    logger.info(f'Incremental sync starting after db_changes id {cursor}, replay={replay}')
+
+    processed = 0
+    failed_total = 0
+    runner = ParallelSyncRunner(workers) if workers > 1 else nullcontext()
+
+    def sync_window(changes):
+        if workers > 1:
+            return runner.sync_window(changes, change_pipeline_ids(changes), standard_ids)
+        return sync_change_window(changes, standard_ids)
+
+    with runner, deferred_summaries():
+        if not replay:
+            # Rows at or below the watermark that are still in db_changes either
+            # failed, were not compacted, or committed after a higher id had been
+            # read. Applying a change again gives the same result, so sweep them all.
+            # Without compaction every processed row stays, so only retry the failures
+            swept = 0
+            still_failing = set()
+            after_id = 0
+            while True:
+                criteria = and_(
+                    tables.Db_Changes.id > after_id, tables.Db_Changes.id <= checkpoint.watermark,
+                    tables.Db_Changes.tablename.in_(SYNCED_TABLES)
+                )
+                if compactor is None:
+                    criteria = and_(criteria, tables.Db_Changes.id.in_(checkpoint.retry_ids or [0]))
+                with get_session(db_address=settings.SNEX1_DB_URL) as db_session:
+                    leftovers = db_session.query(tables.Db_Changes).filter(criteria).order_by(tables.Db_Changes.id).limit(batch_size).all()
+                if not leftovers:
+                    break
+                failed = sync_window(leftovers)
+                after_id = leftovers[-1].id
+                if compactor is not None:
+                    delete_rows(tables.Db_Changes, [change.id for change in leftovers if change.id not in failed])
+                swept += len(leftovers)
+                still_failing |= failed
+            checkpoint = _advance_checkpoint(checkpoint_name, checkpoint.watermark, still_failing, retried=checkpoint.retry_ids)
+            if swept:
+                logger.info(f'Swept {swept} changes at or below the watermark, {len(still_failing)} still failing')
+
+        while True:
+            with get_session(db_address=settings.SNEX1_DB_URL) as db_session:
+                changes = db_session.query(tables.Db_Changes).filter(and_(
+                    tables.Db_Changes.id > cursor, tables.Db_Changes.tablename.in_(SYNCED_TABLES)
+                )).order_by(tables.Db_Changes.id).limit(batch_size).all()
+            if not changes:
+                break
+
+            failed = sync_window(changes)
+            cursor = changes[-1].id
+            processed += len(changes)
+            failed_total += len(failed)
+
+            if not replay:
+                _advance_checkpoint(checkpoint_name, cursor, failed)
+                if compactor is not None:
+                    compactor.submit(compact_db_changes, [change.id for change in changes if change.id not in failed], cursor, checkpoint_name)
+            logger.info(f'Synced db_changes up to {cursor}: {processed} processed, {failed_total} failed')
+
+    if compactor is not None:
+        compactor.shutdown(wait=True)
+    if workers > 1:
+        logger.info(f'Sync workers: {runner.summary()}')
+    logger.info(f'Incremental sync done at db_changes id {cursor}: {processed} processed, {failed_total} failed')
+    return cursor
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from tom_targets.serializers import TargetSerializer
 from tom_targets.models import Target
+from custom_code.spatial import cone_search
 
 class SNExTargetSerializer(TargetSerializer):
     def validate(self, data):
@@ -8,12 +9,7 @@ class SNExTargetSerializer(TargetSerializer):
         ra = data.get('ra')
         dec = data.get('dec')
         if ra is not None and dec is not None:
-            nearby = Target.objects.filter(
-                ra__gte=ra - 4/3600,
-                ra__lte=ra + 4/3600,
-                dec__gte=dec - 4/3600,
-                dec__lte=dec + 4/3600
-            )
+            nearby = cone_search(Target.objects.all(), ra, dec, 4/3600)
             if self.instance:
                 nearby = nearby.exclude(pk=self.instance.pk)
             if nearby.exists():
@@ -0,0 +1,66 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from guardian.models import GroupObjectPermission
+from tom_dataproducts.models import ReducedDatum
+from tom_targets.models import Target, TargetName
+
+from custom_code import names, render_cache, summaries
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@receiver([post_save, post_delete], sender=ReducedDatum)
+def reduceddatum_changed(sender, instance, **kwargs):
+    render_cache.invalidate(instance.target_id, instance.data_type)
+
+
+@receiver(post_save, sender=ReducedDatum)
+def reduceddatum_saved_update_summary(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        summaries.datum_created(instance)
+    else:
+        summaries.datum_changed(instance)
+
+
+@receiver(post_delete, sender=ReducedDatum)
+def reduceddatum_deleted_update_summary(sender, instance, **kwargs):
+    summaries.datum_changed(instance)
+
+
+@receiver([post_save, post_delete], sender=GroupObjectPermission)
+def reduceddatum_permissions_changed(sender, instance, **kwargs):
+    """
+    Group permissions decide which data a user sees in the cached plots,
+    so changing them for a ReducedDatum counts as changing the data
+    """
+    content_type = ContentType.objects.get_for_id(instance.content_type_id)
+    if content_type.app_label != 'tom_dataproducts' or content_type.model != 'reduceddatum':
+        return
+    datum = ReducedDatum.objects.filter(pk=instance.object_pk).values('target_id', 'data_type').first()
+    if datum:
+        render_cache.invalidate(datum['target_id'], datum['data_type'])
+
+
+@receiver(post_save, sender=Target)
+def target_saved_update_names(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    names.index_target_names([instance.id])
+
+
+@receiver(post_save, sender=TargetName)
+def targetname_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    names.index_target_names([instance.target_id])
+
+
+@receiver(post_delete, sender=TargetName)
+def targetname_deleted(sender, instance, **kwargs):
+    # The target itself may be being deleted, see names.index_on_commit
+    names.index_on_commit([instance.target_id])
@@ -0,0 +1,123 @@
+"""
+Process-wide access to the SNEx1 database.
+
+Each worker process keeps one pooled engine per database address and
+reflects the schema into an automap base once, the first time a table is
+asked for. Sessions come from a scoped factory, which under the gevent
+workers gives every greenlet its own session on the shared pool.
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from sqlalchemy import create_engine
+from sqlalchemy.ext.automap import automap_base
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+SNEX1_POOL_DEFAULTS = {
+    'pool_size': 5,
+    'max_overflow': 10,
+    'pool_timeout': 30, #seconds
+    'pool_recycle': 3600, #seconds, below the MySQL wait_timeout
+}
+
+_lock = threading.Lock()
+_engines = {}
+_bases = {}
+_session_factories = {}
+
+
+def _pool_settings():
+    pool_settings = dict(SNEX1_POOL_DEFAULTS)
+    pool_settings.update(getattr(settings, 'SNEX1_DB_POOL', {}))
+    return pool_settings
+
+
+def _key(db_address):
+    # Pooled connections must not be shared with forked children
+    return (os.getpid(), db_address)
+
+
+def get_engine(db_address=settings.SNEX1_DB_URL):
+    """
+    Returns the pooled engine for db_address, creating it on first use
+    """
+    key = _key(db_address)
+    engine = _engines.get(key)
+    if engine is None:
+        with _lock:
+            engine = _engines.get(key)
+            if engine is None:
+                engine = create_engine(db_address, pool_pre_ping=True, **_pool_settings())
+                _engines[key] = engine
+    return engine
+
+
+def get_base(db_address=settings.SNEX1_DB_URL):
+    """
+    Returns the automap base for db_address, reflecting the schema
+    the first time it is called in this process
+    """
+    key = _key(db_address)
+    base = _bases.get(key)
+    if base is None:
+        engine = get_engine(db_address)
+        with _lock:
+            base = _bases.get(key)
+            if base is None:
+                logger.info('Reflecting the SNEx1 schema')
+                base = automap_base()
+                base.prepare(autoload_with=engine)
+                _bases[key] = base
+    return base
+
+
+def get_table(tablename, db_address=settings.SNEX1_DB_URL):
+    """
+    Returns the mapped class of a SNEx1 table
+    """
+    return getattr(get_base(db_address).classes, tablename)
+
+
+def get_session_factory(db_address=settings.SNEX1_DB_URL):
+    key = _key(db_address)
+    factory = _session_factories.get(key)
+    if factory is None:
+        engine = get_engine(db_address)
+        with _lock:
+            factory = _session_factories.get(key)
+            if factory is None:
+                factory = scoped_session(sessionmaker(bind=engine, autoflush=False, expire_on_commit=False))
+                _session_factories[key] = factory
+    return factory
+
+
+@contextmanager
+def session_scope(db_address=settings.SNEX1_DB_URL):
+    """
+    Yields the session of the current greenlet or thread, committing
+    on success and rolling back on error
+    """
+    factory = get_session_factory(db_address)
+    session = factory()
+    try:
+        yield session
+        session.commit()
+    except:
+        session.rollback()
+        raise
+    finally:
+        factory.remove()
+
+
+def new_session(db_address=settings.SNEX1_DB_URL):
+    """
+    Returns a standalone session on the pooled engine, which the caller
+    must close
+    """
+    return sessionmaker(bind=get_engine(db_address), autoflush=False, expire_on_commit=False)()
@@ -0,0 +1,87 @@
+"""
+Declination-zone spatial index for target coordinates.
+
+Every target stores the index of the declination zone (ZONE_HEIGHT degrees
+tall) that it falls in. A cone search first narrows the candidates with an
+indexed range over the zones spanned by the cone, then with a right
+ascension window whose half-width grows as 1/cos(dec) and wraps around
+RA = 0/360, and finally keeps only the candidates within the exact angular
+distance. Near the poles the window covers every right ascension.
+"""
+import math
+
+import numpy as np
+from django.db.models import Q
+
+ZONE_HEIGHT = 1.0 / 60.0 #degrees
+
+
+def zone_for_dec(dec):
+    """
+    Returns the index of the declination zone containing dec
+    """
+    dec = min(max(float(dec), -90.0), 90.0)
+    return int(math.floor((dec + 90.0) / ZONE_HEIGHT))
+
+
+def angular_separation(ra1, dec1, ra2, dec2):
+    """
+    Angular separation in degrees between arrays of coordinates in degrees,
+    using the Vincenty formula
+    """
+    ra1, dec1, ra2, dec2 = (np.radians(np.asarray(a, dtype=float)) for a in (ra1, dec1, ra2, dec2))
+    dra = ra2 - ra1
+    sin_dra, cos_dra = np.sin(dra), np.cos(dra)
+    sin_dec1, cos_dec1 = np.sin(dec1), np.cos(dec1)
+    sin_dec2, cos_dec2 = np.sin(dec2), np.cos(dec2)
+
+    num1 = cos_dec2 * sin_dra
+    num2 = cos_dec1 * sin_dec2 - sin_dec1 * cos_dec2 * cos_dra
+    denominator = sin_dec1 * sin_dec2 + cos_dec1 * cos_dec2 * cos_dra
+
+    return np.degrees(np.arctan2(np.hypot(num1, num2), denominator))
+
+
+def _ra_half_width(dec, radius):
+    """
+    Half-width in right ascension of the smallest window containing a
+    cone of the given radius (Gray et al. 2007, the zones algorithm)
+    """
+    if abs(dec) + radius >= 89.9:
+        return 180.0
+    dec, radius = math.radians(dec), math.radians(radius)
+    return math.degrees(abs(math.atan(
+        math.sin(radius) / math.sqrt(abs(math.cos(dec - radius) * math.cos(dec + radius)))
+    )))
+
+
+def cone_search(queryset, ra, dec, radius):
+    """
+    Filters a queryset of targets down to those within radius degrees
+    of (ra, dec), using the zone index
+    """
+    ra, dec, radius = float(ra) % 360.0, float(dec), float(radius)
+    dec_min, dec_max = max(dec - radius, -90.0), min(dec + radius, 90.0)
+
+    candidates = queryset.filter(
+        zone__gte=zone_for_dec(dec_min), zone__lte=zone_for_dec(dec_max),
+        dec__gte=dec_min, dec__lte=dec_max
+    )
+
+    half_width = _ra_half_width(dec, radius)
+    if half_width < 180.0:
+        ra_min, ra_max = ra - half_width, ra + half_width
+        if ra_min < 0:
+            candidates = candidates.filter(Q(ra__gte=ra_min + 360.0) | Q(ra__lte=ra_max))
+        elif ra_max >= 360.0:
+            candidates = candidates.filter(Q(ra__gte=ra_min) | Q(ra__lte=ra_max - 360.0))
+        else:
+            candidates = candidates.filter(ra__gte=ra_min, ra__lte=ra_max)
+
+    rows = list(candidates.values_list('pk', 'ra', 'dec'))
+    if not rows:
+        return queryset.none()
+
+    pks, ras, decs = zip(*rows)
+    separations = angular_separation(ra, dec, ras, decs)
+    return queryset.filter(pk__in=[pk for pk, sep in zip(pks, separations) if sep <= radius])
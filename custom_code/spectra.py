@@ -0,0 +1,188 @@
+"""
+Reading, storing and decoding spectra as NumPy arrays.
+
+Spectra synced from SNEx1 used to be stored in ReducedDatum.value as one
+dictionary per pixel ({"0": {"wavelength": .., "flux": ..}, ...}). The
+compact layout used now keeps parallel arrays instead, the same layout the
+TOM spectroscopy processor writes:
+
+    {"wavelength": [...], "flux": [...]}
+
+or, with SPECTRUM_ENCODING = 'base64', little-endian float32 blobs:
+
+    {"encoding": "float32-base64", "wavelength": "...", "flux": "..."}
+
+spectrum_arrays decodes all of these, plus the legacy per-pixel layout,
+into float arrays, and the rest of the module (binning, normalization,
+redshifting, line masking) works on those arrays for the static plots and
+the Dash spectra apps.
+"""
+import base64
+
+import numpy as np
+from django.conf import settings
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+BASE64_ENCODING = 'float32-base64'
+_FLOAT32 = np.dtype('<f4')
+
+
+def read_ascii_spectrum(filename):
+    """
+    Reads the first two columns of an ascii spectrum file into
+    wavelength and flux arrays, dropping pixels with a NaN flux
+    """
+    data = np.loadtxt(filename, usecols=(0, 1), ndmin=2, dtype=float)
+    data = data[~np.isnan(data[:, 1])]
+    return data[:, 0], data[:, 1]
+
+
+def _encode(values):
+    return base64.b64encode(np.asarray(values, dtype=_FLOAT32).tobytes()).decode('ascii')
+
+
+def _decode(blob):
+    return np.frombuffer(base64.b64decode(blob), dtype=_FLOAT32).astype(float)
+
+
+def spectrum_value(wavelength, flux, encoding=None):
+    """
+    Returns the ReducedDatum value for a spectrum in the compact layout,
+    as lists or (encoding='base64') float32 blobs, defaulting to
+    settings.SPECTRUM_ENCODING
+    """
+    if encoding is None:
+        encoding = getattr(settings, 'SPECTRUM_ENCODING', 'list')
+    if encoding == 'base64':
+        return {'encoding': BASE64_ENCODING, 'wavelength': _encode(wavelength), 'flux': _encode(flux)}
+    return {
+        'wavelength': np.asarray(wavelength, dtype=float).tolist(),
+        'flux': np.asarray(flux, dtype=float).tolist(),
+    }
+
+
+def is_per_pixel(value):
+    """
+    True for spectra stored in the legacy one dictionary per pixel layout
+    """
+    return isinstance(value, dict) and 'wavelength' not in value and any(
+        isinstance(point, dict) and 'wavelength' in point for point in value.values()
+    )
+
+
+def _per_pixel_arrays(value):
+    wavelength = np.empty(len(value))
+    flux = np.empty(len(value))
+    n = 0
+    for point in value.values():
+        try:
+            w, f = float(point['wavelength']), float(point['flux'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        wavelength[n], flux[n] = w, f
+        n += 1
+    return wavelength[:n], flux[:n]
+
+
+def spectrum_arrays(value):
+    """
+    Returns (wavelength, flux) float arrays from a spectrum ReducedDatum
+    value in any of the stored layouts, preferring photon_flux when present
+    """
+    if not isinstance(value, dict) or not value:
+        return np.empty(0), np.empty(0)
+
+    if value.get('encoding') == BASE64_ENCODING:
+        wavelength, flux = _decode(value['wavelength']), _decode(value['flux'])
+    elif value.get('photon_flux'):
+        wavelength = np.asarray(value.get('wavelength') or [], dtype=float)
+        flux = np.asarray(value['photon_flux'], dtype=float)
+    elif value.get('flux'):
+        wavelength = np.asarray(value.get('wavelength') or [], dtype=float)
+        flux = np.asarray(value['flux'], dtype=float)
+    else:
+        return _per_pixel_arrays(value)
+
+    n = min(len(wavelength), len(flux))
+    return wavelength[:n], flux[:n]
+
+
+def bin_spectrum(wavelength, flux, factor):
+    """
+    Averages every factor consecutive pixels, dropping the leftover pixels
+    at the red end and any bins with a non-positive wavelength
+    """
+    wavelength = np.asarray(wavelength, dtype=float)
+    flux = np.asarray(flux, dtype=float)
+    try:
+        factor = int(factor)
+    except (TypeError, ValueError):
+        factor = 1
+    if factor <= 1 or flux.size < factor:
+        return wavelength, flux
+
+    n = flux.size // factor * factor
+    binned_wavelength = wavelength[:n].reshape(-1, factor).mean(axis=1)
+    binned_flux = flux[:n].reshape(-1, factor).mean(axis=1)
+    keep = binned_wavelength > 0
+    return binned_wavelength[keep], binned_flux[keep]
+
+
+def normalize_median(flux):
+    """
+    Divides flux by its median, leaving it as is if the median is zero
+    """
+    flux = np.asarray(flux, dtype=float)
+    if not flux.size:
+        return flux
+    flux_median = np.median(flux)
+    if not flux_median or not np.isfinite(flux_median):
+        return flux
+    return flux / flux_median
+
+
+def shift_redshift(wavelength, from_z=0, to_z=0):
+    """
+    Moves observed wavelengths at redshift from_z to redshift to_z
+    """
+    return np.asarray(wavelength, dtype=float) * (1 + (to_z or 0)) / (1 + (from_z or 0))
+
+
+def mask_lines(wavelength, flux, rest_waves, z=0, half_width=10, degree=4):
+    """
+    Replaces the flux within half_width angstroms of each redshifted
+    line by the median of a polynomial fit to the continuum over that window
+    """
+    wavelength = np.asarray(wavelength, dtype=float)
+    flux = np.array(flux, dtype=float)
+    if wavelength.size <= degree:
+        return flux
+
+    continuum = np.polyval(np.polyfit(wavelength, flux, degree), wavelength)
+    observed = np.asarray(rest_waves, dtype=float) * (1 + (z or 0))
+    # One column per line, True where the pixel is inside its window
+    windows = np.abs(wavelength[:, None] - observed[None, :]) < half_width
+    for column in np.flatnonzero(windows.any(axis=0)):
+        window = windows[:, column]
+        flux[window] = np.median(continuum[window])
+    return flux
+
+
+def flux_range(fluxes):
+    """
+    Returns the (min, max) over a sequence of flux arrays, ignoring
+    missing values, or None if there are no fluxes
+    """
+    lows, highs = [], []
+    for flux in fluxes:
+        flux = np.asarray(flux, dtype=float)
+        flux = flux[np.isfinite(flux)]
+        if flux.size:
+            lows.append(flux.min())
+            highs.append(flux.max())
+    if not lows:
+        return None
+    return float(min(lows)), float(max(highs))
@@ -0,0 +1,153 @@
+"""
+Cache of decoded spectrum arrays for the Dash spectra apps.
+
+Decoded spectra are kept in a small per-process LRU, backed by the shared
+Django cache so that other workers do not have to load and decode the
+ReducedDatum again. ReducedDatum has no modified time, so entries are keyed
+by the datum id and an md5 of its value computed by the database, which
+changes whenever the spectrum does without transferring or decoding it.
+Entries in the per-process LRU also expire after SPECTRUM_CACHE_LOCAL_TIMEOUT
+so that it does not hold on to spectra that are no longer viewed. Binned
+versions of a spectrum are cheap to make from the arrays and are only kept
+in the per-process LRU, keyed by the bin factor as well.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import TextField
+from django.db.models.functions import MD5, Cast
+from tom_dataproducts.models import ReducedDatum
+
+from custom_code.spectra import bin_spectrum, spectrum_arrays
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+SPECTRUM_CACHE_SIZE = getattr(settings, 'SPECTRUM_CACHE_SIZE', 256)
+SPECTRUM_CACHE_TIMEOUT = getattr(settings, 'SPECTRUM_CACHE_TIMEOUT', 24 * 3600)
+SPECTRUM_CACHE_LOCAL_TIMEOUT = getattr(settings, 'SPECTRUM_CACHE_LOCAL_TIMEOUT', 3600)
+
+CachedSpectrum = namedtuple('CachedSpectrum', ['id', 'fingerprint', 'target_id', 'timestamp', 'wavelength', 'flux'])
+
+
+class _LRU:
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.timeout, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+
+_local = _LRU(SPECTRUM_CACHE_SIZE, SPECTRUM_CACHE_LOCAL_TIMEOUT)
+
+
+def _arrays_key(datum_id, fingerprint):
+    return 'spectrum:arrays:{}:{}'.format(datum_id, fingerprint)
+
+
+def _spectra(datum_ids):
+    return ReducedDatum.objects.filter(
+        id__in=datum_ids, data_type='spectroscopy'
+    ).annotate(fingerprint=MD5(Cast('value', TextField())))
+
+
+def _freeze(array):
+    # Cached arrays are shared between callbacks, which must copy to modify them
+    array.setflags(write=False)
+    return array
+
+
+def get_spectra(datum_ids):
+    """
+    Returns a dictionary of datum id -> CachedSpectrum for the spectra
+    among datum_ids, in the order of datum_ids
+    """
+    datum_ids = [int(datum_id) for datum_id in datum_ids]
+    fingerprints = dict(_spectra(datum_ids).values_list('id', 'fingerprint'))
+
+    spectra = {}
+    missing = []
+    for datum_id, fingerprint in fingerprints.items():
+        spectrum = _local.get((datum_id, fingerprint))
+        if spectrum is None:
+            missing.append(datum_id)
+        else:
+            spectra[datum_id] = spectrum
+
+    if missing:
+        shared = cache.get_many([_arrays_key(datum_id, fingerprints[datum_id]) for datum_id in missing])
+        to_load = []
+        for datum_id in missing:
+            spectrum = shared.get(_arrays_key(datum_id, fingerprints[datum_id]))
+            if spectrum is None:
+                to_load.append(datum_id)
+            else:
+                spectra[datum_id] = spectrum
+                _local.set((datum_id, spectrum.fingerprint), spectrum)
+
+        loaded = {}
+        rows = _spectra(to_load).values_list('id', 'fingerprint', 'target_id', 'timestamp', 'value')
+        for datum_id, fingerprint, target_id, timestamp, value in rows:
+            wavelength, flux = spectrum_arrays(value)
+            spectrum = CachedSpectrum(
+                datum_id, fingerprint, target_id, timestamp, _freeze(wavelength), _freeze(flux)
+            )
+            spectra[datum_id] = spectrum
+            loaded[_arrays_key(datum_id, fingerprint)] = spectrum
+            _local.set((datum_id, fingerprint), spectrum)
+        if loaded:
+            cache.set_many(loaded, SPECTRUM_CACHE_TIMEOUT)
+
+    return {datum_id: spectra[datum_id] for datum_id in datum_ids if datum_id in spectra}
+
+
+def get_spectrum(datum_id):
+    """
+    Returns the CachedSpectrum of one ReducedDatum, or None if it
+    does not exist
+    """
+    return get_spectra([datum_id]).get(int(datum_id))
+
+
+def binned(spectrum, factor):
+    """
+    Returns the (wavelength, flux) arrays of a CachedSpectrum binned by factor
+    """
+    try:
+        factor = int(factor)
+    except (TypeError, ValueError):
+        factor = 1
+    if factor <= 1:
+        return spectrum.wavelength, spectrum.flux
+
+    key = (spectrum.id, spectrum.fingerprint, 'binned', factor)
+    arrays = _local.get(key)
+    if arrays is None:
+        wavelength, flux = bin_spectrum(spectrum.wavelength, spectrum.flux, factor)
+        arrays = (_freeze(wavelength), _freeze(flux))
+        _local.set(key, arrays)
+    return arrays
@@ -0,0 +1,217 @@
+"""
+Maintenance of TargetDataSummary rows.
+
+New ReducedDatums are folded into the summary of their target as they are
+created. Updates and deletes, which can change the brightest or latest
+magnitude, trigger a recomputation of that target's summary, once per
+transaction however many of its datums change. Bulk jobs such
+as the SNEx1 sync can wrap their work in deferred_summaries() so that each
+touched target is recomputed once at the end instead of once per datum.
+"""
+from contextlib import contextmanager
+import threading
+
+from django.db import transaction
+from django.db.models import Count, Max, Min
+from django.db.models.fields.json import KeyTextTransform
+from tom_dataproducts.models import ReducedDatum
+from tom_targets.models import Target
+
+from custom_code.models import TargetDataSummary
+from custom_code.photometry import decode_value, string_valued
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_FIELDS = (
+    'phot_count', 'spec_count', 'first_datum', 'last_datum', 'first_phot', 'last_phot',
+    'last_mag', 'last_filter', 'brightest_mag', 'first_spec', 'last_spec'
+)
+
+_deferred = threading.local()
+_on_commit = threading.local()
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _empty_summary():
+    summary = {field: None for field in SUMMARY_FIELDS}
+    summary.update({'phot_count': 0, 'spec_count': 0, 'last_filter': ''})
+    return summary
+
+
+def refresh_target_summaries(target_ids):
+    """
+    Recomputes the summaries of the given targets from their ReducedDatums
+    with a handful of grouped queries, and upserts them
+    """
+    target_ids = set(Target.objects.filter(id__in=set(target_ids)).values_list('id', flat=True))
+    if not target_ids:
+        return 0
+
+    summaries = {target_id: _empty_summary() for target_id in target_ids}
+    datums = ReducedDatum.objects.filter(target_id__in=target_ids)
+
+    for row in datums.values('target_id').annotate(first=Min('timestamp'), last=Max('timestamp')):
+        summaries[row['target_id']].update(first_datum=row['first'], last_datum=row['last'])
+
+    spectra = datums.filter(data_type='spectroscopy').values('target_id').annotate(
+        count=Count('id'), first=Min('timestamp'), last=Max('timestamp')
+    )
+    for row in spectra:
+        summaries[row['target_id']].update(spec_count=row['count'], first_spec=row['first'], last_spec=row['last'])
+
+    photometry = datums.filter(
+        data_type='photometry', value__has_key='magnitude'
+    ).annotate(
+        mag=KeyTextTransform('magnitude', 'value'), filt=KeyTextTransform('filter', 'value')
+    ).order_by('target_id', 'timestamp').values_list('target_id', 'timestamp', 'mag', 'filt')
+
+    for target_id, timestamp, mag, filt in photometry.iterator(chunk_size=5000):
+        _add_photometry(summaries[target_id], timestamp, mag, filt)
+
+    legacy = string_valued(datums.filter(data_type='photometry')).values_list('target_id', 'timestamp', 'value')
+    for target_id, timestamp, value in legacy:
+        value = decode_value(value)
+        if 'magnitude' in value:
+            _add_photometry(summaries[target_id], timestamp, value['magnitude'], value.get('filter'))
+
+    TargetDataSummary.objects.bulk_create(
+        [TargetDataSummary(target_id=target_id, **summary) for target_id, summary in summaries.items()],
+        update_conflicts=True, unique_fields=['target'], update_fields=list(SUMMARY_FIELDS) + ['modified']
+    )
+    return len(summaries)
+
+
+def _add_photometry(summary, timestamp, mag, filt):
+    mag = _to_float(mag)
+    summary['phot_count'] += 1
+    if summary['first_phot'] is None or timestamp < summary['first_phot']:
+        summary['first_phot'] = timestamp
+    # Of equal timestamps the last one seen wins
+    if summary['last_phot'] is None or timestamp >= summary['last_phot']:
+        summary['last_phot'] = timestamp
+        summary['last_mag'] = mag
+        summary['last_filter'] = filt or ''
+    if mag is not None and (summary['brightest_mag'] is None or mag < summary['brightest_mag']):
+        summary['brightest_mag'] = mag
+
+
+def _add_datum(summary, datum):
+    timestamp = datum.timestamp
+    if summary.first_datum is None or timestamp < summary.first_datum:
+        summary.first_datum = timestamp
+    if summary.last_datum is None or timestamp > summary.last_datum:
+        summary.last_datum = timestamp
+
+    value = decode_value(datum.value)
+    if datum.data_type == 'photometry' and 'magnitude' in value:
+        mag = _to_float(value.get('magnitude'))
+        summary.phot_count += 1
+        if summary.first_phot is None or timestamp < summary.first_phot:
+            summary.first_phot = timestamp
+        if summary.last_phot is None or timestamp >= summary.last_phot:
+            summary.last_phot = timestamp
+            summary.last_mag = mag
+            summary.last_filter = value.get('filter') or ''
+        if mag is not None and (summary.brightest_mag is None or mag < summary.brightest_mag):
+            summary.brightest_mag = mag
+
+    elif datum.data_type == 'spectroscopy':
+        summary.spec_count += 1
+        if summary.first_spec is None or timestamp < summary.first_spec:
+            summary.first_spec = timestamp
+        if summary.last_spec is None or timestamp > summary.last_spec:
+            summary.last_spec = timestamp
+
+
+def datum_created(datum):
+    """
+    Folds a newly created ReducedDatum into its target's summary
+    """
+    if _defer(datum.target_id):
+        return
+    with transaction.atomic():
+        summary = TargetDataSummary.objects.select_for_update().filter(target_id=datum.target_id).first()
+        if summary is None:
+            # Never summarized, so compute from everything the target has
+            refresh_target_summaries([datum.target_id])
+            return
+        _add_datum(summary, datum)
+        summary.save()
+
+
+def datum_changed(datum):
+    """
+    Recomputes the summary of the target of an updated or deleted ReducedDatum,
+    once per transaction (deleting a DataProduct or a target deletes its
+    datums in one transaction)
+    """
+    if _defer(datum.target_id):
+        return
+    _refresh_on_commit(datum.target_id)
+
+
+def _refresh_on_commit(target_id):
+    pending = getattr(_on_commit, 'target_ids', None)
+    if pending is None:
+        pending = _on_commit.target_ids = set()
+    pending.add(target_id)
+    # Registered on every call (and run straight away outside a transaction),
+    # as rolling back a savepoint drops its callbacks; the callbacks after the
+    # first find nothing pending
+    transaction.on_commit(_refresh_pending)
+
+
+def _refresh_pending():
+    target_ids = getattr(_on_commit, 'target_ids', None)
+    if not target_ids:
+        return
+    _on_commit.target_ids = set()
+    refresh_target_summaries(target_ids)
+
+
+def targets_changed(target_ids):
+    """
+    Refreshes the summaries of targets whose ReducedDatums were changed
+    in bulk, bypassing the model signals
+    """
+    pending = getattr(_deferred, 'target_ids', None)
+    if pending is not None:
+        pending.update(target_ids)
+        return
+    refresh_target_summaries(target_ids)
+
+
+def _defer(target_id):
+    pending = getattr(_deferred, 'target_ids', None)
+    if pending is None:
+        return False
+    pending.add(target_id)
+    return True
+
+
+@contextmanager
+def deferred_summaries():
+    """
+    Collects the targets whose ReducedDatums change inside the block
+    and refreshes each of their summaries once on exit
+    """
+    if getattr(_deferred, 'target_ids', None) is not None:
+        # Already deferring in an outer block
+        yield _deferred.target_ids
+        return
+
+    _deferred.target_ids = set()
+    try:
+        yield _deferred.target_ids
+    finally:
+        target_ids, _deferred.target_ids = _deferred.target_ids, None
+        if target_ids:
+            refresh_target_summaries(target_ids)
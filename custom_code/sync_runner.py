@@ -0,0 +1,115 @@
+"""
+Parallel runner for the incremental SNEx1 sync.
+
+Each window of db_changes rows is split into partitions by the pipeline id
+of the target the change belongs to, so that all the changes of a target
+stay in one partition and are applied in id order. Partitions are synced
+by a pool of spawned processes, each of which sets up Django and opens its
+own SNEx1 and SNEx2 connections, and their counters are added up here.
+
+This module is imported by the worker processes before Django is set up,
+so it must not import models at the top level.
+"""
+import multiprocessing
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+Change = namedtuple('Change', ['id', 'tablename', 'rowid', 'action'])
+
+
+def _init_worker():
+    django.setup()
+
+
+def _sync_partition(changes, standard_ids):
+    from custom_code.scripts import sync_databases
+    from custom_code.summaries import deferred_summaries
+
+    changes = [Change(*change) for change in changes]
+    with deferred_summaries():
+        failed = sync_databases.sync_change_window(changes, standard_ids)
+
+    tables = {change.id: change.tablename for change in changes}
+    return {
+        'processed': Counter(tables.values()),
+        'failed': Counter(tables[change_id] for change_id in failed),
+        'failed_ids': failed,
+    }
+
+
+class ParallelSyncRunner:
+    """
+    Context manager owning the worker pool, with running totals of the
+    processed and failed changes per table
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.processed = Counter()
+        self.failed = Counter()
+        self._pool = None
+
+    def __enter__(self):
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker
+        )
+        return self
+
+    def __exit__(self, *exc):
+        self._pool.shutdown(wait=True)
+        self._pool = None
+        return False
+
+    def partition(self, changes, pipeline_ids):
+        """
+        Splits changes into at most self.workers lists, keeping every
+        change of a pipeline id in the same list and in id order
+        """
+        partitions = [[] for _ in range(self.workers)]
+        for change in changes:
+            # Changes whose row is gone (e.g. deletes) only touch themselves
+            key = pipeline_ids.get(change.id, change.rowid)
+            partitions[hash(key) % self.workers].append(
+                (change.id, change.tablename, change.rowid, change.action)
+            )
+        return [partition for partition in partitions if partition]
+
+    def sync_window(self, changes, pipeline_ids, standard_ids):
+        """
+        Syncs a window of changes across the pool and returns the set of
+        ids of the changes that failed
+        """
+        futures = [
+            (partition, self._pool.submit(_sync_partition, partition, standard_ids))
+            for partition in self.partition(changes, pipeline_ids)
+        ]
+
+        failed = set()
+        for partition, future in futures:
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.exception(f'Sync worker failed on {len(partition)} changes with exception {e}')
+                self.processed.update(change[1] for change in partition)
+                self.failed.update(change[1] for change in partition)
+                failed |= {change[0] for change in partition}
+                continue
+
+            self.processed.update(result['processed'])
+            self.failed.update(result['failed'])
+            failed |= result['failed_ids']
+
+        return failed
+
+    def summary(self):
+        return ', '.join(
+            f'{table}: {self.processed[table]} processed, {self.failed[table]} failed'
+            for table in sorted(self.processed)
+        )
@@ -2,6 +2,7 @@ from django.db import models
 from tom_targets.models import BaseTarget
 from django.core.exceptions import ValidationError
 from custom_code.utils import _load_table, _return_session
+from custom_code.spatial import cone_search, zone_for_dec
 from sqlalchemy import func
 from datetime import datetime
 from django.conf import settings
@@ -30,6 +31,9 @@ class SNExTarget(BaseTarget):
     gwfollowupgalaxy_id = models.FloatField(null=True, blank=True)
     gwfollowupgalaxy_id.hidden = True
     pipeline_id = models.IntegerField(null=True, blank=True)
+    zone = models.IntegerField(null=True, blank=True, db_index=True, editable=False,
+        help_text='Declination zone of the target, see custom_code.spatial')
+    zone.hidden = True
 
     class Meta:
         verbose_name = "target"
@@ -43,18 +47,18 @@ class SNExTarget(BaseTarget):
     def clean(self):
         super().clean()
         if self.ra is not None and self.dec is not None:
-            nearby = BaseTarget.objects.filter(
-                ra__gte=self.ra - 4/3600,
-                ra__lte=self.ra + 4/3600,
-                dec__gte=self.dec - 4/3600,
-                dec__lte=self.dec + 4/3600
-            )
+            nearby = cone_search(SNExTarget.objects.all(), self.ra, self.dec, 4/3600)
             if self.pk:
                 nearby = nearby.exclude(pk=self.pk)
             if nearby.exists():
                 raise ValidationError('Target exists near these coordinates.')
 
     def save(self, *args, **kwargs):
+        self.zone = zone_for_dec(self.dec) if self.dec is not None else None
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'dec' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'zone'}
+
         created = self.pk is None
         if created and self.pipeline_id is None:
             db_session = _return_session(settings.SNEX1_DB_URL)
@@ -20,7 +20,7 @@ from tom_dataproducts.templatetags.dataproduct_extras import dataproduct_list_fo
 from tom_observations.models import ObservationRecord, ObservationGroup
 from tom_common.hooks import run_hook
 
-from astroplan import Observer, FixedTarget, time_grid_from_range, moon_illumination
+from astroplan import Observer, FixedTarget, time_grid_from_range
 import datetime
 from django.utils import timezone
 import json
@@ -33,11 +33,16 @@ import matplotlib.pyplot as plt
 from custom_code.models import *
 from custom_code.forms import CustomDataProductUploadForm, PapersForm, PhotSchedulingForm, SpecSchedulingForm, ReferenceStatusForm, ThumbnailForm
 from custom_code.scheduling import get_proposal_choices
-from tom_observations.utils import get_sidereal_visibility
 from custom_code.facilities.lco_facility import SnexPhotometricSequenceForm, SnexSpectroscopicSequenceForm
 from custom_code.facilities.soar_facility import SOARObservationForm, user_can_access_soar
-from custom_code.thumbnails import make_thumb
-import base64
+from custom_code import thumbnail_store
+from custom_code.visibility import get_24hr_visibility, get_sidereal_visibility, hours_above_airmass, SITE_COLORS
+from custom_code import render_cache
+from custom_code.photometry import group_by_filter, load_photometry, photometry_for_user
+from custom_code.ephemeris import moon_illumination, moon_position
+from custom_code.spatial import angular_separation
+from custom_code import times
+from custom_code.spectra import bin_spectrum, spectrum_arrays
 import logging
 import os
 
@@ -47,18 +52,7 @@ LIGHTCURVE_CONTROLS_HEIGHT = 580
 
 register = template.Library()
 
-@register.inclusion_tag('custom_code/airmass_collapse.html')
-def airmass_collapse(target):
-    interval = 30 #min
-    airmass_limit = 3.0
-
-    obj = Target
-    obj.ra = target.ra
-    obj.dec = target.dec
-    obj.epoch = 2000
-    obj.type = 'SIDEREAL' 
-
-    plot_data = get_24hr_airmass(obj, interval, airmass_limit)
+def _airmass_collapse_figure(plot_data, airmass_limit):
     layout = go.Layout(
         xaxis=dict(gridcolor='#D3D3D3',showline=True,linecolor='#D3D3D3',mirror=True),
         yaxis=dict(range=[airmass_limit,1.0],gridcolor='#D3D3D3',showline=True,linecolor='#D3D3D3',mirror=True),
@@ -69,65 +63,79 @@ def airmass_collapse(target):
         showlegend=False,
         plot_bgcolor='white'
     )
-    visibility_graph = offline.plot(
+    return offline.plot(
             go.Figure(data=plot_data, layout=layout), output_type='div', show_link=False, config={'staticPlot': True}, include_plotlyjs=False
     )
+
+@register.inclusion_tag('custom_code/airmass_collapse.html')
+def airmass_collapse(target):
+    interval = 30 #min
+    airmass_limit = 3.0
+
+    visibility_graph = render_cache.get_or_render(
+        render_cache.airmass_key('airmass_collapse', target),
+        lambda: _airmass_collapse_figure(get_24hr_airmass(target, interval, airmass_limit), airmass_limit),
+        timeout=render_cache.AIRMASS_BUCKET
+    )
     return {
         'target': target,
         'figure': visibility_graph
     }
 
+def airmass_collapse_batch(targets):
+    """
+    Computes the collapsed airmass plots and the hours above airmass
+    1.6 and 2.0 at every site for a list of targets in one pass
+    """
+    interval = 30 #min
+    airmass_limit = 3.0
+
+    keys = {target.id: render_cache.airmass_key('airmass_collapse_batch', target) for target in targets}
+    results = cache.get_many(list(keys.values()))
+    results = {target_id: results[key] for target_id, key in keys.items() if key in results}
+
+    targets = [t for t in targets if t.id not in results]
+    if not targets:
+        return results
+
+    sites, time_plot, airmass = get_24hr_visibility(
+        [t.ra for t in targets], [t.dec for t in targets], interval, airmass_limit
+    )
+    hours_low = hours_above_airmass(airmass, interval, 1.6)
+    hours_high = hours_above_airmass(airmass, interval, 2.0)
+
+    rendered = {}
+    for n, target in enumerate(targets):
+        plot_data = _airmass_traces(sites, time_plot, airmass[n])
+        results[target.id] = rendered[keys[target.id]] = {
+            'figure': _airmass_collapse_figure(plot_data, airmass_limit),
+            'hours_above_airmass': {
+                site: {'1.6': float(hours_low[n, i]), '2.0': float(hours_high[n, i])}
+                for i, site in enumerate(sites.names)
+            }
+        }
+    cache.set_many(rendered, render_cache.AIRMASS_BUCKET)
+    return results
+
 @register.inclusion_tag('custom_code/airmass.html', takes_context=True)
 def airmass_plot(context):
     #request = context['request']
     interval = 15 #min
     airmass_limit = 3.0
-    plot_data = get_24hr_airmass(context['object'], interval, airmass_limit)
+    target = context['object']
+    sites, time_plot, airmass = get_24hr_visibility(target.ra, target.dec, interval, airmass_limit)
+    plot_data = _airmass_traces(sites, time_plot, airmass[0])
 
     ### Get the amount of time each site is above airmass 1.6 and 2.0
-    for t in plot_data:
-        time_vals = t['x']
-        airmass_vals = np.asarray(t['y'])
-        vals_above_airmass_low = np.where(airmass_vals < 1.6)
-        vals_above_airmass_high = np.where(airmass_vals < 2.0)
-        
-        ### Have to do this in a complex way to avoid nonsense answers when the
-        ### visibility plots wrap around to 24 hours from now
-        if len(vals_above_airmass_low[0]) > 0:
-            time_diffs = np.asarray(time_vals[vals_above_airmass_low]) - min(time_vals[vals_above_airmass_low])
-            valid_time_diffs = np.where(time_diffs < datetime.timedelta(hours=12))
-            ### Get the ones that are ~24 hours from now too
-            tomorrow_time_diffs = np.where(time_diffs > datetime.timedelta(hours=12))
-
-            if len(tomorrow_time_diffs[0]) > 0: # Visibility plot wrapped, so account for that
-                time_diff = max(time_diffs[valid_time_diffs]) + (max(time_diffs[tomorrow_time_diffs]) - min(time_diffs[tomorrow_time_diffs]))
-            
-            else:
-                time_diff = max(time_diffs[valid_time_diffs])
-            time_above_airmass_low = round(time_diff.total_seconds() / 3600, 1)
-        
-        else:
-            time_above_airmass_low = 0.0
-
-        if len(vals_above_airmass_high[0]) > 0:
-            time_diffs = np.asarray(time_vals[vals_above_airmass_high]) - min(time_vals[vals_above_airmass_high])
-            valid_time_diffs = np.where(time_diffs < datetime.timedelta(hours=12))
-            tomorrow_time_diffs = np.where(time_diffs > datetime.timedelta(hours=12))
-            
-            if len(tomorrow_time_diffs[0]) > 0:
-                time_diff = max(time_diffs[valid_time_diffs]) + (max(time_diffs[tomorrow_time_diffs]) - min(time_diffs[tomorrow_time_diffs]))
-            
-            else:
-                time_diff = max(time_diffs[valid_time_diffs])
-            time_above_airmass_high = round(time_diff.total_seconds() / 3600, 1)
-        
-        else:
-            time_above_airmass_high = 0.0
-        
+    hours_low = hours_above_airmass(airmass[0], interval, 1.6)
+    hours_high = hours_above_airmass(airmass[0], interval, 2.0)
+    hours_from_now = np.asarray([(time_val - datetime.datetime.utcnow()).total_seconds() / 3600 for time_val in time_plot])
+
+    for t, time_above_airmass_low, time_above_airmass_high in zip(plot_data, hours_low, hours_high):
         text = 'Time Above Airmass 1.6: {} hr;Time Above Airmass 2.0: {} hr'.format(time_above_airmass_low, time_above_airmass_high) 
         t['hovertemplate'] = '(%{customdata|%Y-%m-%d %H:%M:%S}, %{y:.2f})' + '<br>{}'.format(text.split(';')[0]) + '<br>{}'.format(text.split(';')[1])
-        t['customdata'] = time_vals
-        t['x'] = np.asarray([(time_val - datetime.datetime.utcnow()).total_seconds() / 3600 for time_val in time_vals])
+        t['customdata'] = time_plot
+        t['x'] = hours_from_now
 
     layout = go.Layout(
         xaxis=dict(gridcolor='#D3D3D3',showline=True,linecolor='#D3D3D3',mirror=True,title_text="Hours From Now"),
@@ -147,86 +155,26 @@ def airmass_plot(context):
         'figure': visibility_graph
     }
 
-def get_24hr_airmass(target, interval, airmass_limit, halimit=4.8):
+def _airmass_traces(sites, time_plot, airmass):
 
     plot_data = []
-    
-    start = Time(datetime.datetime.utcnow())
-    end = Time(start.datetime + datetime.timedelta(days=1))
-    time_range = time_grid_from_range(
-        time_range = [start, end],
-        time_resolution = interval*u.minute)
-    time_plot = time_range.datetime
-    
-    fixed_target = FixedTarget(name = target.name, 
-        coord = SkyCoord(
-            target.ra,
-            target.dec,
-            unit = 'deg'
+    for i, site in enumerate(sites.names):
+        label = '({facility}) {site}'.format(
+            facility = sites.facility, site = site
         )
-    )
 
-    #Hack to speed calculation up by factor of ~3
-    sun_coords = get_sun(time_range[int(len(time_range)/2)])
-    fixed_sun = FixedTarget(name = 'sun',
-        coord = SkyCoord(
-            sun_coords.ra,
-            sun_coords.dec,
-            unit = 'deg'
+        plot_data.append(
+            go.Scatter(x=time_plot, y=airmass[i], mode='lines', name=label, marker=dict(color=SITE_COLORS[site]))
         )
-    )
 
-    #Colors to match SNEx1
-    colors = {
-        'Siding Spring': '#3366cc',
-        'Sutherland': '#dc3912',
-        'Teide': '#8c6239',
-        'Cerro Tololo': '#ff9900',
-        'McDonald': '#109618',
-        'Haleakala': '#990099'
-    }
-
-    for observing_facility in facility.get_service_classes():
-
-        if observing_facility != 'LCO':
-            continue
-
-        observing_facility_class = facility.get_service_class(observing_facility)
-        sites = observing_facility_class().get_observing_sites()
-
-        for site, site_details in sites.items():
-
-            observer = Observer(
-                longitude = site_details.get('longitude')*u.deg,
-                latitude = site_details.get('latitude')*u.deg,
-                elevation = site_details.get('elevation')*u.m
-            )
-            
-            sun_alt = observer.altaz(time_range, fixed_sun).alt
-            obj_airmass = observer.altaz(time_range, fixed_target).secz
-
-            ha = observer.target_hour_angle(time_range, fixed_target).value
-            ha[ha > 12] = 24 - ha[ha > 12]
-
-            bad_indices = np.argwhere(
-                (obj_airmass >= airmass_limit) |
-                (obj_airmass <= 1) |
-                (sun_alt > -12*u.deg) | #between astro twilights
-                (ha > halimit)
-            )
-
-            obj_airmass = [np.nan if i in bad_indices else float(x)
-                for i, x in enumerate(obj_airmass)]
-
-            label = '({facility}) {site}'.format(
-                facility = observing_facility, site = site
-            )
+    return plot_data
 
-            plot_data.append(
-                go.Scatter(x=time_plot, y=obj_airmass, mode='lines', name=label, marker=dict(color=colors[site]))
-            )
+def get_24hr_airmass(target, interval, airmass_limit, halimit=4.8):
 
-    return plot_data
+    sites, time_plot, airmass = get_24hr_visibility(
+        target.ra, target.dec, interval, airmass_limit, halimit=halimit
+    )
+    return _airmass_traces(sites, time_plot, airmass[0])
 
 
 def get_color(filter_name, filter_translate):
@@ -260,35 +208,15 @@ def generic_lightcurve_plot(target, user):
         'g': 'g', 'gp': 'g', 'r': 'r', 'rp': 'r', 'i': 'i', 'ip': 'i',
         'g_ZTF': 'g_ZTF', 'r_ZTF': 'r_ZTF', 'i_ZTF': 'i_ZTF', 'UVW2': 'UVW2', 'UVM2': 'UVM2', 
         'UVW1': 'UVW1'}
-    photometry_data = {}
+    photometry_data = group_by_filter(load_photometry(photometry_for_user(target, user)), filter_translate)
 
-    if settings.TARGET_PERMISSIONS_ONLY:
-        datums = ReducedDatum.objects.filter(target=target, data_type=settings.DATA_PRODUCT_TYPES['photometry'][0])
-    
-    else:
-        datums = get_objects_for_user(user,
-                                      'tom_dataproducts.view_reduceddatum',
-                                      klass=ReducedDatum.objects.filter(
-                                        target=target,
-                                        data_type=settings.DATA_PRODUCT_TYPES['photometry'][0]))
-    for rd in datums:
-    #for rd in ReducedDatum.objects.filter(target=target, data_type='photometry'):
-        value = rd.value
-        if not value:  # empty
-            continue
-        if isinstance(value, str):
-            value = json.loads(value)
+    return _photometry_traces(photometry_data, filter_translate)
 
-        filt = filter_translate.get(value.get('filter', ''), '')
-   
-        photometry_data.setdefault(filt, {})
-        photometry_data[filt].setdefault('time', []).append(rd.timestamp)
-        photometry_data[filt].setdefault('magnitude', []).append(value.get('magnitude',None))
-        photometry_data[filt].setdefault('error', []).append(value.get('error', None))
 
+def _photometry_traces(photometry_data, filter_translate):
     plot_data = [
         go.Scatter(
-            x=filter_values['time'],
+            x=filter_values['timestamp'],
             y=filter_values['magnitude'], mode='markers',
             marker=dict(color=get_color(filter_name, filter_translate)),
             name=filter_translate.get(filter_name, ''),
@@ -305,6 +233,16 @@ def generic_lightcurve_plot(target, user):
 
 @register.inclusion_tag('custom_code/lightcurve_collapse.html')
 def lightcurve_collapse(target, user):
+    plot = render_cache.get_or_render(
+        render_cache.plot_key('lightcurve_collapse', target.id, user, ('photometry', 'spectroscopy')),
+        lambda: _lightcurve_collapse_plot(target, user)
+    )
+    return {
+        'target': target,
+        'plot': plot
+    }
+
+def _lightcurve_collapse_plot(target, user):
     
     plot_data = generic_lightcurve_plot(target, user)   
 
@@ -336,30 +274,18 @@ def lightcurve_collapse(target, user):
             ) for s in spec]
     )
     if plot_data:
-        return {
-            'target': target,
-            'plot': offline.plot(go.Figure(data=plot_data, layout=layout), output_type='div', show_link=False, config={'staticPlot': True}, include_plotlyjs=False)
-        }
+        return offline.plot(go.Figure(data=plot_data, layout=layout), output_type='div', show_link=False, config={'staticPlot': True}, include_plotlyjs=False)
     else:
-        return {
-            'target': target,
-            'plot': 'No photometry for this target yet.'
-        }
+        return 'No photometry for this target yet.'
 
 @register.inclusion_tag('custom_code/moon.html')
 def moon_vis(target):
 
     day_range = 30
-    times = Time(
-        [str(datetime.datetime.utcnow() + datetime.timedelta(days=delta))
-            for delta in np.arange(0, day_range, 0.2)],
-        format = 'iso', scale = 'utc'
-    )
-    
-    obj_pos = SkyCoord(target.ra, target.dec, unit=u.deg)
-    moon_pos = get_body("moon", times)
+    times = Time(datetime.datetime.utcnow()) + np.arange(0, day_range, 0.2) * u.day
 
-    separations = moon_pos.separation(obj_pos).deg
+    moon_ra, moon_dec = moon_position(times)
+    separations = angular_separation(moon_ra, moon_dec, target.ra, target.dec)
     phases = moon_illumination(times)
 
     distance_color = 'rgb(0, 0, 255)'
@@ -396,25 +322,9 @@ def moon_vis(target):
 
 def bin_spectra(waves, fluxes, b):
     """
-    Bins spectra given list of wavelengths, fluxes, and binning factor
+    Bins spectra given arrays of wavelengths, fluxes, and binning factor
     """
-    try:
-        b = int(b)
-    except (TypeError, ValueError):
-        b = 1
-    if b < 1 or not fluxes or len(fluxes) < b:
-        return list(waves), list(fluxes)
-
-    binned_waves = []
-    binned_flux = []
-    for index in range(0, len(fluxes) - b + 1, b):
-        sumx = sum(waves[index:index + b]) / b
-        sumy = sum(fluxes[index:index + b]) / b
-        if sumx > 0:
-            binned_waves.append(sumx)
-            binned_flux.append(sumy)
-
-    return binned_waves, binned_flux
+    return bin_spectrum(waves, fluxes, b)
 
 
 @register.inclusion_tag('custom_code/spectra.html',takes_context=True)
@@ -439,7 +349,7 @@ def spectra_plot(context, target, dataproduct=None):
     for spectrum in spectral_dataproducts:
         name = str(spectrum.timestamp).split(' ')[0]
         wavelength, flux = extract_spectrum_arrays(spectrum)
-        if not wavelength or not flux:
+        if not flux.size:
             continue
 
         binned_wavelength, binned_flux = bin_spectra(wavelength, flux, 5)
@@ -488,25 +398,22 @@ def spectra_plot(context, target, dataproduct=None):
 
 @register.inclusion_tag('custom_code/spectra_collapse.html')
 def spectra_collapse(target,user):
+    plot = render_cache.get_or_render(
+        render_cache.plot_key('spectra_collapse', target.id, user, ('spectroscopy',)),
+        lambda: _spectra_collapse_plot(target, user)
+    )
+    return {
+        'target': target,
+        'plot': plot
+    }
+
+def _spectra_collapse_plot(target, user):
     spectra = []
     spectral_dataproducts = get_objects_for_user(user, 'tom_dataproducts.view_reduceddatum',
                                                  klass=ReducedDatum.objects.filter(
                                                      target=target, data_type='spectroscopy')).order_by('-timestamp')
     for spectrum in spectral_dataproducts:
-        datum = spectrum.value
-        wavelength = []
-        flux = []
-        if datum.get('photon_flux'):
-            wavelength = datum.get('wavelength')
-            flux = datum.get('photon_flux')
-        elif datum.get('flux'):
-            wavelength = datum.get('wavelength')
-            flux = datum.get('flux')
-        else:
-            for key, value in datum.items():
-                wavelength.append(float(value['wavelength']))
-                flux.append(float(value['flux']))
-        
+        wavelength, flux = extract_spectrum_arrays(spectrum)
         binned_wavelength, binned_flux = bin_spectra(wavelength, flux, 5)
         spectra.append((binned_wavelength, binned_flux))
     plot_data = [
@@ -535,15 +442,9 @@ def spectra_collapse(target,user):
         plot_bgcolor='white'
     )
     if plot_data:
-      return {
-          'target': target,
-          'plot': offline.plot(go.Figure(data=plot_data, layout=layout), output_type='div', show_link=False, config={'staticPlot': True}, include_plotlyjs=False)
-      }
+        return offline.plot(go.Figure(data=plot_data, layout=layout), output_type='div', show_link=False, config={'staticPlot': True}, include_plotlyjs=False)
     else:
-        return {
-            'target': target,
-            'plot': 'No spectra for this target yet.'
-        }
+        return 'No spectra for this target yet.'
 
 @register.inclusion_tag('custom_code/aladin_collapse.html')
 def aladin_collapse(target):
@@ -681,23 +582,7 @@ def dash_lightcurve(context, target, height):
     background_subtracted = False
     user = User.objects.get(username=request.user)
 
-    if settings.TARGET_PERMISSIONS_ONLY:
-        datumquery = ReducedDatum.objects.filter(target=target, 
-                                                 data_type=settings.DATA_PRODUCT_TYPES['photometry'][0])
-    
-    else:
-        datumquery = get_objects_for_user(user, 'tom_dataproducts.view_reduceddatum',
-                                          klass=ReducedDatum.objects.filter(
-                                              target=target,
-                                              data_type=settings.DATA_PRODUCT_TYPES['photometry'][0]))
-
-    for i in datumquery:
-        datum_value = i.value
-        if isinstance(datum_value, str):
-            datum_value = json.loads(datum_value)
-        if datum_value.get('background_subtracted', '') == True:
-            background_subtracted = True
-            break
+    background_subtracted = photometry_for_user(target, user, value__background_subtracted=True).exists()
 
     final_background_subtracted = False
     for de in get_objects_for_user(user, 'custom_code.view_reduceddatumextra',
@@ -817,22 +702,11 @@ def dash_spectra(context, target):
     min_flux = 0
     for i in range(len(spectral_dataproducts)):
         spectrum = spectral_dataproducts[i]
-        datum = spectrum.value
-        wavelength = []
-        flux = []
-        name = str(spectrum.timestamp).split(' ')[0]
-        if datum.get('photon_flux'):
-            wavelength = datum.get('wavelength')
-            flux = datum.get('photon_flux')
-        elif datum.get('flux'):
-            wavelength = datum.get('wavelength')
-            flux = datum.get('flux')
-        else:
-            for key, value in datum.items():
-                wavelength.append(value['wavelength'])
-                flux.append(float(value['flux']))
-        if max(flux) > max_flux: max_flux = max(flux)
-        if min(flux) < min_flux: min_flux = min(flux)
+        _, flux = spectrum_arrays(spectrum.value)
+        if not flux.size:
+            continue
+        max_flux = max(max_flux, float(flux.max()))
+        min_flux = min(min_flux, float(flux.min()))
 
     dash_context = {'target_id': {'value': target.id},
                     'user_id': {'value': user.id},
@@ -1437,32 +1311,16 @@ def spectra_list(context, target):
 
 
 def extract_spectrum_arrays(spectrum):
-    datum = spectrum.value or {}
-    wavelength = []
-    flux = []
-    if datum.get('photon_flux'):
-        wavelength = list(datum.get('wavelength') or [])
-        flux = list(datum.get('photon_flux'))
-    elif datum.get('flux'):
-        wavelength = list(datum.get('wavelength') or [])
-        flux = list(datum.get('flux'))
-    else:
-        for value in datum.values():
-            try:
-                wavelength.append(float(value['wavelength']))
-                flux.append(float(value['flux']))
-            except (KeyError, TypeError, ValueError):
-                continue
-    return wavelength, flux
+    return spectrum_arrays(spectrum.value)
 
 
 def build_spectrum_plot(spectrum, bin_factor=5):
     wavelength, flux = extract_spectrum_arrays(spectrum)
-    if not wavelength or not flux:
+    if not flux.size:
         return ''
 
     binned_wavelength, binned_flux = bin_spectra(wavelength, flux, bin_factor)
-    if not binned_wavelength:
+    if not binned_wavelength.size:
         return ''
 
     layout = go.Layout(
@@ -1486,8 +1344,8 @@ def build_spectrum_entry(target, spectrum, redshift=None, user=None, include_plo
 
     _, flux = extract_spectrum_arrays(spectrum)
 
-    max_flux = max(flux) if flux else 0
-    min_flux = min(flux) if flux else 0
+    max_flux = float(flux.max()) if flux.size else 0
+    min_flux = float(flux.min()) if flux.size else 0
 
     spec_extras_row = ReducedDatumExtra.objects.filter(
         data_type='spectroscopy', target=target, data_product=spectrum.data_product).first()
@@ -1783,20 +1641,19 @@ def image_slideshow(context, target):
     choices = {'filenames': thumbdict}
     thumbnailform = ThumbnailForm(initial=initial, choices=choices)
 
-    ### Make the initial thumbnail
-    if psfxs[0] < 9999 and psfys[0] < 9999:
-        print(os.path.join(settings.FITS_DIR,filepaths[0].lstrip('/'),filenames[0]+'.fits'))
-        f = make_thumb([os.path.join(settings.FITS_DIR,filepaths[0].lstrip('/'),filenames[0]+'.fits')], grow=1.0, x=psfxs[0], y=psfys[0], ticks=True)
-    else:
-        f = make_thumb([os.path.join(settings.FITS_DIR,filepaths[0].lstrip('/'),filenames[0]+'.fits')], grow=1.0, x=1024, y=1024, ticks=False)
+    ### Look up the initial thumbnail, queueing it for the worker if needed
+    fits_path, params = thumbnail_store.frame_thumbnail(filepaths[0], filenames[0], psfxs[0], psfys[0])
+    key, thumbnail = thumbnail_store.request_thumbnail(fits_path, **params)
 
-    with open(os.path.join(settings.THUMB_DIR,f[0]), 'rb') as imagefile:        
-        b64_image = base64.b64encode(imagefile.read())
-        thumb = b64_image
+    if thumbnail is not None:
+        thumb = thumbnail_store.thumbnail_url(thumbnail)
+    else:
+        thumb = None
 
     return {'target': target,
             'form': thumbnailform,
-            'thumb': b64_image.decode('utf-8'),
+            'thumb': thumb,
+            'thumb_key': key,
             'telescope': teles[0],
             'instrument': instr[0],
             'filter': filters[0],
@@ -1812,45 +1669,8 @@ def lightcurve_fits(target, user, filt=False, days=None):
         'g': 'g', 'gp': 'g', 'r': 'r', 'rp': 'r', 'i': 'i', 'ip': 'i',
         'g_ZTF': 'g_ZTF', 'r_ZTF': 'r_ZTF', 'i_ZTF': 'i_ZTF', 'UVW2': 'UVW2', 'UVM2': 'UVM2', 
         'UVW1': 'UVW1'}
-    plot_data = generic_lightcurve_plot(target, user)     
-    photometry_data = {}
-
-    if settings.TARGET_PERMISSIONS_ONLY:
-        datums = ReducedDatum.objects.filter(target=target, data_type=settings.DATA_PRODUCT_TYPES['photometry'][0])
-    else:
-        datums = get_objects_for_user(user,
-                                      'tom_dataproducts.view_reduceddatum',
-                                      klass=ReducedDatum.objects.filter(
-                                        target=target,
-                                        data_type=settings.DATA_PRODUCT_TYPES['photometry'][0]))
-
-    for rd in datums:
-        value = rd.value
-        if not value:  # empty
-            continue
-        if isinstance(value, str):
-            value = json.loads(value)
-
-        current_filt = filter_translate.get(value.get('filter', ''), '')
-   
-        photometry_data.setdefault(current_filt, {})
-        photometry_data[current_filt].setdefault('time', []).append(rd.timestamp)
-        photometry_data[current_filt].setdefault('magnitude', []).append(value.get('magnitude',None))
-        photometry_data[current_filt].setdefault('error', []).append(value.get('error', None))        
-
-    plot_data = [
-        go.Scatter(
-            x=filter_values['time'],
-            y=filter_values['magnitude'], mode='markers',
-            marker=dict(color=get_color(filter_name, filter_translate)),
-            name=filter_translate.get(filter_name, ''),
-            error_y=dict(
-                type='data',
-                array=filter_values['error'],
-                visible=True,
-                color=get_color(filter_name, filter_translate)
-            )
-        ) for filter_name, filter_values in photometry_data.items()] 
+    photometry_data = group_by_filter(load_photometry(photometry_for_user(target, user)), filter_translate)
+    plot_data = _photometry_traces(photometry_data, filter_translate)
      
     layout = go.Layout(
         xaxis=dict(gridcolor='#D3D3D3',showline=True,linecolor='#D3D3D3',mirror=True),
@@ -1884,39 +1704,28 @@ def lightcurve_fits(target, user, filt=False, days=None):
         }
     
     else:
-        filtlist = list(photometry_data.keys())
-        lens = []
-        for f in filtlist:
-            lens.append(len(photometry_data[f]['magnitude']))
-        filt = filtlist[lens.index(max(lens))]
+        filt = max(photometry_data, key=lambda f: len(photometry_data[f]))
         photometry_to_fit = photometry_data[filt]
 
-    start_date = min(photometry_to_fit['time'])
-    start_jd = Time(start_date, scale='utc').jd
-   
-    times = photometry_to_fit['time']
-    mags = []
-    errs = []
-    jds = []
-
     if not days:
         days_to_fit = 20
     else:
         days_to_fit = days
 
-    for date in times:
-        if Time(date, scale='utc').jd < start_jd + days_to_fit:
-            jds.append(float(Time(date, scale='utc').jd))
-            mags.append(photometry_to_fit['magnitude'][times.index(date)])
-            errs.append(photometry_to_fit['error'][times.index(date)])
+    all_jds = times.jd(photometry_to_fit['timestamp'])
+    to_fit = all_jds < all_jds.min() + days_to_fit
+    jds = all_jds[to_fit]
+    mags = photometry_to_fit['magnitude'][to_fit]
+    errs = photometry_to_fit['error'][to_fit]
+    max_mag = ''
     try:
-        A, B, C = np.polyfit(jds, mags, 2, w=1/(np.asarray(errs)))
+        A, B, C = np.polyfit(jds, mags, 2, w=1/errs)
         fit_jds = np.linspace(min(jds), max(jds), 100)
         quadratic_fit = A*fit_jds**2 + B*fit_jds + C
 
         plot_data.append(
             go.Scatter(
-                x=Time(fit_jds, format='jd', scale='utc').isot,
+                x=times.isot(times.from_jd(fit_jds)),
                 y=quadratic_fit, mode='lines',
                 marker=dict(color='gray'),
                 name='n=2 fit'
@@ -1925,7 +1734,7 @@ def lightcurve_fits(target, user, filt=False, days=None):
 
         max_mag = round(min(quadratic_fit), 2)
         max_jd = fit_jds[np.argmin(quadratic_fit)]
-        max_date = Time(max_jd, format='jd', scale='utc').isot
+        max_date = times.isot(times.from_jd([max_jd]))[0]
 
         plot_data.append(
             go.Scatter(
@@ -1997,7 +1806,7 @@ def lightcurve_with_extras(target, user):
             if jd:
                 plot_data.append(
                     go.Scatter(
-                        x=[Time(float(jd), format='jd', scale='utc').isot],
+                        x=times.isot(times.from_jd([float(jd)])),
                         y=[float(value['mag'])], mode='markers',
                         marker=dict(color=get_color(value['filt'], filter_translate), size=12, symbol=symbols[i]),
                         name=names[i]
@@ -2020,9 +1829,6 @@ def lightcurve_with_extras(target, user):
 @register.inclusion_tag('custom_code/thumbnail.html', takes_context=True)
 def display_thumbnails(context, target):
     
-    from os import listdir
-    from os.path import isfile, join
-
     username = context['request'].user
     
     if not settings.DEBUG:
@@ -2040,52 +1846,28 @@ def display_thumbnails(context, target):
                 'no_images': True
             }
     
-    thumbs = [f for f in listdir(settings.THUMB_DIR) if isfile(join(settings.THUMB_DIR, f))]
     top_images = []
     bottom_images = [] 
     sites = [f[:3].upper() for f in filenames]
     
-    thumbfiles = []
-    thumbdates = []
-    thumbteles = []
-    thumbsites = []
-    thumbfilters = []
-    thumbexptimes = []
+    halfway = round(len(filenames)/2)
 
     for i in range(len(filenames)):
-        currentfile = filenames[i]
-        if any(currentfile in f and 'grow' not in f for f in thumbs):
-            matchingfiles = [f for f in thumbs if f.startswith(currentfile) and 'grow' not in f]
-            if matchingfiles:
-                thumbfiles.append(matchingfiles[0])
+        # Look up the thumbnail in the store, queueing it for the worker if needed
+        fits_path, params = thumbnail_store.frame_thumbnail(filepaths[i], filenames[i], psfxs[i], psfys[i])
+        key, thumbnail = thumbnail_store.request_thumbnail(fits_path, **params)
+
+        image = {'key': key,
+                 'url': None,
+                 'label': '{} {} {} {} {}'.format(dates[i], sites[i], teles[i], filters[i], exptimes[i])
+                 }
+        if thumbnail is not None:
+            image['url'] = thumbnail_store.thumbnail_url(thumbnail)
+
+        if i < halfway:
+            top_images.append(image)
         else:
-            # Generate the thumbnail and save the image
-            if psfxs[i] < 9999 and psfys[i] < 9999:
-                f = make_thumb([os.path.join(settings.FITS_DIR,filepaths[i].lstrip('/'),currentfile+'.fits')], grow=1.0, x=psfxs[i], y=psfys[i], ticks=True)
-            else:
-                f = make_thumb([os.path.join(settings.FITS_DIR,filepaths[i].lstrip('/'),currentfile+'.fits')], grow=1.0, x=1024, y=1024, ticks=False)
-            thumbfiles.append(f[0])
-        
-        thumbdates.append(dates[i])
-        thumbteles.append(teles[i])
-        thumbsites.append(sites[i])
-        thumbfilters.append(filters[i])
-        thumbexptimes.append(exptimes[i])
-    
-    halfway = round(len(thumbfiles)/2)
-    
-    for i in range(len(thumbfiles)):
-        with open(os.path.join(settings.THUMB_DIR,thumbfiles[i]), 'rb') as imagefile:        
-            b64_image = base64.b64encode(imagefile.read())
-            label = '{} {} {} {} {}'.format(thumbdates[i], thumbsites[i], thumbteles[i], thumbfilters[i], thumbexptimes[i])
-            if i < halfway:
-                top_images.append({'image': b64_image.decode('utf-8'),
-                                   'label': label,
-                                })
-            else:
-                bottom_images.append({'image': b64_image.decode('utf-8'),
-                                      'label': label
-                                      })
+            bottom_images.append(image)
 
     return {'top_images': top_images,
             'bottom_images': bottom_images,
@@ -2114,12 +1896,12 @@ def broker_target_lightcurve(target):
         if not detections[filt]:
             continue
 
-        photometry_data.setdefault(filt, {})
-
-        for mjd, phot in detections[filt].items():
-            photometry_data[filt].setdefault('time', []).append(Time(mjd, format='mjd').to_value('iso'))
-            photometry_data[filt].setdefault('magnitude', []).append(phot[0])
-            photometry_data[filt].setdefault('magerr', []).append(phot[1])
+        mjds = list(detections[filt].keys())
+        photometry_data[filt] = {
+            'time': times.iso(times.from_mjd(mjds)),
+            'magnitude': [phot[0] for phot in detections[filt].values()],
+            'magerr': [phot[1] for phot in detections[filt].values()],
+        }
 
     plot_data = [
         go.Scatter(
@@ -2141,11 +1923,10 @@ def broker_target_lightcurve(target):
     for filt in nondetections:
         if not nondetections[filt]:
             continue
-        nondetection_data.setdefault(filt, {})
-
-        for mjd, mag in nondetections[filt].items():
-            nondetection_data[filt].setdefault('time', []).append(Time(mjd, format='mjd').to_value('iso'))
-            nondetection_data[filt].setdefault('magnitude', []).append(mag)
+        nondetection_data[filt] = {
+            'time': times.iso(times.from_mjd(list(nondetections[filt].keys()))),
+            'magnitude': list(nondetections[filt].values()),
+        }
 
     plot_data += [
         go.Scatter(
@@ -1,3 +1,90 @@
-from django.test import TestCase
+import numpy as np
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from tom_targets.models import Target, TargetName
 
-# Create your tests here.
+from custom_code.models import TargetNameKey
+from custom_code.names import resolve_target_name
+from custom_code.thumbnails import make_depth_256
+
+
+def _make_depth_256_reference(data, sky, sig, depth=256, zerosig=-1, spansig=6):
+    """
+    The scaling used for thumbnails before make_depth_256 worked in place,
+    followed by the uint8 conversion in prepare_image
+    """
+    data = data.astype(np.float64)
+    zero = sky + zerosig * sig
+    span = spansig * sig
+
+    data -= zero
+    data *= (depth - 1) / span
+    data[data < 0] = 0
+    data[data > (depth - 1)] = (depth - 1)
+    data += 256 - depth
+
+    return data.astype(np.uint8)
+
+
+class MakeDepth256Test(SimpleTestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(20240611)
+        # Sky with noise, a few stars and saturated pixels, as read from a cutout
+        data = rng.normal(1000.0, 25.0, size=(200, 300))
+        data[50:55, 60:65] += 40000.0
+        data[120, 200] = 65535.0
+        data[10:20, 10:20] = -500.0
+        self.data = data.astype(np.float32)
+
+    def test_matches_previous_scaling(self):
+        for dtype in (np.float32, np.float64, np.int16):
+            for zerosig, spansig in ((-1, 6), (0, 4)):
+                data = self.data.astype(dtype)
+                expected = _make_depth_256_reference(data, 1000.0, 25.0, zerosig=zerosig, spansig=spansig)
+                scaled = make_depth_256(data, sky=1000.0, sig=25.0, zerosig=zerosig, spansig=spansig)
+                self.assertEqual(scaled.dtype, np.uint8)
+                np.testing.assert_array_equal(scaled, expected)
+
+    def test_overwrite_matches_copy(self):
+        data = self.data.astype(np.float64)
+        expected = make_depth_256(data, sky=1000.0, sig=25.0)
+        scaled = make_depth_256(data.copy(), sky=1000.0, sig=25.0, overwrite=True)
+        np.testing.assert_array_equal(scaled, expected)
+
+    def test_blank_pixels_are_black(self):
+        data = self.data.copy()
+        data[0, :] = np.nan
+        scaled = make_depth_256(data, sky=1000.0, sig=25.0)
+        self.assertTrue((scaled[0, :] == 0).all())
+
+
+class TargetNameIndexTest(TestCase):
+
+    def setUp(self):
+        # pipeline_id keeps the target out of the SNEx1 database
+        self.target = Target.objects.create(name='2024ggi', type='SIDEREAL', ra=169.59, dec=-32.84, pipeline_id=1)
+        TargetName.objects.create(target=self.target, name='ATLAS24fsk')
+
+    def test_aliases_are_indexed(self):
+        keys = set(TargetNameKey.objects.filter(target=self.target).values_list('name', 'is_alias'))
+        self.assertEqual(keys, {('2024ggi', False), ('ATLAS24fsk', True)})
+
+    def test_prefix_only_search(self):
+        other = Target.objects.create(name='SN 2023ixf', type='SIDEREAL', ra=210.91, dec=54.31, pipeline_id=2)
+        self.assertEqual([match.target_id for match in resolve_target_name('SN')], [other.id])
+        self.assertEqual([match.target_id for match in resolve_target_name('24ggi')], [self.target.id])
+
+    def test_deleting_alias_reindexes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            TargetName.objects.filter(target=self.target).delete()
+        names = list(TargetNameKey.objects.filter(target=self.target).values_list('name', flat=True))
+        self.assertEqual(names, ['2024ggi'])
+
+    def test_deleting_target_with_alias(self):
+        target_id = self.target.id
+        with self.captureOnCommitCallbacks(execute=True):
+            self.target.delete()
+        self.assertFalse(TargetNameKey.objects.filter(target_id=target_id).exists())
+        # The foreign keys are only checked at commit, which TestCase never reaches
+        connection.check_constraints()
@@ -0,0 +1,371 @@
+"""
+Content-addressed store for the image thumbnails.
+
+A thumbnail is identified by the basename of its FITS image and the
+parameters it was rendered with. The SHA-1 of those is the key of its
+Thumbnail index row and names the image file, which lives in a sharded
+directory under settings.THUMB_DIR (ab/cd/abcd....webp), so finding a
+thumbnail is one indexed lookup however many thumbnails exist.
+
+The index also records the size and last access time of every image, and
+collect_garbage evicts the least recently used ones to keep the store
+under an age limit and a size cap (see the gc_thumbnails command).
+
+Web requests never render: request_thumbnail returns the stored thumbnail
+or queues a ThumbnailJob, and the thumbnail_worker command renders the
+queue in the background. Default thumbnails of new photlco frames are
+queued by the SNEx1 sync, so they are usually ready before anyone looks.
+"""
+import datetime
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.urls import reverse
+from django.utils import timezone
+
+from custom_code.models import Thumbnail, ThumbnailJob
+from custom_code.thumbnails import render_thumb
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_STORE_MAX_BYTES = getattr(settings, 'THUMBNAIL_STORE_MAX_BYTES', 5 * 1024**3)
+THUMBNAIL_STORE_MAX_AGE_DAYS = getattr(settings, 'THUMBNAIL_STORE_MAX_AGE_DAYS', 180)
+# Access times are only written back this often, so most lookups are a single read
+TOUCH_INTERVAL = datetime.timedelta(hours=1)
+
+THUMBNAIL_JOB_MAX_ATTEMPTS = getattr(settings, 'THUMBNAIL_JOB_MAX_ATTEMPTS', 3)
+# Failed renders are retried after this delay, doubling with each attempt
+THUMBNAIL_JOB_RETRY_DELAY = datetime.timedelta(seconds=getattr(settings, 'THUMBNAIL_JOB_RETRY_DELAY', 60))
+# A job that ran out of attempts is requeued by the next request after this long
+THUMBNAIL_JOB_FAILED_COOLDOWN = datetime.timedelta(seconds=getattr(settings, 'THUMBNAIL_JOB_FAILED_COOLDOWN', 3600))
+# Running jobs older than this are assumed to belong to a dead worker
+THUMBNAIL_JOB_TIMEOUT = datetime.timedelta(minutes=10)
+# Someone is waiting for a requested thumbnail, so it goes ahead of pre-rendering
+PRIORITY_REQUEST = 10
+PRIORITY_PRERENDER = 0
+
+
+def fits_basename(filename):
+    basename = os.path.basename(filename)
+    for ext in ('.fz', '.fits'):
+        if basename.endswith(ext):
+            basename = basename[:-len(ext)]
+    return basename
+
+
+def frame_thumbnail(filepath, filename, psfx=None, psfy=None):
+    """
+    Returns the FITS path and the parameters of the default thumbnail of a
+    photlco frame, centred on the target if its position is known
+    """
+    filepath = filepath.replace(settings.LSC_DIR, '').replace('/supernova/data/', '')
+    fits_path = os.path.join(settings.FITS_DIR, filepath.lstrip('/'), fits_basename(filename) + '.fits')
+    if psfx is not None and psfy is not None and psfx < 9999 and psfy < 9999:
+        return fits_path, {'grow': 1.0, 'sigma': 4.0, 'x': psfx, 'y': psfy, 'ticks': True}
+    return fits_path, {'grow': 1.0, 'sigma': 4.0, 'x': 1024, 'y': 1024, 'ticks': False}
+
+
+def thumbnail_key(basename, grow=1.0, sigma=4.0, x=900, y=900, ticks=False):
+    params = '{}|{!r}|{!r}|{!r}|{!r}|{}'.format(
+        basename, float(grow), float(sigma), float(x), float(y), int(bool(ticks))
+    )
+    return hashlib.sha1(params.encode()).hexdigest()
+
+
+def relative_path(key):
+    return os.path.join(key[:2], key[2:4], key + '.webp')
+
+
+def absolute_path(relative):
+    return os.path.join(settings.THUMB_DIR, relative)
+
+
+def _write_image(image, path):
+    # Write to a temporary file and rename, so readers never see half an image
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            image.save(f, 'WEBP')
+        os.replace(tmppath, path)
+    except:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+        raise
+    return os.path.getsize(path)
+
+
+def thumbnail_version(thumbnail):
+    # A thumbnail rendered again after eviction gets a new index row
+    return int(thumbnail.created.timestamp())
+
+
+def thumbnail_url(thumbnail):
+    """
+    Returns the URL of a stored thumbnail, which names this rendering of
+    it, so browsers can cache it for good
+    """
+    return '{}?v={}'.format(reverse('thumbnail', kwargs={'key': thumbnail.key}), thumbnail_version(thumbnail))
+
+
+def thumbnail_etag(thumbnail):
+    return '"{}-{}"'.format(thumbnail.key, thumbnail_version(thumbnail))
+
+
+def lookup(basename, grow=1.0, sigma=4.0, x=900, y=900, ticks=False):
+    """
+    Returns the Thumbnail of these parameters if its image exists,
+    marking it as used
+    """
+    return lookup_key(thumbnail_key(basename, grow, sigma, x, y, ticks))
+
+
+def lookup_key(key):
+    """
+    Returns the Thumbnail with this key if its image exists, marking it as used
+    """
+    thumbnail = Thumbnail.objects.filter(key=key).first()
+    if thumbnail is None:
+        return None
+    if not os.path.exists(absolute_path(thumbnail.path)):
+        thumbnail.delete()
+        return None
+
+    now = timezone.now()
+    if now - thumbnail.last_accessed > TOUCH_INTERVAL:
+        Thumbnail.objects.filter(pk=thumbnail.pk).update(last_accessed=now)
+        thumbnail.last_accessed = now
+    return thumbnail
+
+
+def get_thumbnail(filename, grow=1.0, sigma=4.0, x=900, y=900, ticks=False):
+    """
+    Returns the Thumbnail of the FITS image at filename rendered with
+    these parameters, rendering and storing it if there is none yet
+    """
+    basename = fits_basename(filename)
+    thumbnail = lookup(basename, grow, sigma, x, y, ticks)
+    if thumbnail is not None:
+        return thumbnail
+
+    key = thumbnail_key(basename, grow, sigma, x, y, ticks)
+    image = render_thumb(filename, grow=grow, x=x, y=y, ticks=ticks, spansig=sigma)
+    path = relative_path(key)
+    size = _write_image(image, absolute_path(path))
+    logger.info(f'Stored thumbnail {path} of {basename}')
+
+    thumbnail, _ = Thumbnail.objects.update_or_create(
+        key=key,
+        defaults={
+            'basename': basename[:100],
+            'grow': grow,
+            'sigma': sigma,
+            'x': x,
+            'y': y,
+            'ticks': bool(ticks),
+            'path': path,
+            'size': size,
+            'last_accessed': timezone.now(),
+        }
+    )
+    return thumbnail
+
+
+def enqueue(filename, grow=1.0, sigma=4.0, x=900, y=900, ticks=False, priority=PRIORITY_REQUEST):
+    """
+    Queues the thumbnail of the FITS image at filename for the worker,
+    raising the priority of a job that is already queued and requeueing
+    one that failed, once its cooldown is over
+
+    Returns the ThumbnailJob
+    """
+    key = thumbnail_key(fits_basename(filename), grow, sigma, x, y, ticks)
+    job, created = ThumbnailJob.objects.get_or_create(
+        key=key,
+        defaults={
+            'filename': filename[:300],
+            'grow': grow,
+            'sigma': sigma,
+            'x': x,
+            'y': y,
+            'ticks': bool(ticks),
+            'priority': priority,
+        }
+    )
+    if created:
+        return job
+
+    if job.status == 'failed' and (job.not_before is None or job.not_before <= timezone.now()):
+        # Often the file was not there yet, or the disk was briefly unavailable
+        updated = ThumbnailJob.objects.filter(pk=job.pk, status='failed').update(
+            status='pending', attempts=0, not_before=None, priority=max(job.priority, priority)
+        )
+        if updated:
+            job.status, job.attempts, job.not_before = 'pending', 0, None
+            job.priority = max(job.priority, priority)
+    elif job.status == 'pending' and job.priority < priority:
+        ThumbnailJob.objects.filter(pk=job.pk).update(priority=priority)
+        job.priority = priority
+    return job
+
+
+def enqueue_frames(frames, priority=PRIORITY_PRERENDER):
+    """
+    Queues the default thumbnails of (filepath, filename, psfx, psfy)
+    photlco frames, skipping those that are stored or queued already
+
+    Returns the number of jobs queued
+    """
+    jobs = {}
+    for filepath, filename, psfx, psfy in frames:
+        fits_path, params = frame_thumbnail(filepath, filename, psfx, psfy)
+        key = thumbnail_key(fits_basename(fits_path), **params)
+        jobs[key] = ThumbnailJob(key=key, filename=fits_path[:300], priority=priority, **params)
+    if not jobs:
+        return 0
+
+    stored = set(Thumbnail.objects.filter(key__in=list(jobs)).values_list('key', flat=True))
+    new = [job for key, job in jobs.items() if key not in stored]
+    ThumbnailJob.objects.bulk_create(new, ignore_conflicts=True)
+    return len(new)
+
+
+def request_thumbnail(filename, grow=1.0, sigma=4.0, x=900, y=900, ticks=False):
+    """
+    Returns the key and the stored Thumbnail of these parameters, or the
+    key and None after queueing it for the worker, so requests never render
+    """
+    thumbnail = lookup(fits_basename(filename), grow, sigma, x, y, ticks)
+    if thumbnail is not None:
+        return thumbnail.key, thumbnail
+    job = enqueue(filename, grow, sigma, x, y, ticks, priority=PRIORITY_REQUEST)
+    return job.key, None
+
+
+def thumbnail_states(keys):
+    """
+    Returns a dictionary of key -> (status, Thumbnail or None) for the
+    given thumbnail keys, the status being one of ready, pending or failed
+    """
+    keys = list(keys)
+    thumbnails = {thumbnail.key: thumbnail for thumbnail in Thumbnail.objects.filter(key__in=keys)}
+    failed = set(ThumbnailJob.objects.filter(key__in=keys, status='failed').values_list('key', flat=True))
+
+    states = {}
+    for key in keys:
+        thumbnail = thumbnails.get(key)
+        if thumbnail is not None and os.path.exists(absolute_path(thumbnail.path)):
+            states[key] = ('ready', thumbnail)
+        elif key in failed:
+            states[key] = ('failed', None)
+        else:
+            states[key] = ('pending', None)
+    return states
+
+
+def claim_jobs(limit=10):
+    """
+    Marks up to limit queued jobs as running and returns them, highest
+    priority first, skipping the jobs other workers hold locked and those
+    waiting to be retried
+
+    Jobs left running by a dead worker are claimed again, unless they
+    have used up their attempts (e.g. a frame that makes the worker run
+    out of memory), in which case they are marked as failed
+    """
+    now = timezone.now()
+    timed_out = Q(status='running', started__lt=now - THUMBNAIL_JOB_TIMEOUT)
+    with transaction.atomic():
+        ThumbnailJob.objects.filter(timed_out, attempts__gte=THUMBNAIL_JOB_MAX_ATTEMPTS).update(
+            status='failed', error='Timed out', not_before=now + THUMBNAIL_JOB_FAILED_COOLDOWN
+        )
+        jobs = list(
+            ThumbnailJob.objects.select_for_update(skip_locked=True).filter(
+                (Q(status='pending') & (Q(not_before__isnull=True) | Q(not_before__lte=now))) | timed_out
+            ).order_by('-priority', 'created')[:limit]
+        )
+        for job in jobs:
+            job.status = 'running'
+            job.started = now
+            job.attempts += 1
+        ThumbnailJob.objects.bulk_update(jobs, ['status', 'started', 'attempts'])
+    return jobs
+
+
+def run_job(job):
+    """
+    Renders the thumbnail of a claimed job, deleting the job when it is
+    stored and requeueing it on failure, with a growing delay, until it
+    runs out of attempts
+
+    Returns True if the thumbnail was stored
+    """
+    try:
+        get_thumbnail(job.filename, grow=job.grow, sigma=job.sigma, x=job.x, y=job.y, ticks=job.ticks)
+    except Exception as e:
+        logger.exception(f'Failed to render thumbnail of {job.filename} with exception {e}')
+        now = timezone.now()
+        if job.attempts >= THUMBNAIL_JOB_MAX_ATTEMPTS:
+            job.status = 'failed'
+            job.not_before = now + THUMBNAIL_JOB_FAILED_COOLDOWN
+        else:
+            job.status = 'pending'
+            job.not_before = now + THUMBNAIL_JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        job.error = str(e)
+        job.save(update_fields=['status', 'error', 'not_before'])
+        return False
+
+    job.delete()
+    return True
+
+
+def _evict(thumbnails, dry_run=False):
+    evicted = 0
+    freed = 0
+    for thumbnail in thumbnails:
+        if not dry_run:
+            try:
+                os.remove(absolute_path(thumbnail.path))
+            except FileNotFoundError:
+                pass
+            thumbnail.delete()
+        evicted += 1
+        freed += thumbnail.size
+    return evicted, freed
+
+
+def collect_garbage(max_bytes=THUMBNAIL_STORE_MAX_BYTES, max_age_days=THUMBNAIL_STORE_MAX_AGE_DAYS, dry_run=False):
+    """
+    Evicts the thumbnails not used in max_age_days, then the least recently
+    used ones until the store is under max_bytes (either can be None)
+
+    Returns the number of thumbnails evicted and the bytes freed
+    """
+    evicted = freed = 0
+    remaining = Thumbnail.objects.all()
+
+    if max_age_days is not None:
+        cutoff = timezone.now() - datetime.timedelta(days=max_age_days)
+        evicted, freed = _evict(Thumbnail.objects.filter(last_accessed__lt=cutoff).iterator(), dry_run)
+        # On a dry run the old thumbnails are still there
+        remaining = remaining.filter(last_accessed__gte=cutoff)
+
+    if max_bytes is not None:
+        total = remaining.aggregate(total=Sum('size'))['total'] or 0
+        to_evict = []
+        for thumbnail in remaining.order_by('last_accessed').iterator():
+            if total <= max_bytes:
+                break
+            to_evict.append(thumbnail)
+            total -= thumbnail.size
+        n, size = _evict(to_evict, dry_run)
+        evicted += n
+        freed += size
+
+    return evicted, freed
@@ -6,16 +6,17 @@ Modified from SNEx
 """
 import sys
 import os
+import math
 import numpy as np
 from astropy.io import fits
 from PIL import Image, ImageDraw
-from struct import pack, unpack
 from django.conf import settings
-import tempfile
 import logging
 
 logger = logging.getLogger(__name__)
 
+THUMBNAIL_SKY_SAMPLE_SIZE = getattr(settings, 'THUMBNAIL_SKY_SAMPLE_SIZE', 10000)
+
 
 # ************************************************************
 class ImageThumb:
@@ -62,21 +63,12 @@ class ImageThumb:
         # normalize the sky background?
         self.fixscale = fixscale
 
-        # open the image
-        hlist = fits.open(imagepath)
-
-        hdu = hlist[0]
-        if self.region:
-            data = getdata(imagepath, region=self.region, skip=self.skip, ext=0)
+        # read the image, or just the region of it
+        data, header = read_region(imagepath, region=self.region, skip=self.skip)
 
-        else:
-            data = hdu.data
-            
-        chip_id = int(hdu.header.get('CCDID', default=len(self.datacube)))
+        chip_id = int(header.get('CCDID', default=len(self.datacube)))
         self.datacube.append((chip_id, data))
 
-        hlist.close()
-
     # ***********
     def prepare_image(self, data):
         """
@@ -84,11 +76,11 @@ class ImageThumb:
 
         """
         # convert the data to the requested image format
-        im = Image.fromarray(data.astype(np.uint8), mode='L')
+        im = Image.fromarray(data.astype(np.uint8, copy=False), mode='L')
 
         if self.grow < 1.0:
             # shrink image
-            filt = Image.ANTIALIAS
+            filt = Image.LANCZOS
         else:
             # grow image
             filt = Image.NEAREST
@@ -134,35 +126,38 @@ class ImageThumb:
 
 
 # ************************************************************
-def getsky(data):
+def getsky(data, nsample=None):
     """
     Determine the sky parameters for a FITS data extension.
 
     data -- array holding the image data
+    nsample -- number of pixels to estimate them from
+               (default settings.THUMBNAIL_SKY_SAMPLE_SIZE)
+
+    The pixels are sampled at a fixed stride from a random start, with
+    the stride made coprime with the row length so the sample covers
+    every column, and the sky is their sigma clipped mean and deviation.
     """
 
     # maximum number of interations for mean,std loop
     maxiter = 30
 
     # maximum number of data points to sample
-    maxsample = 10000
-
-    # size of the array
-    ny, nx = data.shape
-
-    # how many sampels should we take?
-    if data.size > maxsample:
-        nsample = maxsample
-    else:
-        nsample = data.size
-
-    # create sample indicies
-    xs = np.random.uniform(low=0, high=nx, size=nsample).astype('L')
-    ys = np.random.uniform(low=0, high=ny, size=nsample).astype('L')
-
-    # sample the data
-    sample = data[ys, xs].copy()
-    sample = sample.reshape(nsample)
+    if nsample is None:
+        nsample = THUMBNAIL_SKY_SAMPLE_SIZE
+
+    # how many samples should we take, and how far apart?
+    nsample = max(1, min(nsample, data.size))
+    step = data.size // nsample
+    while step > 1 and math.gcd(step, data.shape[-1]) != 1:
+        step -= 1
+    start = np.random.randint(data.size - step * (nsample - 1))
+
+    # sample the data, only copying out the sampled pixels
+    sample = data.flat[np.arange(start, start + step * nsample, step)].astype(np.float64)
+    sample = sample[np.isfinite(sample)]
+    if not sample.size:
+        return 0.0, 1.0
 
     # determine the clipped mean and standard deviation
     mean = sample.mean()
@@ -172,10 +167,7 @@ def getsky(data):
     while oldsize != sample.size and niter < maxiter:
         niter += 1
         oldsize = sample.size
-        wok = (sample < mean + 3 * std)
-        sample = sample[wok]
-        wok = (sample > mean - 3 * std)
-        sample = sample[wok]
+        sample = sample[np.abs(sample - mean) < 3 * std]
         mean = sample.mean()
         std = sample.std()
 
@@ -183,7 +175,7 @@ def getsky(data):
 
 
 # ************************************************************
-def make_depth_256(data, sky=None, sig=None, depth=256, zerosig=-1, spansig=6):
+def make_depth_256(data, sky=None, sig=None, depth=256, zerosig=-1, spansig=6, overwrite=False, out=None):
     """
     Convert image to 256 colors.
 
@@ -193,8 +185,11 @@ def make_depth_256(data, sky=None, sig=None, depth=256, zerosig=-1, spansig=6):
     * sig). If optional sky and sig keywords are not set, they are
     calculated using getsky(data)
 
-   """
-    data = data.astype(np.float64)
+    The data are scaled as float64, as they always have been, in a single
+    working array, which is data itself if it is float64 and overwrite is
+    set, and then written into out (a new uint8 array if not given), which
+    is returned.
+    """
     if sky is None or sig is None:
         # get the scaling parameters
         sky2, sig2 = getsky(data)
@@ -206,237 +201,109 @@ def make_depth_256(data, sky=None, sig=None, depth=256, zerosig=-1, spansig=6):
     # set the color range
     zero = sky + zerosig * sig
     span = spansig * sig
+    if not span or not np.isfinite(span):
+        span = 1.0
+
+    if overwrite and data.dtype == np.float64 and data.flags.writeable:
+        work = data
+    else:
+        work = np.empty(data.shape, dtype=np.float64)
 
     # scale the data to the requested display values
     # greys
-    data -= zero
-    data *= (depth - 1) / span
+    np.subtract(data, zero, out=work, casting='unsafe')
+    work *= (depth - 1) / span
 
-    # black
-    w = data < 0
-    data[w] = 0
+    # black, including blank pixels (fmax ignores NaN)
+    np.fmax(work, 0, out=work)
 
     # white
-    w = data > (depth - 1)
-    data[w] = (depth - 1)
-
-    data += 256 - depth
+    np.minimum(work, depth - 1, out=work)
 
-    return data
+    work += 256 - depth
 
+    if out is None:
+        out = np.empty(data.shape, dtype=np.uint8)
+    # truncates like astype
+    np.copyto(out, work, casting='unsafe')
 
-# ************************************************************
-DATATYPES = {}
-class intdata:
-    type = 'i'
-    nbytes = 2
-    format = 'h'
-DATATYPES[16] = intdata
-class floatdata:
-    type = 'f'
-    nbytes = 4
-    format = 'f'
-DATATYPES[32] = floatdata
-class floatdata64:
-    type = 'f'
-    nbytes = 4
-    format = 'f'
-DATATYPES[64] = floatdata64
-
-BLOCKSIZE = 2880 # FITS standard
+    return out
 
 
-# ************************************************************
-def gethead(filename, fp=None, ext=0):
+# ***************************************************************************
+def _image_hdu(hlist):
     """
-    Read a FITS header and return import keywords and data section index.
+    Return the first 2D image extension, which is extension 1 in a
+    tile-compressed (fpack) file
     """
+    for hdu in hlist:
+        if hdu.is_image and len(hdu.shape) >= 2:
+            return hdu
+    raise ValueError('No image data in {}'.format(hlist.filename()))
 
-    # get the file pointer
-    if fp:
-        f = fp
-    else:
-        f=open(filename, 'rb')
-
-    nx = 0
-    ny = 0
-    datasize = 0
-    for ex in range(ext + 1):
-        # jump to the next header
-        f.seek(nx * ny * datasize, 1)
-        pos = f.tell()
-        if pos % BLOCKSIZE != 0:
-            shift = BLOCKSIZE - (pos % BLOCKSIZE)
-            f.seek(shift, 1)
-
-        # read in the header
-        header = {}
-        line=f.read(80).decode('UTF-8') # first line
-        while line[:3] != "END":
-            key = line[:8].strip()
-            val = line[9:].split('/')[0].strip()
-            header[key] = val
-
-            # read the next line
-            line=f.read(80).decode('UTF-8')
-
-
-        if 'NAXIS1' in header.keys():
-            nx = int(header['NAXIS1'])
-        else:
-            nx = 0
-        if 'NAXIS2' in header.keys():
-            ny = int(header['NAXIS2'])
-        else:
-            ny = 0
-        if 'BITPIX' in header.keys():
-            datasize = abs(int(header['BITPIX']))/8
-        else:
-            datasize = 0
-
-        # jump to the start of the data section
-        pos = f.tell()
-        if pos % BLOCKSIZE != 0:
-            shift = BLOCKSIZE - (pos % BLOCKSIZE)
-            f.seek(shift, 1)
-        startpos = f.tell()
-
-    # close file if opened locally
-    if not fp: f.close()
-
-    return (startpos, header)
 
-
-# ***************************************************************************
-def getdata(filename, region=None, skip=0, ext=0):
+def read_region(filename, region=None, skip=0):
     """
-    Read out a sub section of data from a FITS file
+    Read a sub section of the image data and the header from a FITS file
 
-    filename  full path to the FITS file.
-    region    subsection to extract [x1, x2, y1, y2]
+    filename  full path to the FITS file, plain or tile-compressed (.fz)
+    region    subsection to extract [x1, x2, y1, y2], clipped to the image
     skip      integer of rows, columns to skip between reads
+
+    Only the requested rows are read from uncompressed files, and only the
+    tiles that overlap the region are decompressed from compressed ones.
     """
+    with fits.open(filename, memmap=True) as hlist:
+        hdu = _image_hdu(hlist)
+        header = hdu.header.copy()
+        ny, nx = hdu.shape[-2:]
 
-    # get the file pointer
-    f=open(filename, 'rb')#,errors='ignore')
+        # set the region to the full frame if not specified
+        if region is None:
+            region = [0, nx-1, 0, ny-1]
+        x1, x2, y1, y2 = region
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2, y2 = min(x2, nx-1), min(y2, ny-1)
 
-    # read in the header
-    startpos, header = gethead(filename, fp=f, ext=ext)
+        # the section copies the data out of the file, so it outlives it
+        data = hdu.section[y1:y2+1, x1:x2+1]
 
-    # grab the keywords necessary to parse the data
-    nx = int(header['NAXIS1'])
-    ny = int(header['NAXIS2'])
-    bitpix = abs(int(header['BITPIX']))
-    if 'BZERO' in header.keys():
-        bzero = float(header['BZERO'])
-    else:
-        bzero = None
-    if 'BSCALE' in header.keys():
-        bscale = float(header['BSCALE'])
-    else:
-        bscale = None
-
-    # set the data type to read
-    datatype = DATATYPES[bitpix]
-
-    # set the region to the full frame if not specified
-    if region == None:
-        region = [0, nx-1, 0, ny-1]
-
-    # initalize the subarray
-    x1, x2, y1, y2 = region
-    if x1 < 0: x1 = 0
-    if y1 < 0: y1 = 0
-    if x2 >= nx: x2 = nx-1
-    if y2 >= ny: y2 = ny-1
-    nx2 = int(round((x2 - x1) / (skip + 1) + 1))
-    ny2 = int(round((y2 - y1) / (skip + 1) + 1))
-    section = np.zeros((ny2, nx2), dtype=datatype.type)   #### fix! ####
-
-    # read in a continuous line and then throw away any skipped columns
-    fmt = "%s%dx" % (datatype.format, skip * datatype.nbytes)
-    fmt = '>' + (fmt * nx2)
-    buffsize = nx2 * (1 + skip) * datatype.nbytes
-    jumpsize = nx * (1 + skip) * datatype.nbytes
-    
-    # read in the sub array
-    f.seek(startpos)
-
-    # jump to the first section column
-    f.seek((nx * y1 + x1) * datatype.nbytes, 1)
-    for j in range(ny2):
-        pos = f.tell()
-
-        # read in the data
-        section[j, :] = unpack(fmt, f.read(buffsize))
-
-        # jump to the next row
-        f.seek(pos + jumpsize, 0)
-
-    # we're done reading the file
-    f.close()
-
-    # scale the data as necessary
-    try:
-        if bscale: section *= bscale
-        if bzero: section += bzero
-    except:
-        if bscale: section *= int(bscale)
-        if bzero: section += int(bzero)
-
-    return section
+    if skip:
+        data = data[::skip+1, ::skip+1]
+    return data, header
 
 
 # ***************************************************************************
-def make_thumb(files, grow=1.0, sky=None, sig=None, x=900, y=900, width=250, height=250, ticks=False, spansig=4, skip=0, fixscale=None):
+def render_thumb(filename, grow=1.0, sky=None, sig=None, x=900, y=900, width=250, height=250, ticks=False, spansig=4, skip=0):
     """
-    Make thumbnails from a FITS image
+    Render the thumbnail of one FITS image as an RGB PIL image
     """
     region = [round(x-(width/grow)), round(x+(width/grow)), round(y-(height/grow)), round(y+(height/grow))]
-    # make the thumbnails
-    outfiles = []
-    for filename in files:
-        # See if fits file needs to be funpacked
-        with tempfile.TemporaryDirectory() as tmpdir:
-            tmpfile = os.path.join(tmpdir, os.path.basename(filename))
-            if os.path.exists(filename):
-                tmpfile = filename
-            else:
-                r = os.system(f'funpack -O "{tmpfile}" "{filename}.fz"')
+    # Compressed images are read in place
+    if not os.path.exists(filename) and os.path.exists(filename + '.fz'):
+        filename += '.fz'
 
-            # load in the image data
-            thumb = ImageThumb(tmpfile, skip=skip, grow=grow, verbose=True, region=region)
-            data = thumb.datacube[0][1].copy()
-            data = make_depth_256(data, sky=thumb.sky, sig=thumb.sig, zerosig=0, spansig=spansig)
+    # load in the image data
+    thumb = ImageThumb(filename, skip=skip, grow=grow, verbose=True, region=region)
+    # the cutout is read into its own array, so it is scaled in place
+    data = make_depth_256(thumb.datacube[0][1], sky=thumb.sky, sig=thumb.sig, zerosig=0, spansig=spansig, overwrite=True)
 
-            im = thumb.prepare_image(data).convert('RGB')
+    im = thumb.prepare_image(data).convert('RGB')
 
-            ### Do rotations and reflections here
+    ### Do rotations and reflections here
 
-            ### Add crosshair
-            if ticks:
-                x1, x2, y1, y2 = region
-                xoff = -0.5
-                yoff = 1.0
+    ### Add crosshair
+    if ticks:
+        x1, x2, y1, y2 = region
+        xoff = -0.5
+        yoff = 1.0
 
-                x_new = int(round((x + xoff - max([0, x1])) * grow))
-                y_new = int(round((min([y2, 4096]) - y + yoff) * grow))
-                
-                draw = ImageDraw.Draw(im)
-                draw.line((x_new,y_new+7,x_new,y_new+25), fill='white')
-                draw.line((x_new-7,y_new,x_new-25,y_new), fill='white')
-
-            # make the thumbs
-            if grow == 1.0 and not sig:
-                newfile = tmpfile.split('/')[-1].replace('.fits', '.webp')
-            else:
-                newfile = tmpfile.split('/')[-1].replace('.fits', 'grow{}sig{}.webp'.format(grow, sig))
-            outfile = os.path.join(settings.THUMB_DIR,newfile)
-            logger.info(f'out file {outfile}')
-            f = open(outfile, 'wb')
-            im.save(f, 'WEBP')
-            f.close()
+        x_new = int(round((x + xoff - max([0, x1])) * grow))
+        y_new = int(round((min([y2, 4096]) - y + yoff) * grow))
+        
+        draw = ImageDraw.Draw(im)
+        draw.line((x_new,y_new+7,x_new,y_new+25), fill='white')
+        draw.line((x_new-7,y_new,x_new-25,y_new), fill='white')
 
-        outfiles.append(newfile)
+    return im
 
-    return outfiles
@@ -0,0 +1,105 @@
+"""
+Array time conversions for the light curve plots.
+
+Timestamps are handled as naive UTC datetime64[us] arrays (the layout
+load_photometry returns) and converted to MJD, JD, ISO strings or days ago
+with a single NumPy expression per array, rather than one astropy Time per
+point. Like astropy's UTC MJD, days are taken to be 86400 s long, so leap
+seconds are ignored.
+"""
+import datetime
+
+import numpy as np
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+MJD_EPOCH = np.datetime64('1858-11-17T00:00:00', 'us')
+MJD_TO_JD = 2400000.5
+_DAY = np.timedelta64(86400 * 10**6, 'us')
+
+
+def _naive_utc(t):
+    if isinstance(t, datetime.datetime) and t.tzinfo is not None:
+        return t.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return t
+
+
+def to_datetime64(times):
+    """
+    Returns times (datetime64 values, naive UTC or aware datetimes,
+    or ISO strings) as a naive UTC datetime64[us] array
+    """
+    if isinstance(times, np.ndarray) and np.issubdtype(times.dtype, np.datetime64):
+        return times.astype('datetime64[us]')
+    if isinstance(times, (datetime.datetime, np.datetime64, str)):
+        times = [times]
+    return np.array([_naive_utc(t) for t in times], dtype='datetime64[us]')
+
+
+def utcnow():
+    return np.datetime64(datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None), 'us')
+
+
+def mjd(times):
+    return (to_datetime64(times) - MJD_EPOCH) / _DAY
+
+
+def jd(times):
+    return mjd(times) + MJD_TO_JD
+
+
+def days_ago(times, now=None):
+    """
+    Returns the days elapsed between times and now (default: the current time)
+    """
+    if now is None:
+        now = utcnow()
+    return (to_datetime64(now)[0] - to_datetime64(times)) / _DAY
+
+
+def from_mjd(mjds):
+    """
+    Returns a datetime64[us] array from MJDs, which may be numbers or strings
+    """
+    mjds = np.asarray(mjds, dtype=float)
+    return MJD_EPOCH + np.round(mjds * 86400e6).astype('i8').astype('timedelta64[us]')
+
+
+def from_jd(jds):
+    return from_mjd(np.asarray(jds, dtype=float) - MJD_TO_JD)
+
+
+def from_days_ago(days, now=None):
+    if now is None:
+        now = utcnow()
+    days = np.asarray(days, dtype=float)
+    return to_datetime64(now)[0] - np.round(days * 86400e6).astype('i8').astype('timedelta64[us]')
+
+
+def isot(times):
+    """
+    Returns ISO strings like 2024-05-21T04:12:30.000, as Time(...).isot
+    """
+    return np.datetime_as_string(to_datetime64(times), unit='ms')
+
+
+def iso(times):
+    """
+    Returns ISO strings like 2024-05-21 04:12:30.000, as Time(...).iso
+    """
+    return np.char.replace(isot(times), 'T', ' ')
+
+
+def mdy(times):
+    """
+    Returns dates as MM/DD/YYYY strings
+    """
+    times = to_datetime64(times)
+    years = times.astype('datetime64[Y]')
+    months = times.astype('datetime64[M]')
+    year = (years.astype('i8') + 1970).astype(str)
+    month = np.char.zfill(((months - years).astype('i8') + 1).astype(str), 2)
+    day = np.char.zfill(((times.astype('datetime64[D]') - months).astype('i8') + 1).astype(str), 2)
+    return np.char.add(np.char.add(np.char.add(np.char.add(month, '/'), day), '/'), year)
@@ -1,6 +1,3 @@
-from sqlalchemy import create_engine, pool
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.automap import automap_base
 from contextlib import contextmanager
 
 from dateutil.parser import parse
@@ -12,6 +9,8 @@ from django.conf import settings
 from django.core.exceptions import NON_FIELD_ERRORS
 from django.utils import timezone
 
+from custom_code import snex1
+
 import logging
 
 logger = logging.getLogger(__name__)
@@ -57,21 +56,9 @@ def powers_of_two(num):
 
 @contextmanager
 def _get_session(db_address):
-    Base = automap_base()
-    engine = create_engine(db_address, poolclass=pool.NullPool)
-    Base.metadata.bind = engine
-
-    db_session = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
-    session = db_session()
-
-    try:
+    ### Pooled session from the process-wide SNEx1 gateway
+    with snex1.session_scope(db_address) as session:
         yield session
-        session.commit()
-    except:
-        session.rollback()
-        raise
-    finally:
-        session.close()
 
 def update_permissions(groupid, permission, obj, snex1_groups):
     """
@@ -93,6 +80,20 @@ def update_permissions(groupid, permission, obj, snex1_groups):
             snex2_group = Group.objects.filter(name=g_name).first()
             assign_perm(permission, snex2_group, obj)
 
+def bulk_update_permissions(groupid, permission, queryset, snex1_groups):
+    """
+    Same as update_permissions, but assigns the permission on every
+    object of queryset with one bulk insert per group
+    """
+
+    target_groups = powers_of_two(groupid)
+
+    for g_name, g_id in snex1_groups.items():
+        if g_id in target_groups:
+            snex2_group = Group.objects.filter(name=g_name).first()
+            if snex2_group is not None:
+                assign_perm(permission, snex2_group, queryset)
+
 TARGET_CONTENT_TYPES = (('custom_code', 'snextarget'), ('tom_targets', 'target'))
 
 def get_target_permission_groups(target_id):
@@ -227,19 +228,8 @@ def _format_prefixed_name_for_create(canonical_name: str) -> str:
 
 def _return_session(db_address=settings.SNEX1_DB_URL):
     ### This one is not run within a with loop, must be closed manually
-    Base = automap_base()
-    engine = create_engine(db_address, poolclass=pool.NullPool)
-    Base.metadata.bind = engine
-
-    db_session = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
-    session = db_session()
-
-    return session
+    return snex1.new_session(db_address)
 
 def _load_table(tablename, db_address):
-    Base = automap_base()
-    engine = create_engine(db_address, poolclass=pool.NullPool)
-    Base.prepare(engine, reflect=True)
-
-    table = getattr(Base.classes, tablename)
-    return(table)
+    ### The schema is only reflected once per process
+    return snex1.get_table(tablename, db_address)
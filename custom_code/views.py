@@ -1,9 +1,9 @@
-import base64
 import json
 import os
 from datetime import date, datetime, timedelta
 from io import BytesIO, StringIO
 import zipfile
+import numpy as np
 import requests
 from astropy import units as u
 from astropy.coordinates import SkyCoord
@@ -15,11 +15,12 @@ from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.models import Group, User
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.exceptions import SuspiciousFileOperation
 from django.core.files.base import ContentFile
 from django.core.cache import cache
 from django.db.models import Count, DateTimeField, Exists, ExpressionWrapper, F, FloatField, OuterRef, Q, Subquery, Sum
 from django.db.models.fields.json import KeyTextTransform
-from django.db.models.functions import Cast
+from django.db.models.functions import Cast, Coalesce
 from django.shortcuts import redirect, render, get_object_or_404
 from django.http import HttpResponse, JsonResponse, HttpResponseRedirect, FileResponse, HttpResponseBadRequest, HttpResponseForbidden, QueryDict, Http404
 from django.views.decorators.http import require_GET
@@ -29,6 +30,9 @@ from django.views.generic.edit import FormView
 from django.views.generic.detail import DetailView
 from django.urls import reverse, reverse_lazy
 from django.template.loader import render_to_string
+from django.templatetags.static import static
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
 from django.utils import timezone
 from django.views.decorators.http import require_http_methods
 from django.views.generic.base import RedirectView, TemplateView
@@ -56,12 +60,17 @@ from custom_code.facilities.soar_facility import user_can_access_soar
 from custom_code.filters import BrokerTargetFilter, CustomTargetFilter, TNSTargetFilter
 from custom_code.forms import CustomDataProductUploadForm, CustomTargetCreateForm, PapersForm, PhotSchedulingForm, ReferenceStatusForm, SNEx2RegistrationApprovalForm, SNEx2UserCreationForm, SpecSchedulingForm
 from custom_code.hooks import _get_tns_params, get_standards_from_snex1, get_unreduced_spectra
+from custom_code.names import EXACT, cross_match_names, resolve_target_name
+from custom_code.photometry import load_photometry, photometry_for_user
+from custom_code.spatial import cone_search
+from custom_code.spectra import spectrum_arrays
+from custom_code import times
 from custom_code.models import BrokerTarget, InterestedPersons, Papers, ReducedDatumExtra, ScienceTags, TargetTags, TNSTarget
 from custom_code.management.commands.ingest_ztf_data import get_ztf_data
 from custom_code.processors.data_processor import run_custom_data_processor
 from custom_code.scheduling import cancel_observation, change_obs_from_scheduling, get_proposal_choices, save_comments
 from custom_code.templatetags import custom_code_tags
-from custom_code.thumbnails import make_thumb
+from custom_code import thumbnail_store
 from custom_code.utils import _normalize_view_object_name, _format_prefixed_name_for_create, format_form_errors, get_target_permission_groups
 import logging
 from urllib.parse import quote_plus
@@ -71,6 +80,9 @@ logger = logging.getLogger(__name__)
 ## debug
 logger.setLevel(logging.DEBUG) 
 
+# Matches listed by the name search box, best first (the old query listed all of them)
+NAME_SEARCH_LIMIT = getattr(settings, 'NAME_SEARCH_LIMIT', 100)
+
 # Create your views here.
 
 def make_coords(ra, dec):
@@ -195,7 +207,7 @@ def target_redirect_view(request):
             ra = float(ra)
             dec = float(dec)
 
-        target_match_list = Target.objects.filter(ra__gte=ra-radius, ra__lte=ra+radius, dec__gte=dec-radius, dec__lte=dec+radius)
+        target_match_list = cone_search(Target.objects.all(), ra, dec, radius)
 
         if len(target_match_list) == 1:
             target_id = target_match_list[0].id
@@ -209,31 +221,19 @@ def target_redirect_view(request):
     else:
         # Name resolution mode
         original_clean = (search_entry or '').strip()
-        original_compact = original_clean.replace(' ', '')
 
         canonical = _normalize_view_object_name(search_entry)
 
-        candidates = set()
-        if original_clean:
-            candidates.add(original_clean)
-        if original_compact:
-            candidates.add(original_compact)
-        if canonical:
-            candidates.add(canonical)
-            candidates.add(_format_prefixed_name_for_create(canonical))
-            # Allow matching when user enters just the year+label (e.g. `2024ggi`)
-            if canonical.upper().startswith('SN') or canonical.upper().startswith('AT'):
-                candidates.add(canonical[2:])
-
-        match_q = Q()
-        for c in candidates:
-            if c:
-                match_q |= Q(name__icontains=c) | Q(aliases__name__icontains=c)
-
-        target_match_list = Target.objects.filter(match_q).distinct()
+        # Exact matches rank first, so an exact name or alias of a single
+        # target wins over longer names that merely contain it
+        matches = resolve_target_name(original_clean, limit=2)
+        exact_matches = [match for match in matches if match.rank == EXACT]
+        if len(exact_matches) == 1:
+            matches = exact_matches
+        target_match_list = [match.target_id for match in matches]
 
         if len(target_match_list) == 1:
-            target_id = target_match_list[0].id
+            target_id = target_match_list[0]
             return redirect('/targets/{}/'.format(target_id))
 
         elif len(target_match_list) > 1:
@@ -333,16 +333,38 @@ def targetlist_collapse_view(request):
 
     lightcurve_plot = custom_code_tags.lightcurve_collapse(target, user)['plot']
     spectra_plot = custom_code_tags.spectra_collapse(target, user)['plot']
-    airmass_plot = custom_code_tags.airmass_collapse(target)['figure']
 
     context = {
         'lightcurve_plot': lightcurve_plot,
         'spectra_plot': spectra_plot,
-        'airmass_plot': airmass_plot
     }
 
+    ### Pages that prefetch visibility with batch_visibility_view pass airmass=0
+    if request.GET.get('airmass', '1') != '0':
+        context['airmass_plot'] = custom_code_tags.airmass_collapse(target)['figure']
+
     return HttpResponse(json.dumps(context), content_type='application/json')
 
+
+BATCH_VISIBILITY_MAX_TARGETS = 100
+
+def batch_visibility_view(request):
+    """
+    Returns the collapsed airmass plots and the hours above airmass 1.6
+    and 2.0 at each site for a comma-separated list of target_ids,
+    computed for all of them at once
+    """
+    target_ids = [int(i) for i in request.GET.get('target_ids', '').split(',') if i.strip().isdigit()]
+    if not target_ids:
+        return HttpResponseBadRequest('No target_ids given')
+    if len(target_ids) > BATCH_VISIBILITY_MAX_TARGETS:
+        return HttpResponseBadRequest('At most {} targets can be requested at once'.format(BATCH_VISIBILITY_MAX_TARGETS))
+
+    targets = targets_for_user(request.user, Target.objects.filter(id__in=target_ids), 'view_target')
+    visibility = custom_code_tags.airmass_collapse_batch(targets)
+
+    return JsonResponse({str(target_id): data for target_id, data in visibility.items()})
+
 class CustomTargetCreateView(TargetCreateView):
 
     def get_form_class(self):
@@ -739,7 +761,9 @@ def search_name_view(request):
     logger.info("searching for {}".format(search_entry))
     context = {}
     if search_entry:
-        target_match_list = Target.objects.filter(Q(name__icontains=search_entry) | Q(aliases__name__icontains=search_entry)).distinct()
+        target_ids = [match.target_id for match in resolve_target_name(search_entry, limit=NAME_SEARCH_LIMIT)]
+        targets = Target.objects.in_bulk(target_ids)
+        target_match_list = [targets[target_id] for target_id in target_ids if target_id in targets]
 
     else:
         target_match_list = Target.objects.none()
@@ -1306,28 +1330,34 @@ class BrokerTargetView(FilterView):
             kwargs['data']['status'] = 'New'
         return kwargs
 
+    def get_queryset(self):
+        return super().get_queryset().select_related('tns_target')
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         #TNS_URL = "https://www.wis-tns.org/object/"
-        for target in context['object_list']:
+        brokertargets = list(context['object_list'])
+        existing_targets = cross_match_names(
+            [target.name for target in brokertargets] +
+            [target.tns_target.name for target in brokertargets if target.tns_target]
+        )
+        for target in brokertargets:
             target.coords = make_coords(target.ra, target.dec)
             if target.tns_target is not None:
                 target.tns_name = target.tns_target.name
 
-            targetname_matchlist = Target.objects.filter(Q(name__icontains=target.name) | Q(aliases__name__icontains=target.name)).distinct().first()
-            if target.tns_target:
-                target_tnsname_matchlist = Target.objects.filter(Q(name__icontains=target.tns_target.name) | Q(aliases__name__icontains=target.tns_target.name)).distinct().first()
+            existing_target = existing_targets.get(target.name)
+            if existing_target is None and target.tns_target:
+                existing_target = existing_targets.get(target.tns_target.name)
 
-            if targetname_matchlist:
-                target.existing_target = targetname_matchlist.id
-                target.exists = True
-            elif target.tns_target and target_tnsname_matchlist:
-                target.existing_target = target_tnsname_matchlist.id
+            if existing_target is not None:
+                target.existing_target = existing_target
                 target.exists = True
             else:
                 target.exists = False
             
         #    target.link = TNS_URL + target.name
+        context['object_list'] = context['brokertargets'] = brokertargets
         return context
 
 
@@ -1364,17 +1394,24 @@ def make_thumbnail_view(request):
     zoom = float(request.GET['zoom'])
     sigma = float(request.GET['sigma'])
 
-    if filename_dict['psfx'] < 9999 and filename_dict['psfy'] < 9999:
-        f = make_thumb([os.path.join(settings.FITS_DIR,filename_dict['filepath'].lstrip('/'),filename_dict['filename']+'.fits')], grow=zoom, spansig=sigma, x=filename_dict['psfx'], y=filename_dict['psfy'], ticks=True)
-    else:
-        f = make_thumb([os.path.join(settings.FITS_DIR,filename_dict['filepath'].lstrip('/'),filename_dict['filename']+'.fits')], grow=zoom, spansig=sigma, x=1024, y=1024, ticks=False)
-
-    with open(os.path.join(settings.THUMB_DIR,f[0]), 'rb') as imagefile:
-        b64_image = base64.b64encode(imagefile.read())
-        thumb = b64_image.decode('utf-8')
+    fits_path, params = thumbnail_store.frame_thumbnail(filename_dict['filepath'], filename_dict['filename'], filename_dict['psfx'], filename_dict['psfy'])
+    params.update({'grow': zoom, 'sigma': sigma})
+    key, thumbnail = thumbnail_store.request_thumbnail(fits_path, **params)
+
+    if thumbnail is None:
+        # Queued for the thumbnail worker, the page polls thumbnail_status_view for it
+        content_response = {'success': 'Pending',
+                            'key': key,
+                            'thumb': static('custom_code/img/thumbnail_placeholder.svg'),
+                            'telescope': filename_dict['tele'],
+                            'instrument': filename_dict['instr'],
+                            'filter': filename_dict['filter'],
+                            'exptime': filename_dict['exptime']
+                        }
+        return HttpResponse(json.dumps(content_response), content_type='application/json')
 
     content_response = {'success': 'Yes',
-                        'thumb': 'data:image/png;base64,{}'.format(thumb),
+                        'thumb': thumbnail_store.thumbnail_url(thumbnail),
                         'telescope': filename_dict['tele'],
                         'instrument': filename_dict['instr'],
                         'filter': filename_dict['filter'],
@@ -1383,6 +1420,73 @@ def make_thumbnail_view(request):
 
     return HttpResponse(json.dumps(content_response), content_type='application/json')
 
+def thumbnail_status_view(request):
+    """
+    Returns the status of the thumbnails with the given keys, with the
+    URLs of those that are ready, for pages polling for queued thumbnails
+    """
+    keys = request.GET.getlist('key')[:50]
+
+    content_response = {}
+    for key, (status, thumbnail) in thumbnail_store.thumbnail_states(keys).items():
+        content_response[key] = {'status': status}
+        if thumbnail is not None:
+            content_response[key]['thumb'] = thumbnail_store.thumbnail_url(thumbnail)
+
+    return HttpResponse(json.dumps(content_response), content_type='application/json')
+
+def _image_response(request, path, content_type, etag, cache_control, accel_redirect=None):
+    """
+    Returns the image at path, or Not Modified if the browser has this
+    version of it, handing the file to nginx if it has an internal
+    location for it (accel_redirect)
+    """
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        if accel_redirect:
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = accel_redirect
+        else:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    return response
+
+@login_required
+def thumbnail_view(request, key):
+    """
+    Serves a stored thumbnail. Its URL names the rendering (see
+    thumbnail_store.thumbnail_url), so browsers may keep it for good
+    """
+    thumbnail = thumbnail_store.lookup_key(key)
+    if thumbnail is None:
+        raise Http404('Thumbnail not found')
+
+    accel_redirect = None
+    if settings.THUMBNAIL_ACCEL_REDIRECT:
+        accel_redirect = settings.THUMBNAIL_ACCEL_REDIRECT.rstrip('/') + '/' + thumbnail.path
+    return _image_response(
+        request, thumbnail_store.absolute_path(thumbnail.path), 'image/webp',
+        thumbnail_store.thumbnail_etag(thumbnail), 'private, max-age=31536000, immutable', accel_redirect
+    )
+
+@login_required
+def floyds_inbox_image_view(request, path):
+    """
+    Serves the quicklook plot of an unreduced FLOYDS spectrum, which can
+    change, so browsers revalidate it by its ETag
+    """
+    try:
+        image_path = safe_join(settings.FLOYDS_DATA_DIR, path)
+    except SuspiciousFileOperation:
+        raise Http404('Image not found')
+    if not image_path.endswith('.png') or not os.path.isfile(image_path):
+        raise Http404('Image not found')
+
+    stat = os.stat(image_path)
+    etag = '"{:x}-{:x}"'.format(stat.st_mtime_ns, stat.st_size)
+    return _image_response(request, image_path, 'image/png', etag, 'private, no-cache')
+
 def download_data_product_view(request, pk):
     dp = get_object_or_404(DataProduct, pk=pk)
     if not request.user.has_perm('tom_dataproducts.view_dataproduct', dp):
@@ -1412,12 +1516,12 @@ class BulkDownloadView(LoginRequiredMixin, View):
     def _generate_ascii(self, product):
         """Build ascii content from ReducedDatum spectrum data. Returns bytes or None."""
         rd = product.reduceddatum_set.first()
-        if not rd or not isinstance(rd.value, dict):
+        if not rd:
             return None
-        wavelength = rd.value.get('wavelength')
-        flux = rd.value.get('flux')
-        if not wavelength or not flux or len(wavelength) != len(flux):
+        wavelength, flux = spectrum_arrays(rd.value)
+        if not wavelength.size:
             return None
+        wavelength, flux = wavelength.tolist(), flux.tolist()
         lines = [f'{w} {f}' for w, f in zip(wavelength, flux)]
         return ('\n'.join(lines)).encode('utf-8')
 
@@ -1599,9 +1703,8 @@ class SNEx2SpectroscopyTNSSharePassthrough(RedirectView):
         if not datum.data_product:
             print(f"Reduced datum {datum_id} does not have an associated data product - creating it now")
             target = Target.objects.get(pk=target_id)
-            data_str = ''
-            for datapoint in datum.value.values():
-                data_str += f"{datapoint.get('wavelength')}\t{datapoint.get('flux')}\n"
+            wavelength, flux = spectrum_arrays(datum.value)
+            data_str = ''.join(f"{w}\t{f}\n" for w, f in zip(wavelength.tolist(), flux.tolist()))
             dp_name = f"spectra_{datum_id}_{datum.timestamp.strftime('%Y_%m_%d_%H_%M_%S')}.txt"
             dp = DataProduct.objects.create(target=target, product_id=dp_name, data_product_type='spectroscopy')
             dp.data.save(dp_name, ContentFile(data_str))
@@ -1630,10 +1733,7 @@ class FloydsInboxView(TemplateView):
             current_dict['path'] = paths[i]
             current_dict['filename'] = filenames[i]
             
-            with open(imgpaths[i], 'rb') as imagefile:
-                b64_image = base64.b64encode(imagefile.read())
-                thumb = b64_image.decode('utf-8')
-            current_dict['img'] = 'data:image/png;base64,{}'.format(thumb) 
+            current_dict['img'] = reverse('floyds-inbox-image', kwargs={'path': os.path.relpath(imgpaths[i], settings.FLOYDS_DATA_DIR)})
             
             inbox_rows.append(current_dict)
 
@@ -1656,24 +1756,16 @@ def download_photometry_view(request, targetid):
     user = request.user
     target = Target.objects.get(id=int(targetid))
 
-    if settings.TARGET_PERMISSIONS_ONLY:
-        datums = ReducedDatum.objects.filter(target=target, data_type=settings.DATA_PRODUCT_TYPES['photometry'][0])
-
-    else:
-        datums = get_objects_for_user(user,
-                                      'tom_dataproducts.view_reduceddatum',
-                                      klass=ReducedDatum.objects.filter(
-                                        target=target,
-                                        data_type=settings.DATA_PRODUCT_TYPES['photometry'][0]))
+    photometry = load_photometry(
+        photometry_for_user(target, user).order_by('timestamp'),
+        require=('magnitude', 'error', 'filter')
+    )
+    mjds = np.round(times.mjd(photometry['timestamp']), 2)
 
-    datums = datums.order_by('timestamp')
     newfile = StringIO()
-
     newfile.write('mjd mag err filter subtracted?\n')
-
-    for d in datums:
-        if all(k in d.value.keys() for k in ['magnitude', 'error', 'filter']):
-            newfile.write('{} {} {} {} {}\n'.format(round(Time(d.timestamp).mjd, 2), d.value['magnitude'], d.value['error'], d.value['filter'], d.value.get('background_subtracted', False)))
+    for mjd, d in zip(mjds, photometry):
+        newfile.write('{} {} {} {} {}\n'.format(mjd, d['magnitude'], d['error'], d['filter'], d['background_subtracted']))
 
     response = HttpResponse(newfile.getvalue(), content_type='text/plain')
     response['Content-Disposition'] = 'attachment; filename={}.txt'.format(target.name.replace(' ',''))
@@ -1922,8 +2014,11 @@ class TargetFilteringView(FormView):
         filters = Q()
 
         # Use SNExTarget since redshift and classification are direct fields on it
-        photometry_q = Q(reduceddatum__data_type='photometry') & Q(reduceddatum__value__has_key='magnitude')
-        spectroscopy_q = Q(reduceddatum__data_type='spectroscopy')
+        # Counts and dates come from the precomputed TargetDataSummary
+        summary_counts = dict(
+            phot_count=Coalesce('data_summary__phot_count', 0),
+            spectra_count=Coalesce('data_summary__spec_count', 0),
+        )
 
         # Start with only targets the user has permission to view
         if self.request.user.is_authenticated:
@@ -1931,16 +2026,10 @@ class TargetFilteringView(FormView):
                 self.request.user,
                 'custom_code.view_target',
                 accept_global_perms=True
-            ).annotate(
-                phot_count=Count('reduceddatum', filter=photometry_q, distinct=True),
-                spectra_count=Count('reduceddatum', filter=spectroscopy_q, distinct=True),  
-            )
+            ).annotate(**summary_counts)
         else:
             # Anonymous users get empty queryset
-            qs = Target.objects.none().annotate(
-                phot_count=Count('reduceddatum', filter=photometry_q, distinct=True),
-                spectra_count=Count('reduceddatum', filter=spectroscopy_q, distinct=True),  
-            )
+            qs = Target.objects.none().annotate(**summary_counts)
 
         # name filter
         if cd.get('apply_name_filter'):
@@ -2018,69 +2107,21 @@ class TargetFilteringView(FormView):
 
             if ndays:
                 cutoff = timezone.now() - timedelta(days=ndays)
-
-                # Build dynamic kwarg for timestamp field
-                ts_kw = {f'timestamp__gte': cutoff}
-
-                # Subqueries for Exists(...)
-                recent_any_sq = ReducedDatum.objects.filter(
-                    target=OuterRef('pk'),
-                    **ts_kw
-                )
-                recent_phot_sq = ReducedDatum.objects.filter(
-                    target=OuterRef('pk'),
-                    data_type='photometry',
-                    **ts_kw
-                ).filter(value__has_key='magnitude')  # keep consistent with your photometry count
-                recent_spec_sq = ReducedDatum.objects.filter(
-                    target=OuterRef('pk'),
-                    data_type='spectroscopy',
-                    **ts_kw
-                )
-
-                # Annotate booleans once; then filter on them
-                qs = qs.annotate(
-                    has_recent_any = Exists(recent_any_sq),
-                    has_recent_phot = Exists(recent_phot_sq),
-                    has_recent_spec = Exists(recent_spec_sq),
-                )
-
-                if kind == 'any':
-                    filters &= Q(has_recent_any=True)
-                elif kind == 'phot':
-                    filters &= Q(has_recent_phot=True)
-                elif kind == 'spec':
-                    filters &= Q(has_recent_spec=True)
+                filters &= {
+                    'any':  Q(data_summary__last_datum__gte=cutoff),
+                    'phot': Q(data_summary__last_phot__gte=cutoff),
+                    'spec': Q(data_summary__last_spec__gte=cutoff),
+                }.get(kind, Q())
 
         # --- On/after (≥) ---
         if cd.get('apply_recent_date_filter'):
             kind = (cd.get('recent_date_kind') or 'any').lower()
             date_cut = cd.get('recent_date_threshold')
             if date_cut:
-                recent_any_sq = ReducedDatum.objects.filter(
-                    target=OuterRef('pk'),
-                    timestamp__date__gte=date_cut,
-                )
-                recent_phot_sq = ReducedDatum.objects.filter(
-                    target=OuterRef('pk'),
-                    data_type='photometry',
-                    timestamp__date__gte=date_cut,
-                ).filter(value__has_key='magnitude')
-                recent_spec_sq = ReducedDatum.objects.filter(
-                    target=OuterRef('pk'),
-                    data_type='spectroscopy',
-                    timestamp__date__gte=date_cut,
-                )
-
-                qs = qs.annotate(
-                    has_since_any  = Exists(recent_any_sq),
-                    has_since_phot = Exists(recent_phot_sq),
-                    has_since_spec = Exists(recent_spec_sq),
-                )
                 filters &= {
-                    'any':  Q(has_since_any=True),
-                    'phot': Q(has_since_phot=True),
-                    'spec': Q(has_since_spec=True),
+                    'any':  Q(data_summary__last_datum__date__gte=date_cut),
+                    'phot': Q(data_summary__last_phot__date__gte=date_cut),
+                    'spec': Q(data_summary__last_spec__date__gte=date_cut),
                 }[kind]
 
         # --- On/before (≤) ---
@@ -2088,74 +2129,22 @@ class TargetFilteringView(FormView):
             kind = (cd.get('recent_date_before_kind') or 'any').lower()
             date_cut = cd.get('recent_date_before_threshold')
             if date_cut:
-                recent_any_sq = ReducedDatum.objects.filter(
-                    target=OuterRef('pk'),
-                    timestamp__date__lte=date_cut,
-                )
-                recent_phot_sq = ReducedDatum.objects.filter(
-                    target=OuterRef('pk'),
-                    data_type='photometry',
-                    timestamp__date__lte=date_cut,
-                ).filter(value__has_key='magnitude')
-                recent_spec_sq = ReducedDatum.objects.filter(
-                    target=OuterRef('pk'),
-                    data_type='spectroscopy',
-                    timestamp__date__lte=date_cut,
-                )
-
-                qs = qs.annotate(
-                    has_before_any  = Exists(recent_any_sq),
-                    has_before_phot = Exists(recent_phot_sq),
-                    has_before_spec = Exists(recent_spec_sq),
-                )
                 filters &= {
-                    'any':  Q(has_before_any=True),
-                    'phot': Q(has_before_phot=True),
-                    'spec': Q(has_before_spec=True),
+                    'any':  Q(data_summary__first_datum__date__lte=date_cut),
+                    'phot': Q(data_summary__first_phot__date__lte=date_cut),
+                    'spec': Q(data_summary__first_spec__date__lte=date_cut),
                 }[kind]
 
-
         # --- Any/Last observation with apparent mag brighter than X (any filter)
-        ## TODO: this is very slow for some reason
         if cd.get('apply_mag_bright_filter'):
             mode = (cd.get('mag_bright_mode') or 'any').lower()
             X = cd.get('mag_bright_threshold')
 
             if X is not None:
-                # Base photometry queryset: has numeric magnitude in JSON
-                base_phot = ReducedDatum.objects.filter(
-                    target=OuterRef('pk'),
-                    data_type='photometry',
-                    value__has_key='magnitude',
-                )
-
-                # ANY obs: fast Exists()
                 if mode == 'any':
-                    any_bright_sq = base_phot.annotate(
-                        mag_txt=KeyTextTransform('magnitude', F('value')),
-                        mag=Cast('mag_txt', FloatField()),
-                    ).filter(mag__lt=X)
-
-                    qs = qs.annotate(has_any_bright=Exists(any_bright_sq))
-                    filters &= Q(has_any_bright=True)
-
-                # LAST obs: get latest row id, then its mag
+                    filters &= Q(data_summary__brightest_mag__lt=X)
                 else:
-                    latest_phot_id_sq = base_phot.order_by('-timestamp').values('pk')[:1]
-
-                    qs = qs.annotate(
-                        latest_phot_id=Subquery(latest_phot_id_sq)
-                    )
-
-                    last_mag_sq = ReducedDatum.objects.filter(
-                        pk=OuterRef('latest_phot_id')
-                    ).annotate(
-                        mag_txt=KeyTextTransform('magnitude', F('value')),
-                        mag=Cast('mag_txt', FloatField()),
-                    ).values('mag')[:1]
-
-                    qs = qs.annotate(last_mag=Subquery(last_mag_sq))
-                    filters &= Q(last_mag__lt=X)
+                    filters &= Q(data_summary__last_mag__lt=X)
 
 
         if cd.get('apply_proposal_filter'):
@@ -0,0 +1,196 @@
+"""
+Vectorized airmass and visibility calculations for the LCO network.
+
+Rather than building an astroplan Observer per site and transforming the
+target and the sun separately for each one, the target hour angle, target
+altitude and sun altitude are evaluated for every (target, site, time)
+combination in a single NumPy broadcast. Sun positions come from the shared
+ephemeris in custom_code.ephemeris.
+"""
+import datetime
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+from astropy import units as u
+from astropy.coordinates import FK5, SkyCoord
+from astropy.time import Time
+from tom_observations import facility
+
+from custom_code.ephemeris import sun_position
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+#Colors to match SNEx1
+SITE_COLORS = {
+    'Siding Spring': '#3366cc',
+    'Sutherland': '#dc3912',
+    'Teide': '#8c6239',
+    'Cerro Tololo': '#ff9900',
+    'McDonald': '#109618',
+    'Haleakala': '#990099'
+}
+
+Sites = namedtuple('Sites', ['facility', 'names', 'longitude', 'sin_lat', 'cos_lat'])
+
+
+@lru_cache(maxsize=None)
+def get_site_vectors(observing_facility='LCO'):
+    """
+    Returns the geodetic coordinates of the sites of an observing
+    facility as arrays, computed once per process
+    """
+    if observing_facility not in facility.get_service_classes():
+        return Sites(observing_facility, (), np.empty(0), np.empty(0), np.empty(0))
+
+    sites = facility.get_service_class(observing_facility)().get_observing_sites()
+    names = tuple(sites.keys())
+    longitude = np.radians([sites[site]['longitude'] for site in names])
+    latitude = np.radians([sites[site]['latitude'] for site in names])
+
+    return Sites(observing_facility, names, longitude, np.sin(latitude), np.cos(latitude))
+
+
+def get_time_grid(interval, start=None, duration=datetime.timedelta(days=1)):
+    """
+    Returns an astropy Time array starting at start (default now) and
+    spaced by interval minutes, matching astroplan's time_grid_from_range
+    """
+    if start is None:
+        start = datetime.datetime.utcnow()
+    start = Time(start)
+    npoints = int(np.ceil(duration.total_seconds() / (interval * 60.0)))
+
+    return start + np.arange(npoints) * interval * u.minute
+
+
+def _altitude(sin_dec, cos_dec, hour_angle, sin_lat, cos_lat):
+    return sin_lat * sin_dec + cos_lat * cos_dec * np.cos(hour_angle)
+
+
+def compute_airmass(ra, dec, time_range, sites=None, airmass_limit=3.0, sun_alt_limit=-12.0, halimit=4.8):
+    """
+    Computes the airmass of N targets at M sites over T times
+
+    Returns an array of shape (N, M, T), with NaNs wherever the target
+    is outside of (1, airmass_limit), the sun is above sun_alt_limit
+    degrees, or the absolute hour angle is above halimit hours
+    (pass halimit=None to skip the hour angle cut)
+    """
+    if sites is None:
+        sites = get_site_vectors()
+
+    ra = np.atleast_1d(np.asarray(ra, dtype=float))
+    dec = np.atleast_1d(np.asarray(dec, dtype=float))
+
+    # Precess the targets and the sun to the equinox of the grid in one
+    # transformation so the local sidereal time can be compared directly
+    # with right ascension
+    sun_ra, sun_dec = sun_position(time_range)
+    midpoint = time_range[len(time_range) // 2]
+    coords = SkyCoord(
+        np.concatenate([ra, sun_ra]), np.concatenate([dec, sun_dec]), unit='deg'
+    ).transform_to(FK5(equinox=midpoint))
+    target_coords, sun_coords = coords[:len(ra)], coords[len(ra):]
+
+    gmst = time_range.sidereal_time('mean', 'greenwich').radian
+    lst = gmst[np.newaxis, :] + sites.longitude[:, np.newaxis] # (M, T)
+
+    sun_dec = sun_coords.dec.radian[np.newaxis, :]
+    sun_sin_alt = _altitude(
+        np.sin(sun_dec), np.cos(sun_dec), lst - sun_coords.ra.radian[np.newaxis, :],
+        sites.sin_lat[:, np.newaxis], sites.cos_lat[:, np.newaxis]
+    )
+    sun_alt = np.degrees(np.arcsin(np.clip(sun_sin_alt, -1.0, 1.0)))
+
+    target_ra = target_coords.ra.radian[:, np.newaxis, np.newaxis]
+    target_dec = target_coords.dec.radian[:, np.newaxis, np.newaxis]
+    hour_angle = lst[np.newaxis, :, :] - target_ra # (N, M, T)
+    sin_alt = _altitude(
+        np.sin(target_dec), np.cos(target_dec), hour_angle,
+        sites.sin_lat[np.newaxis, :, np.newaxis], sites.cos_lat[np.newaxis, :, np.newaxis]
+    )
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        airmass = 1.0 / sin_alt
+
+    bad = (airmass >= airmass_limit) | (airmass <= 1) | (sun_alt > sun_alt_limit)[np.newaxis, :, :]
+    if halimit is not None:
+        # Wrap the hour angle into [-12, 12) hours
+        ha_hours = np.degrees(np.mod(hour_angle + np.pi, 2 * np.pi) - np.pi) / 15.0
+        bad |= np.abs(ha_hours) > halimit
+
+    airmass[bad] = np.nan
+    return airmass
+
+
+def get_24hr_visibility(ra, dec, interval, airmass_limit, sun_alt_limit=-12.0, halimit=4.8, observing_facility='LCO'):
+    """
+    Computes airmass curves for the next 24 hours at every site of
+    observing_facility
+
+    Returns the sites, the grid as datetimes and the airmass array
+    of shape (N targets, M sites, T times)
+    """
+    sites = get_site_vectors(observing_facility)
+    time_range = get_time_grid(interval)
+    time_plot = time_range.datetime
+
+    if not sites.names:
+        return sites, time_plot, np.empty((np.size(ra), 0, len(time_plot)))
+
+    airmass = compute_airmass(
+        ra, dec, time_range, sites=sites, airmass_limit=airmass_limit,
+        sun_alt_limit=sun_alt_limit, halimit=halimit
+    )
+    return sites, time_plot, airmass
+
+
+def get_sidereal_visibility(target, start_time, end_time, interval, airmass_limit, observation_facility=None):
+    """
+    Drop-in replacement for tom_observations.utils.get_sidereal_visibility
+    covering the sites of every configured facility
+
+    Returns a dictionary of '(facility) site' -> (datetimes, airmasses),
+    with None wherever the target is not observable
+    """
+    time_range = get_time_grid(interval, start=start_time, duration=end_time - start_time)
+    time_plot = time_range.datetime
+
+    visibility = {}
+    for observing_facility in facility.get_service_classes():
+        if observation_facility and observation_facility != observing_facility:
+            continue
+
+        sites = get_site_vectors(observing_facility)
+        if not sites.names:
+            continue
+
+        airmass = compute_airmass(
+            target.ra, target.dec, time_range, sites=sites, airmass_limit=airmass_limit,
+            sun_alt_limit=-18.0, halimit=None
+        )
+        for i, site in enumerate(sites.names):
+            obj_airmass = [None if np.isnan(x) else float(x) for x in airmass[0, i]]
+            visibility['({}) {}'.format(observing_facility, site)] = (time_plot, obj_airmass)
+
+    return visibility
+
+
+def hours_above_airmass(airmass, interval, threshold):
+    """
+    Hours each curve spends below the given airmass threshold
+
+    airmass is an array of shape (..., T) on a grid spaced by interval
+    minutes. Each contiguous stretch of k good points counts as k - 1
+    intervals, so a night that wraps around the end of the 24 hour
+    window is measured as two separate pieces
+    """
+    with np.errstate(invalid='ignore'):
+        above = airmass < threshold
+    npoints = above.sum(axis=-1)
+    starts = above[..., 0].astype(int) + (above[..., 1:] & ~above[..., :-1]).sum(axis=-1)
+
+    return np.round((npoints - starts) * interval / 60.0, 1)
@@ -28,6 +28,7 @@ THUMB_DIR = os.path.join(DATA_DIR,'thumbs')
 FITS_DIR = os.path.join(DATA_DIR,'fits')
 LSC_DIR = os.path.join(SN_DIR,'data','lsc')
 FLOYDS_DIR = os.path.join(SN_DIR,'data','floyds')
+FLOYDS_DATA_DIR = os.getenv('FLOYDS_DATA_DIR', '/snex2/data/floyds')
 
 OBS_WINDOW_MINIMUM = 24 # Minimum observation window in hours
 
@@ -507,14 +508,54 @@ SNEX1_DB_NAME = os.getenv('SNEX1_DB_NAME', 'supernova')
 SNEX1_DB_USER = os.getenv('SNEX1_DB_USER', '')
 SNEX1_DB_PASSWORD = os.getenv('SNEX1_DB_PASSWORD', '')
 SNEX1_DB_URL = f'mysql+pymysql://{SNEX1_DB_USER}:{SNEX1_DB_PASSWORD}@{SNEX1_DB_HOST}:{SNEX1_DB_PORT}/{SNEX1_DB_NAME}?charset=utf8&use_unicode=1'
+# Per gunicorn worker; gevent greenlets share the pool
+SNEX1_DB_POOL = {
+    'pool_size': int(os.getenv('SNEX1_DB_POOL_SIZE', 5)),
+    'max_overflow': int(os.getenv('SNEX1_DB_MAX_OVERFLOW', 10)),
+}
+
+# Layout of spectrum arrays in ReducedDatum.value: 'list' or 'base64' (float32)
+SPECTRUM_ENCODING = os.getenv('SPECTRUM_ENCODING', 'list')
+
+# Most photometry points sent per light curve figure, zooming in refines the visible window
+LIGHTCURVE_MAX_POINTS = int(os.getenv('LIGHTCURVE_MAX_POINTS', 3000))
+
+# Eviction limits of the thumbnail store in THUMB_DIR, see the gc_thumbnails command
+THUMBNAIL_STORE_MAX_BYTES = int(os.getenv('THUMBNAIL_STORE_MAX_MB', 5 * 1024)) * 1024**2
+THUMBNAIL_STORE_MAX_AGE_DAYS = int(os.getenv('THUMBNAIL_STORE_MAX_AGE_DAYS', 180))
+# Renders of a queued thumbnail tried by the thumbnail_worker command before giving up
+THUMBNAIL_JOB_MAX_ATTEMPTS = int(os.getenv('THUMBNAIL_JOB_MAX_ATTEMPTS', 3))
+# Seconds before the first retry of a failed render (doubling after that), and before
+# a thumbnail that failed every attempt is queued again by the next page that shows it
+THUMBNAIL_JOB_RETRY_DELAY = int(os.getenv('THUMBNAIL_JOB_RETRY_DELAY', 60))
+THUMBNAIL_JOB_FAILED_COOLDOWN = int(os.getenv('THUMBNAIL_JOB_FAILED_COOLDOWN', 3600))
+# Pixels sampled to estimate the sky level and noise a thumbnail is scaled by
+THUMBNAIL_SKY_SAMPLE_SIZE = int(os.getenv('THUMBNAIL_SKY_SAMPLE_SIZE', 10000))
+# Internal nginx location serving THUMB_DIR (e.g. /protected-thumbs/). When set, the
+# thumbnail view only checks the login and has nginx send the file with X-Accel-Redirect
+THUMBNAIL_ACCEL_REDIRECT = os.getenv('THUMBNAIL_ACCEL_REDIRECT', '')
+
+# Most targets listed by the name search box, best matches first
+NAME_SEARCH_LIMIT = int(os.getenv('NAME_SEARCH_LIMIT', 100))
 
 CACHES = {
     'default': {
         'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'),
         'LOCATION': os.getenv('CACHE_LOCATION', 'django_cache'),
+        'OPTIONS': {
+            # Rendered plots are cached per target and group set, and spectra per datum
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 50000)),
+        },
     }
 }
 
+# Sun and moon positions shared by all visibility plots, see custom_code/ephemeris.py
+EPHEMERIS_CACHE = {
+    'resolution': 5, #minutes
+    'days': 31,
+    'shared': True,
+}
+
 PLOTLY_DASH = {
     'cache_arguments': True,
     'cache_timeout_initial_arguments': 3600,
@@ -43,6 +43,7 @@ urlpatterns = [
     path('add_tag/', add_tag_view, name='add_tag'),
     path('save_target_tag/', save_target_tag_view, name='save_target_tag'),
     path('targetlist_collapse/', targetlist_collapse_view, name='targetlist_collapse'),
+    path('batch-visibility/', batch_visibility_view, name='batch-visibility'),
     path('create-target/', CustomTargetCreateView.as_view(), name='create-target'),
     path('custom-data-upload/', CustomDataProductUploadView.as_view(), name='custom-data-upload'),
     path('save_dataproduct_groups/', save_dataproduct_groups_view, name='save_dataproduct_groups'),
@@ -73,6 +74,8 @@ urlpatterns = [
     path('targets/<int:pk>/spectrum/<int:spectrum_id>/', load_single_spectrum_view, name='load-single-spectrum'),
     path('targets/<int:pk>/spectrum/<int:spectrum_id>/interactive/', load_spectrum_interactive_view, name='load-spectrum-interactive'),
     path('make-thumbnail/', make_thumbnail_view, name='make-thumbnail'),
+    path('thumbnail-status/', thumbnail_status_view, name='thumbnail-status'),
+    path('thumbnails/<str:key>.webp', thumbnail_view, name='thumbnail'),
     path('download-fits/', download_fits_view, name='download-fits'),
     path('get-frame-ids/', get_frame_ids_view, name='get-frame-ids'),
     path('interesting-targets/', InterestingTargetsView.as_view(), name='interesting-targets'),
@@ -87,6 +90,7 @@ urlpatterns = [
     path('submit-gw-obs/', submit_galaxy_observations_view, name='submit-gw-obs'),
     path('cancel-gw-obs/', cancel_galaxy_observations_view, name='cancel-gw-obs'),
     path('floyds-inbox/', FloydsInboxView.as_view(), name='floyds-inbox'),
+    path('floyds-inbox/images/<path:path>', floyds_inbox_image_view, name='floyds-inbox-image'),
     path('nonlocalizedevents/sequence/<int:id>/obs/', EventSequenceGalaxiesTripletView.as_view(), name='nonlocalizedevents-sequence-triplets'),
     path('nonlocalizedevents/galaxies/<int:id>/obs/', GWFollowupGalaxyTripletView.as_view(), name='nonlocalizedevents-galaxies-triplets'),
     path('snex2/accounts/approve/<int:pk>/', SNEx2UserApprovalView.as_view(), name="snex2-approve-user"),